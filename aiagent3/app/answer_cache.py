@@ -0,0 +1,161 @@
+# app/answer_cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from app import metrics
+
+# ------------------------------
+# Per-tenant semantic answer cache
+# ------------------------------
+# A question whose embedding is within ANSWER_CACHE_THRESHOLD cosine similarity
+# of one answered before is served the stored answer, skipping search and the LLM.
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # seconds, 0 = no expiry
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256"))  # per tenant, 0 = disabled
+ANSWER_CACHE_MAX_TENANTS = int(os.getenv("ANSWER_CACHE_MAX_TENANTS", "1024"))
+
+
+class _Bucket:
+    """
+    One tenant's entries, all answered against the same index fingerprint.
+    """
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.entries = OrderedDict()  # entry id -> (unit vector, value, stored_at)
+        self._matrix = None
+        self._ids = None
+        self._next_id = 0
+
+    def matrix(self):
+        if self._matrix is None:
+            self._ids = list(self.entries)
+            self._matrix = np.stack([self.entries[i][0] for i in self._ids])
+        return self._ids, self._matrix
+
+    def add(self, vec, value, max_entries: int):
+        self.entries[self._next_id] = (vec, value, time.time())
+        self._next_id += 1
+        while len(self.entries) > max_entries:
+            self.entries.popitem(last=False)
+        self._matrix = None
+
+    def drop(self, entry_ids):
+        for entry_id in entry_ids:
+            self.entries.pop(entry_id, None)
+        self._matrix = None
+
+
+class AnswerCache:
+    """
+    LRU of tenants, each holding an LRU of answered questions. A tenant's
+    entries are dropped as soon as its index fingerprint changes (new
+    documents), so a cached answer never predates the content it cites.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES, max_tenants: int = ANSWER_CACHE_MAX_TENANTS):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_tenants = max_tenants
+        self._buckets = OrderedDict()  # user_id -> _Bucket
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _bucket(self, user_id: int, fingerprint, create: bool):
+        bucket = self._buckets.get(user_id)
+        if bucket is not None and bucket.fingerprint != fingerprint:
+            self._buckets.pop(user_id)
+            self.invalidations += 1
+            bucket = None
+        if bucket is None and create:
+            bucket = self._buckets[user_id] = _Bucket(fingerprint)
+            while len(self._buckets) > self.max_tenants:
+                self._buckets.popitem(last=False)
+        if bucket is not None:
+            self._buckets.move_to_end(user_id)
+        return bucket
+
+    def lookup(self, user_id: int, qvec, fingerprint):
+        """
+        Best stored answer for qvec as (value, similarity, age seconds),
+        or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        q = _unit(qvec)
+        with self._lock:
+            bucket = self._bucket(user_id, fingerprint, create=False)
+            if bucket is not None and self.ttl > 0:
+                cutoff = time.time() - self.ttl
+                bucket.drop([i for i, (_, _, stored) in bucket.entries.items() if stored < cutoff])
+            if not bucket or not bucket.entries:
+                self.misses += 1
+                return None
+            ids, matrix = bucket.matrix()
+            sims = matrix @ q
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                self.misses += 1
+                return None
+            entry_id = ids[best]
+            bucket.entries.move_to_end(entry_id)
+            _, value, stored = bucket.entries[entry_id]
+            self.hits += 1
+            return value, float(sims[best]), time.time() - stored
+
+    def store(self, user_id: int, qvec, fingerprint, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._bucket(user_id, fingerprint, create=True).add(_unit(qvec), value, self.max_entries)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            if self._buckets.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def tenant_stats(self, user_id: int) -> dict:
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            return {
+                "entries": len(bucket.entries) if bucket is not None else 0,
+                "threshold": self.threshold,
+                "ttl": self.ttl,
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tenants": len(self._buckets),
+                "entries": sum(len(b.entries) for b in self._buckets.values()),
+                "threshold": self.threshold,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+def _unit(vec) -> np.ndarray:
+    vec = np.asarray(vec, dtype="float32").ravel()
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+answer_cache = AnswerCache()
+
+
+@metrics.counter("aiagent_answer_cache_total", "Answer cache lookups.", ("result",))
+def _answer_cache_counts():
+    s = answer_cache.stats()
+    return [(("hit",), s["hits"]), (("miss",), s["misses"])]
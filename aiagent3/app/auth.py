@@ -1,19 +1,29 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from app.database import SessionLocal
+from app.database import SessionLocal, DB_ASYNC, get_async_sessionmaker
 from app.user import User
-from app.security import hash_password, verify_password, create_access_token
+from app.security import hash_password_async, verify_password_async, create_access_token, PasswordHasherBusy
 from pydantic import BaseModel
 import traceback
 
 router = APIRouter()
 
-def get_db():
+async def get_db():
+    """
+    AsyncSession when DB_ASYNC=1, otherwise a sync Session whose calls
+    find_user / save_user push onto the threadpool.
+    """
+    if DB_ASYNC:
+        async with get_async_sessionmaker()() as db:
+            yield db
+        return
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
+        await run_in_threadpool(db.close)
 
 class UserCreate(BaseModel):
     username: str
@@ -23,29 +33,68 @@ class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
 
+def _find_user_sync(db: Session, username: str):
+    return db.query(User).filter(User.username == username).first()
+
+def _save_user_sync(db: Session, db_user: User):
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    return db_user
+
+async def find_user(db, username: str):
+    if isinstance(db, Session):
+        return await run_in_threadpool(_find_user_sync, db, username)
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
+
+async def save_user(db, db_user: User):
+    if isinstance(db, Session):
+        return await run_in_threadpool(_save_user_sync, db, db_user)
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+# Password hashing runs on the bounded argon2 pool in app/security.py and
+# DB calls either on an AsyncSession or the threadpool, so neither blocks
+# the event loop
 @router.post("/register", response_model=Token)
-def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db=Depends(get_db)):
     try:
-        if db.query(User).filter(User.username == user.username).first():
+        if await find_user(db, user.username):
             raise HTTPException(status_code=400, detail="Username taken")
-        db_user = User(username=user.username, hashed_password=hash_password(user.password))
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        hashed = await hash_password_async(user.password)
+        db_user = await save_user(db, User(username=user.username, hashed_password=hashed))
         token = create_access_token({"user_id": db_user.id})
         return {"access_token": token}
+    except HTTPException:
+        raise
+    except PasswordHasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Registration failed: {e}")
 
 @router.post("/login", response_model=Token)
-def login(user: UserCreate, db: Session = Depends(get_db)):
+async def login(user: UserCreate, db=Depends(get_db)):
     try:
-        db_user = db.query(User).filter(User.username == user.username).first()
-        if not db_user or not verify_password(user.password, db_user.hashed_password):
+        db_user = await find_user(db, user.username)
+        if not db_user:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        valid, new_hash = await verify_password_async(user.password, db_user.hashed_password)
+        if not valid:
             raise HTTPException(status_code=401, detail="Invalid credentials")
+        if new_hash:
+            # Stored with older argon2 parameters
+            db_user.hashed_password = new_hash
+            await save_user(db, db_user)
         token = create_access_token({"user_id": db_user.id})
         return {"access_token": token}
+    except HTTPException:
+        raise
+    except PasswordHasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Login failed: {e}")
@@ -1,23 +1,12 @@
 # app/automation.py
-from fastapi import APIRouter, Depends, HTTPException
-from dotenv import load_dotenv
-import os
-import requests
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from .security import decode_access_token
-
-load_dotenv()
+from .sms import dispatcher, SmsQueueFull, SmsNotConfigured, valid_signature, SMS_STATUS_CALLBACK_URL
 
 router = APIRouter()
 security = HTTPBearer()
 
-# ------------------------------
-# Twilio credentials
-# ------------------------------
-TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
-TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
-TWILIO_SMS_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")  # Twilio SMS-enabled number
-
 # ------------------------------
 # JWT dependency
 # ------------------------------
@@ -42,32 +31,45 @@ def summarize_text(text: str) -> str:
 # ------------------------------
 # Endpoint: send SMS
 # ------------------------------
-@router.post("/send_sms")
+# Queued on the dispatcher in app/sms.py; poll GET /sms/{id} for delivery
+@router.post("/send_sms", status_code=202)
 def send_sms(msg: str, to_number: str, user_id: int = Depends(get_user_id)):
-    if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN or not TWILIO_SMS_NUMBER:
-        raise HTTPException(status_code=500, detail="Twilio credentials not set")
-
     # Summarize the message
     summary = summarize_text(msg)
 
-    # Prepare payload using Twilio requests pattern
-    payload = {
-        "From": TWILIO_SMS_NUMBER,
-        "To": to_number,
-        "Body": summary
-    }
-
-    url = f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
-
     try:
-        response = requests.post(url, data=payload, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN))
-        if not response.ok:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"SMS send failed: {e}")
+        message_id = dispatcher.submit(to_number, summary, user_id)
+    except SmsNotConfigured as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    except SmsQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
 
     return {
-        "status": "sent",
+        "status": "queued",
+        "id": message_id,
         "summary": summary,
-        "twilio_response": response.json()
     }
+
+@router.get("/sms/{message_id}")
+def sms_status(message_id: str, user_id: int = Depends(get_user_id)):
+    status = dispatcher.status(message_id)
+    if status is None or status["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Unknown message")
+    return status
+
+@router.get("/sms")
+def sms_stats(user_id: int = Depends(get_user_id)):
+    return dispatcher.stats()
+
+# ------------------------------
+# Twilio delivery status callback (SMS_STATUS_CALLBACK_URL)
+# ------------------------------
+@router.post("/sms/callback")
+async def sms_callback(request: Request):
+    params = {k: str(v) for k, v in (await request.form()).items()}
+    if not valid_signature(SMS_STATUS_CALLBACK_URL or str(request.url), params,
+                           request.headers.get("X-Twilio-Signature", "")):
+        raise HTTPException(status_code=403, detail="Invalid signature")
+    dispatcher.update_delivery(params.get("MessageSid", ""), params.get("MessageStatus", ""), params.get("ErrorCode"),
+                               params.get("To"))
+    return Response(status_code=204)
@@ -0,0 +1,224 @@
+# app/chunk_store.py
+import json
+import mmap
+import os
+import threading
+import numpy as np
+
+# ------------------------------
+# Append-only chunk store, readable by vector id without loading the rest
+# ------------------------------
+#   {user_id}_chunks.txt   utf-8 text of every chunk, back to back
+#   {user_id}_chunks.idx   one RECORD per chunk (row number == FAISS vector id)
+#   {user_id}_sources.json one {"doc_id", "name"} entry per document, referenced by RECORD.source;
+#                          "deleted": true tombstones a document's chunks (and vectors) in place
+RECORD = np.dtype([
+    ("offset", "<i8"),      # byte offset into the blob
+    ("length", "<i4"),      # byte length in the blob
+    ("source", "<i4"),      # index into sources.json
+    ("page", "<i4"),        # 1-based page (0 when the format has no pages)
+    ("char_start", "<i8"),  # char offsets of the chunk within its page
+    ("char_end", "<i8"),
+])
+
+
+def store_paths(directory: str, user_id: int):
+    base = os.path.join(directory, f"{user_id}_chunks")
+    return base + ".txt", base + ".idx", os.path.join(directory, f"{user_id}_sources.json")
+
+
+def store_exists(directory: str, user_id: int) -> bool:
+    return os.path.exists(store_paths(directory, user_id)[1])
+
+
+def chunk_count(directory: str, user_id: int) -> int:
+    idx_path = store_paths(directory, user_id)[1]
+    return os.path.getsize(idx_path) // RECORD.itemsize if os.path.exists(idx_path) else 0
+
+
+def _load_sources(path: str):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        sources = json.load(f)
+    # Older stores kept bare filenames
+    return [{"doc_id": None, "name": s} if isinstance(s, str) else s for s in sources]
+
+
+def _write_sources(path: str, sources):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(sources, f)
+    os.replace(tmp, path)
+
+
+def _find_source(sources, doc_id: str):
+    """
+    Index of a document by doc_id; documents stored before doc ids existed
+    are addressed by filename.
+    """
+    for i, src in enumerate(sources):
+        if src["doc_id"] == doc_id or (src["doc_id"] is None and src["name"] == doc_id):
+            return i
+    return None
+
+
+class ChunkStore:
+    """
+    Read-only view over a user's chunk store. Only the fixed-size records
+    are read up front; chunk text is sliced out of the mmap'd blob on demand.
+    close() releases the blob; a holder that reads afterwards reopens it.
+    """
+
+    def __init__(self, directory: str, user_id: int):
+        blob_path, idx_path, sources_path = store_paths(directory, user_id)
+        # Records are written after the blob, so every complete record is readable
+        n = os.path.getsize(idx_path) // RECORD.itemsize
+        # (read, not mapped: a mapping would pin a file descriptor for the life of the array)
+        self.records = np.fromfile(idx_path, dtype=RECORD, count=n)
+        self._blob_path = blob_path
+        self._lock = threading.Lock()
+        self._open_blob()
+        self.sources = _load_sources(sources_path)
+        dead = [i for i, src in enumerate(self.sources) if src.get("deleted")]
+        # Tombstoned chunk ids, sorted; searches exclude them until compaction drops the vectors
+        self.deleted_ids = np.flatnonzero(np.isin(self.records["source"], dead)).astype("int64") if dead else np.empty(0, "int64")
+
+    def _open_blob(self):
+        with open(self._blob_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            # The mapping keeps its own descriptor until close()
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def close(self):
+        with self._lock:
+            if isinstance(self._blob, mmap.mmap):
+                self._blob.close()
+            self._blob = None
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def nbytes(self) -> int:
+        # Resident cost; the blob itself lives in the OS page cache
+        return self.records.nbytes + self.deleted_ids.nbytes + 1024
+
+    @property
+    def live(self) -> int:
+        return len(self) - len(self.deleted_ids)
+
+    def deleted_mask(self) -> np.ndarray:
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.deleted_ids] = True
+        return mask
+
+    def _texts(self, ids):
+        recs = self.records[ids]
+        with self._lock:
+            if self._blob is None:
+                # Evicted from the cache while a request was still reading
+                self._open_blob()
+            blob = self._blob
+            return [
+                blob[start:start + length].decode("utf-8")
+                for start, length in zip(recs["offset"].tolist(), recs["length"].tolist())
+            ]
+
+    def get(self, chunk_id: int) -> str:
+        return self._texts([chunk_id])[0]
+
+    def get_many(self, ids):
+        return self._texts([int(i) for i in ids if 0 <= i < len(self)])
+
+    def meta(self, chunk_id: int) -> dict:
+        rec = self.records[chunk_id]
+        return {
+            "id": int(chunk_id),
+            "source": self.sources[int(rec["source"])]["name"],
+            "doc_id": self.sources[int(rec["source"])]["doc_id"],
+            "page": int(rec["page"]),
+            "char_start": int(rec["char_start"]),
+            "char_end": int(rec["char_end"]),
+        }
+
+    def documents(self):
+        """
+        Live documents with their chunk counts, in ingest order.
+        """
+        counts = np.bincount(self.records["source"], minlength=len(self.sources)) if len(self) else [0] * len(self.sources)
+        return [
+            {"doc_id": src["doc_id"] if src["doc_id"] is not None else src["name"], "name": src["name"], "chunks": int(n)}
+            for src, n in zip(self.sources, counts) if not src.get("deleted")
+        ]
+
+    def count_for(self, doc_id: str) -> int:
+        """
+        Number of chunks already stored for a document (used to resume ingest).
+        """
+        ids = [i for i, src in enumerate(self.sources) if src["doc_id"] == doc_id]
+        if not ids:
+            return 0
+        return int(np.isin(self.records["source"], ids).sum())
+
+
+def append_chunks(directory: str, user_id: int, source: str, chunks, doc_id: str = None) -> int:
+    """
+    Append chunks for one document. chunks: iterable of
+    (text, page, char_start, char_end). Documents are keyed by doc_id when
+    given, else by source filename. Returns the number of chunks written.
+    """
+    blob_path, idx_path, sources_path = store_paths(directory, user_id)
+    sources = _load_sources(sources_path)
+    key = "doc_id" if doc_id is not None else "name"
+    wanted = doc_id if doc_id is not None else source
+    # A doc_id is never reused, so an ingest still running after its delete stays tombstoned;
+    # a filename can come back as a new document
+    source_id = next(
+        (i for i, src in enumerate(sources) if src[key] == wanted and (doc_id is not None or not src.get("deleted"))),
+        None,
+    )
+    if source_id is None:
+        sources.append({"doc_id": doc_id, "name": source})
+        source_id = len(sources) - 1
+        _write_sources(sources_path, sources)
+
+    with open(blob_path, "ab") as blob:
+        offset = blob.tell()
+        data, records = [], []
+        for text, page, char_start, char_end in chunks:
+            raw = text.encode("utf-8")
+            records.append((offset, len(raw), source_id, page, char_start, char_end))
+            data.append(raw)
+            offset += len(raw)
+        blob.write(b"".join(data))
+        blob.flush()
+        os.fsync(blob.fileno())
+
+    with open(idx_path, "ab") as idx:
+        # Drop a torn record left by a crash so row numbers stay aligned
+        idx.truncate(idx.tell() - idx.tell() % RECORD.itemsize)
+        idx.write(np.array(records, dtype=RECORD).tobytes())
+        idx.flush()
+        os.fsync(idx.fileno())
+    return len(records)
+
+
+def mark_deleted(directory: str, user_id: int, doc_id: str, name: str = None) -> bool:
+    """
+    Tombstone a document. Its chunks keep their ids (and their bytes in the
+    blob); readers drop them from results. Given a name, a document with no
+    chunks yet (its ingest is still running) is recorded already deleted.
+    Returns False if there is no such live document.
+    """
+    sources_path = store_paths(directory, user_id)[2]
+    sources = _load_sources(sources_path)
+    i = _find_source(sources, doc_id)
+    if i is None and name is not None:
+        sources.append({"doc_id": doc_id, "name": name, "deleted": True})
+    elif i is None or sources[i].get("deleted"):
+        return False
+    else:
+        sources[i]["deleted"] = True
+    _write_sources(sources_path, sources)
+    return True
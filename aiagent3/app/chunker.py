@@ -0,0 +1,257 @@
+# app/chunker.py
+# Chunking stage of ingest: splits each page at paragraph and sentence
+# boundaries into ~CHUNK_SIZE-char chunks that overlap by a few trailing
+# sentences (trailing words where a run-on has to be cut), then drops near-duplicate chunks (repeated headers, footers,
+# disclaimers) by SimHash before they are embedded.
+import hashlib
+import os
+import re
+import numpy as np
+
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))  # max chunk length in characters
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "100"))  # characters of trailing sentences repeated in the next chunk
+# A chunk that is at least this full ends at a paragraph break instead of running into the next paragraph
+CHUNK_PARAGRAPH_FILL = float(os.getenv("CHUNK_PARAGRAPH_FILL", "0.5"))
+# Drop a chunk whose 64-bit SimHash is within this many bits of an earlier chunk of the document (-1 = keep all)
+CHUNK_DEDUP_DISTANCE = int(os.getenv("CHUNK_DEDUP_DISTANCE", "3"))
+# A run cut at word boundaries doesn't end in a chunk adding fewer new characters than
+# this fraction of the chunk size; they are merged into the chunk before it instead
+CHUNK_MIN_TAIL = float(os.getenv("CHUNK_MIN_TAIL", "0.2"))
+
+# Paragraph break, end of sentence or line break; a segment ends after the match
+_BREAK = re.compile(r"\n[ \t]*\n\s*|(?<=[.!?])[\"')\]]*\s+|\n\s*")
+_WORD = re.compile(r"\w+")
+# Text ending at a sentence or line boundary
+_ENDS_SENTENCE = re.compile(r"(?:[.!?][\"')\]]*\s+|\n\s*)$")
+
+
+def _segments(text: str, final: bool):
+    """
+    Split text at boundaries into (segment, ends paragraph) pairs. Returns
+    them with the number of characters consumed; unless final, the tail
+    after the last boundary is left for the next piece to continue.
+    """
+    out, pos = [], 0
+    for m in _BREAK.finditer(text):
+        if m.end() == len(text) and not final:
+            break  # the whitespace run may go on in the next piece
+        out.append((text[pos:m.end()], m.group().count("\n") >= 2))
+        pos = m.end()
+    if final and pos < len(text):
+        out.append((text[pos:], True))
+        pos = len(text)
+    return out, pos
+
+
+class _Packer:
+    """
+    Packs one page's text, fed piece by piece, into chunks:
+    (text, page, char_start, char_end), offsets relative to the page.
+    A short paragraph that already occurred in the document (a header,
+    footer or disclaimer) becomes a chunk of its own, so the Deduper can
+    drop it instead of it being embedded inside every neighbouring chunk.
+    """
+
+    def __init__(self, page, size: int, overlap: int, seen: set):
+        self.page = page
+        self.size = size
+        self.overlap = overlap
+        self.seen = seen  # normalized short paragraphs of the document so far
+        self.buf = ""  # unfinished segment, starting at page offset self.offset
+        self.offset = 0
+        self.paragraph = []  # (page offset, segment) of the current paragraph while it is short
+        self.paragraph_length = 0
+        self.long_paragraph = False
+        self.parts = []  # (page offset, text) of the pending chunk
+        self.length = 0
+        self.held = None  # last chunk cut mid-sentence, until the next one shows if it must absorb it
+
+    def feed(self, text: str, final: bool = False):
+        self.buf += text
+        segments, consumed = _segments(self.buf, final)
+        out = []
+        for segment, paragraph_end in segments:
+            out.extend(self.segment(self.offset, segment, paragraph_end))
+            self.offset += len(segment)
+        self.buf = self.buf[consumed:]
+        if len(self.buf) > 2 * self.size:
+            # No boundary in sight: pass on all but the last size chars, cut at words
+            cut = self.buf.rfind(" ", 0, len(self.buf) - self.size) + 1 or len(self.buf) - self.size
+            out.extend(self.segment(self.offset, self.buf[:cut], False))
+            self.buf, self.offset = self.buf[cut:], self.offset + cut
+        if final:
+            # The end of the page ends its last paragraph, newline or not
+            if self.paragraph:
+                out.extend(self.flush_paragraph(True))
+                self.long_paragraph = False
+            out.extend(self.emit())
+        return out
+
+    def segment(self, start: int, text: str, paragraph_end: bool):
+        self.paragraph.append((start, text))
+        self.paragraph_length += len(text)
+        if paragraph_end:
+            out = self.flush_paragraph(True)
+            self.long_paragraph = False
+            return out
+        if self.paragraph_length > self.size:
+            self.long_paragraph = True  # too long to be boilerplate
+            return self.flush_paragraph(False)
+        return []
+
+    def flush_paragraph(self, complete: bool):
+        paragraph, self.paragraph, self.paragraph_length = self.paragraph, [], 0
+        out = []
+        if complete and not self.long_paragraph:
+            key = " ".join("".join(text for _, text in paragraph).lower().split())
+            if key in self.seen:
+                out.extend(self.emit())
+                for start, text in paragraph:
+                    self.add(start, text, False)
+                return out + self.emit()
+            self.seen.add(key)
+        for i, (start, text) in enumerate(paragraph):
+            out.extend(self.add(start, text, complete and i == len(paragraph) - 1))
+        return out
+
+    def add(self, start: int, text: str, paragraph_end: bool):
+        out = []
+        while self.length + len(text.rstrip()) > self.size:
+            if self.parts and len(text) <= self.size and _ENDS_SENTENCE.search(self.parts[-1][1]):
+                # Start a new chunk at the boundary before this segment
+                out.extend(self.emit(carry=min(self.overlap, self.size - len(text))))
+                break
+            # Mid-sentence (or longer than a chunk): fill the chunk up to the last word that fits
+            room = self.size - self.length
+            cut = text.rfind(" ", 0, room + 1) + 1
+            if cut == 0:
+                if self.parts and (room == 0 or self.parts[-1][1][-1:].isspace()):
+                    out.extend(self.emit(carry=min(self.overlap, max(0, self.size - len(text)))))
+                    continue
+                cut = room  # inside a word longer than a chunk
+            self.parts.append((start, text[:cut]))
+            self.length += cut
+            out.extend(self.emit(carry=self.overlap, words=True))
+            start, text = start + cut, text[cut:]
+        if text:
+            self.parts.append((start, text))
+            self.length += len(text)
+        if paragraph_end and self.length >= self.size * CHUNK_PARAGRAPH_FILL:
+            out.extend(self.emit())
+        return out
+
+    def emit(self, carry: int = 0, words: bool = False):
+        """
+        The pending chunk, if it has any text. Keeps the trailing parts that
+        fit in carry characters as the start of the next one, or, for a chunk
+        cut mid-sentence (words), the trailing words that do. Such a chunk is
+        held back until the next one is known: if that one ends the run with
+        few new characters (CHUNK_MIN_TAIL), the two are merged.
+        """
+        parts, keep, kept = self.parts, [], 0
+        raw = "".join(text for _, text in parts)
+        if words:
+            first = raw.find(" ", max(0, len(raw) - carry - 1)) + 1
+            if 0 < first < len(raw) and raw[first:].strip():
+                keep, kept = [(parts[0][0] + first, raw[first:])], len(raw) - first
+        else:
+            for part in reversed(parts[1:]):
+                if kept + len(part[1]) > carry:
+                    break
+                keep.insert(0, part)
+                kept += len(part[1])
+        self.parts, self.length = keep, kept
+
+        text = raw.strip()
+        chunk = None
+        if text:
+            start = parts[0][0] + len(raw) - len(raw.lstrip())
+            chunk = (text, self.page, start, start + len(text))
+        out = []
+        held, self.held = self.held, None
+        if held is not None:
+            if chunk is not None and not words and chunk[2] <= held[3] and chunk[3] - held[3] < self.size * CHUNK_MIN_TAIL:
+                # A run's short remainder: extend the chunk it was cut from
+                return [(held[0] + chunk[0][held[3] - chunk[2]:], self.page, held[2], chunk[3])]
+            out.append(held)
+        if chunk is not None:
+            if words:
+                self.held = chunk
+            else:
+                out.append(chunk)
+        return out
+
+
+def iter_chunks(pieces, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP):
+    """
+    Chunk (page, text) pieces into (text, page, char_start, char_end) at
+    paragraph, sentence or line boundaries. Holds at most the unfinished
+    sentence and the pending chunk between pieces.
+    """
+    packer, seen = None, set()
+    for page, text in pieces:
+        if packer is None or page != packer.page:
+            if packer is not None:
+                yield from packer.feed("", final=True)
+            packer = _Packer(page, size, overlap, seen)
+        yield from packer.feed(text)
+    if packer is not None:
+        yield from packer.feed("", final=True)
+
+
+# ------------------------------
+# Near-duplicate elimination
+# ------------------------------
+def simhash(text: str) -> int:
+    """
+    64-bit SimHash of the text's word 3-shingles (single words for shorter texts).
+    """
+    words = _WORD.findall(text.lower())
+    if not words:
+        return 0
+    n = 3 if len(words) >= 3 else 1
+    shingles = {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+    digests = b"".join(hashlib.blake2b(s.encode(), digest_size=8).digest() for s in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1)
+    return int.from_bytes(np.packbits(bits.sum(axis=0) * 2 > len(shingles)).tobytes(), "big")
+
+
+class Deduper:
+    """
+    Remembers the SimHash of every chunk it keeps and drops a chunk within
+    `distance` bits of one of them. The 64 bits are split into distance + 1
+    bands: two hashes that close agree exactly on at least one band, so only
+    chunks sharing a band are compared.
+    """
+
+    def __init__(self, distance: int = CHUNK_DEDUP_DISTANCE):
+        self.distance = distance
+        width = 64 // (distance + 1) if distance >= 0 else 64
+        self.bands = [(i * width, 64 if i == distance else (i + 1) * width) for i in range(distance + 1)]
+        self.buckets = [{} for _ in self.bands]
+        self.kept = 0
+        self.dropped = 0
+
+    def _keys(self, h: int):
+        return [(h >> lo) & ((1 << (hi - lo)) - 1) for lo, hi in self.bands]
+
+    def is_duplicate(self, text: str) -> bool:
+        h = simhash(text)
+        keys = self._keys(h)
+        for bucket, key in zip(self.buckets, keys):
+            for other in bucket.get(key, ()):
+                if bin(h ^ other).count("1") <= self.distance:
+                    self.dropped += 1
+                    return True
+        for bucket, key in zip(self.buckets, keys):
+            bucket.setdefault(key, []).append(h)
+        self.kept += 1
+        return False
+
+    def filter(self, chunks):
+        """
+        Pass through the chunks that aren't near-duplicates of earlier ones.
+        """
+        for chunk in chunks:
+            if self.distance < 0 or not self.is_duplicate(chunk[0]):
+                yield chunk
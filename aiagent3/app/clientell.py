@@ -1,48 +1,199 @@
+import asyncio
 import os
+import random
+import time
 import typing as t
-from openai import OpenAI
 from dotenv import load_dotenv
+from app import metrics
 
 load_dotenv()
 
 key = os.getenv("OpenAI_API_KEY")
-c = OpenAI(base_url="https://openrouter.ai/api/v1",api_key=key)
-
 
+# ------------------------------
+# LLM endpoint + client tuning (point LLM_BASE_URL at a local stub for tests)
+# ------------------------------
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://openrouter.ai/api/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "mistralai/mixtral-8x7b-instruct")
+# Comma-separated models tried (or hedged) after the primary one
+LLM_FALLBACK_MODELS = [m.strip() for m in os.getenv("LLM_FALLBACK_MODELS", "").split(",") if m.strip()]
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "0.5"))  # seconds, doubled per retry, full jitter
+# Start the next fallback model if the current one hasn't answered in this many seconds (0 = off)
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
 
 Groq_API_KEY = key
 
 class LLMClient:
     """
-    Simple wrapper for OpenAI API calls.
+    Async wrapper for OpenAI-compatible chat completions with a shared HTTP
+    connection pool, a concurrency limit, jittered retries and hedged
+    requests across fallback models.
     """
 
-    def __init__(self, api_key: t.Optional[str] = None):
-        self.api_key = Groq_API_KEY
+    def __init__(
+        self,
+        api_key: t.Optional[str] = None,
+        base_url: str = LLM_BASE_URL,
+        model: str = LLM_MODEL,
+        fallback_models: t.Optional[t.List[str]] = None,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_retries: int = LLM_MAX_RETRIES,
+        hedge_after: float = LLM_HEDGE_AFTER,
+    ):
+        self.api_key = api_key or Groq_API_KEY
         if not self.api_key:
             raise ValueError("OpenAI API key not found. Set OPENAI_API_KEY in .env")
-        
-    def chat(
+        # openai/httpx take ~0.5s to import; pay it here, not at app import
+        import httpx
+        from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
+        self.retryable = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError)
+        self.model = model
+        self.fallback_models = LLM_FALLBACK_MODELS if fallback_models is None else fallback_models
+        self.max_retries = max_retries
+        self.hedge_after = hedge_after
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        )
+        # Retries are ours (with jitter and fallbacks), not the SDK's
+        self._client = AsyncOpenAI(base_url=base_url, api_key=self.api_key, http_client=self._http, max_retries=0)
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, LLM_RETRY_BASE * 2 ** attempt)
+
+    def _models(self, model: t.Optional[str]) -> t.List[str]:
+        primary = model or self.model
+        return [primary] + [m for m in self.fallback_models if m != primary]
+
+    async def _complete(self, model: str, messages: t.List[dict], temperature: float) -> str:
+        """
+        One model, retrying transient failures with jittered exponential backoff.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self._client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                )
+                return response.choices[0].message.content
+            except self.retryable:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+
+    async def chat(
         self,
         system: str = "You are a helpful AI assistant.",
         messages: t.List[dict] = None,
-        model: str ="mistralai/mixtral-8x7b-instruct",
+        model: t.Optional[str] = None,
         temperature: float = 0.2,
     ) -> t.Dict:
         """
         messages: List of dicts, e.g. [{"role":"user","content":"Hello"}]
         Returns: {"content": "..."}
+        Tries the primary model, then fallbacks. With hedging on, a fallback
+        is also started when the current model is slow; first answer wins.
         """
-       
         if messages is None:
             messages = [{"role": "user", "content": ""}]
-        response = c.chat.completions.create(
-            model=model,
-            messages=[{"role": "system", "content": system}] + messages,
-            temperature=temperature,
-        )
-        content = response.choices[0].message.content
-        return {"content": content}
-    
+        messages = [{"role": "system", "content": system}] + messages
+
+        remaining = self._models(model)
+        pending, errors = set(), []
+
+        def launch():
+            pending.add(asyncio.create_task(self._complete(remaining.pop(0), messages, temperature)))
+
+        async with self._semaphore:
+            t0 = time.perf_counter()
+            launch()
+            try:
+                while pending:
+                    timeout = self.hedge_after if self.hedge_after > 0 and remaining else None
+                    done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        launch()  # hedge
+                        continue
+                    for task in done:
+                        pending.discard(task)
+                        if task.exception() is None:
+                            metrics.observe("llm", time.perf_counter() - t0)
+                            return {"content": task.result()}
+                        errors.append(task.exception())
+                    if not pending and remaining:
+                        launch()  # fall back
+                raise errors[-1]
+            finally:
+                for task in pending:
+                    task.cancel()
+
+    async def chat_stream(
+        self,
+        system: str = "You are a helpful AI assistant.",
+        messages: t.List[dict] = None,
+        model: t.Optional[str] = None,
+        temperature: float = 0.2,
+    ) -> t.AsyncIterator[str]:
+        """
+        Same as chat(), but yields content deltas as the completion streams in.
+        Retries and fallbacks apply only until the first delta arrives.
+        """
+        if messages is None:
+            messages = [{"role": "user", "content": ""}]
+        messages = [{"role": "system", "content": system}] + messages
+
+        async with self._semaphore:
+            t0 = time.perf_counter()
+            models = self._models(model)
+            for i, name in enumerate(models):
+                for attempt in range(self.max_retries + 1):
+                    started = False
+                    try:
+                        stream = await self._client.chat.completions.create(
+                            model=name,
+                            messages=messages,
+                            temperature=temperature,
+                            stream=True,
+                        )
+                        async for event in stream:
+                            if event.choices and event.choices[0].delta.content:
+                                if not started:
+                                    metrics.observe("llm_first_token", time.perf_counter() - t0)
+                                started = True
+                                yield event.choices[0].delta.content
+                        metrics.observe("llm", time.perf_counter() - t0)
+                        return
+                    except self.retryable:
+                        if started:
+                            raise
+                        if attempt == self.max_retries:
+                            if i == len(models) - 1:
+                                raise
+                            break  # next fallback model
+                        await asyncio.sleep(self._backoff(attempt))
+
+
+_client = None
+
+def get_client() -> LLMClient:
+    """
+    Shared client, created on first use (or by the startup warm-up).
+    """
+    global _client
+    if _client is None:
+        _client = LLMClient()
+    return _client
 
-client = LLMClient()
\ No newline at end of file
+async def close_client():
+    if _client is not None:
+        await _client.aclose()
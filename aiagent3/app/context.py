@@ -0,0 +1,100 @@
+# app/context.py
+# Prompt context builder: re-ranks a wide candidate set by maximal marginal
+# relevance (retrieval relevance against redundancy between the chunks'
+# stored vectors), so overlapping or near-identical chunks don't crowd the
+# prompt, and packs them into the model's token budget.
+import math
+import os
+import numpy as np
+
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))  # 1 = relevance only, 0 = diversity only
+# Chunks at least this similar to one already picked are dropped outright
+CONTEXT_DUP_SIMILARITY = float(os.getenv("CONTEXT_DUP_SIMILARITY", "0.95"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Per-model overrides, e.g. "mistralai/mixtral-8x7b-instruct=3000,openai/gpt-4o-mini=6000"
+CONTEXT_TOKEN_BUDGETS = {
+    model.strip(): int(tokens)
+    for model, _, tokens in (item.rpartition("=") for item in os.getenv("CONTEXT_TOKEN_BUDGETS", "").split(","))
+    if model.strip()
+}
+# "chars" estimates CONTEXT_CHARS_PER_TOKEN characters per token; "tiktoken" counts exactly
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "chars")
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4"))
+
+_encoding = None
+
+
+def token_budget(model: str) -> int:
+    return CONTEXT_TOKEN_BUDGETS.get(model, CONTEXT_TOKEN_BUDGET)
+
+
+def count_tokens(text: str) -> int:
+    global _encoding
+    if CONTEXT_TOKENIZER != "tiktoken":
+        return math.ceil(len(text) / CONTEXT_CHARS_PER_TOKEN)
+    if _encoding is None:
+        try:
+            import tiktoken
+        except ImportError:
+            raise RuntimeError("CONTEXT_TOKENIZER=tiktoken needs tiktoken: pip install tiktoken")
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def _unit(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype="float32")
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def mmr_order(qvec: np.ndarray, vectors: np.ndarray, lam: float = MMR_LAMBDA,
+              dup_similarity: float = CONTEXT_DUP_SIMILARITY, relevance=None):
+    """
+    Row indices of vectors in maximal-marginal-relevance order: each pick
+    maximizes lam * rel(d) - (1 - lam) * max sim(d, picked).
+    rel is the given per-row relevance (e.g. fused retrieval scores, which
+    also credit lexical matches) rescaled to [0, 1], else the cosine
+    similarity to qvec. Near-duplicates of a picked row are left out.
+    """
+    if not len(vectors):
+        return []
+    v = _unit(vectors)
+    if relevance is None:
+        relevance = v @ _unit(qvec)
+    else:
+        relevance = np.asarray(relevance, dtype="float32")
+        spread = relevance.max() - relevance.min()
+        relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones_like(relevance)
+    pairwise = v @ v.T
+    redundancy = np.zeros(len(v), dtype="float32")
+    left = np.ones(len(v), dtype=bool)
+    order = []
+    while left.any():
+        score = np.where(left, lam * relevance - (1 - lam) * redundancy, -np.inf)
+        best = int(np.argmax(score))
+        order.append(best)
+        left[best] = False
+        redundancy = np.maximum(redundancy, pairwise[best])
+        left &= pairwise[best] < dup_similarity
+    return order
+
+
+def select(qvec: np.ndarray, ids, vectors: np.ndarray, texts: dict, budget: int, max_chunks: int,
+           lam: float = MMR_LAMBDA, relevance=None):
+    """
+    Pick chunk ids for the prompt from candidates ids (rows of vectors) in
+    MMR order (relevance: see mmr_order), skipping any that no longer fit
+    the token budget, up to max_chunks. The top pick is always kept so a
+    small budget never leaves the prompt empty. Returns (picked ids, tokens
+    used).
+    """
+    picked, used = [], 0
+    for row in mmr_order(qvec, vectors, lam, relevance=relevance):
+        tokens = count_tokens(texts[ids[row]])
+        if picked and used + tokens > budget:
+            continue
+        picked.append(ids[row])
+        used += tokens
+        if len(picked) >= max_chunks:
+            break
+    return picked, used
@@ -1,5 +1,6 @@
+import importlib
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import declarative_base, sessionmaker
 from dotenv import load_dotenv
 
@@ -14,14 +15,101 @@ DATABASE_URL = os.environ.get("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("❌ DATABASE_URL is not set")
 
+# ------------------------------
+# Engine profile
+# ------------------------------
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"  # log every SQL statement (debugging only)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds; below the server's idle timeout
+# Use an AsyncSession (asyncpg / aiosqlite) for the auth routes
+DB_ASYNC = os.getenv("DB_ASYNC", "0") == "1"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+
+def _engine_kwargs() -> dict:
+    if IS_SQLITE:
+        # Sessions move between the event loop and threadpool threads
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL lets readers run alongside the writer; NORMAL sync is safe under WAL
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
 # ------------------------------
 # SQLAlchemy Engine & Session
 # ------------------------------
 engine = create_engine(
     DATABASE_URL,
     pool_pre_ping=True,   # prevents stale connections on Render
-    echo=True
+    echo=DB_ECHO,
+    **_engine_kwargs(),
 )
+if IS_SQLITE:
+    event.listen(engine, "connect", _sqlite_pragmas)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+
+# ------------------------------
+# Optional async engine (DB_ASYNC=1)
+# ------------------------------
+_ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+_async_sessionmaker = None
+
+
+def async_database_url(url: str = DATABASE_URL) -> str:
+    scheme, rest = url.split("://", 1)
+    base = scheme.split("+", 1)[0]
+    if base not in _ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver configured for {base} databases")
+    return f"{_ASYNC_DRIVERS[base]}://{rest}"
+
+
+def get_async_sessionmaker():
+    """
+    Created on first use so sync-only deployments never import the async drivers.
+    """
+    global _async_sessionmaker
+    if _async_sessionmaker is None:
+        url = async_database_url()
+        driver = url.split("+", 1)[1].split(":", 1)[0]
+        try:
+            # Both are otherwise only imported on the first query
+            importlib.import_module("greenlet")
+            importlib.import_module(driver)
+        except ImportError as e:
+            raise RuntimeError(f"DB_ASYNC=1 needs: pip install 'sqlalchemy[asyncio]' {driver}") from e
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        async_engine = create_async_engine(
+            url,
+            pool_pre_ping=True,
+            echo=DB_ECHO,
+            **({} if IS_SQLITE else _engine_kwargs()),
+        )
+        if IS_SQLITE:
+            event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+        _async_sessionmaker = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+    return _async_sessionmaker
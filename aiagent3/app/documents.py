@@ -0,0 +1,98 @@
+# app/routes/documents.py
+import os
+import uuid
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from app import jobs
+from app.index import delete_document, load_chunks
+from app.ingest import ALLOWED_EXTENSIONS, file_extension, get_user_id, spool_upload
+
+router = APIRouter()
+
+# ------------------------------
+# Per-document management. A document's id is the id of the ingest job
+# that created it (documents from before job ids are addressed by filename).
+# ------------------------------
+def _find(user_id: int, doc_id: str):
+    """
+    The live document, a pending job of this tenant, or (None, None).
+    """
+    store = load_chunks(user_id)
+    if store is not None:
+        for doc in store.documents():
+            if doc["doc_id"] == doc_id:
+                return doc, None
+    job = jobs.get_job(doc_id)
+    if job is not None and job["user_id"] == user_id and job["status"] in ("queued", "running"):
+        return None, job
+    return None, None
+
+
+# ------------------------------
+# GET /documents
+# ------------------------------
+@router.get("/documents")
+def list_documents(user_id: int = Depends(get_user_id)):
+    store = load_chunks(user_id)
+    docs = store.documents() if store is not None else []
+    listed = {doc["doc_id"] for doc in docs}
+    deleted = {src["doc_id"] for src in store.sources if src.get("deleted")} if store is not None else set()
+    for doc in docs:
+        doc["status"] = "completed"
+    # Uploads still being ingested (a running one may already have chunks)
+    for job in jobs.pending_jobs(user_id):
+        if job["id"] in deleted:
+            continue
+        if job["id"] in listed:
+            next(d for d in docs if d["doc_id"] == job["id"]).update(status=job["status"], progress=job["progress"])
+        else:
+            docs.append({"doc_id": job["id"], "name": job["filename"], "chunks": 0, "status": job["status"],
+                         "progress": job["progress"]})
+    return {"documents": docs}
+
+
+# ------------------------------
+# DELETE /documents/{doc_id}
+# ------------------------------
+@router.delete("/documents/{doc_id}")
+def remove_document(doc_id: str, user_id: int = Depends(get_user_id)):
+    """
+    Takes effect on the next query; the vectors are dropped by a background
+    compaction. A queued upload is cancelled instead.
+    """
+    doc, job = _find(user_id, doc_id)
+    if doc is None and job is None:
+        raise HTTPException(404, "Document not found")
+    if doc is None and jobs.cancel(doc_id):
+        return {"status": "cancelled", "doc_id": doc_id}
+    # Indexed, or still running: chunks it commits after this are tombstoned too
+    name = job["filename"] if job is not None else None
+    if not delete_document(user_id, doc_id, name):
+        raise HTTPException(404, "Document not found")
+    return {"status": "deleted", "doc_id": doc_id}
+
+
+# ------------------------------
+# PUT /documents/{doc_id}
+# ------------------------------
+@router.put("/documents/{doc_id}")
+async def replace_document(doc_id: str, file: UploadFile = File(...), user_id: int = Depends(get_user_id)):
+    """
+    Ingest a new version as a new document; the old one keeps answering
+    until the new one is indexed, then is deleted. An old upload still
+    queued is cancelled right away (one still running is retired by the
+    new job when it completes).
+    """
+    ext = file_extension(file.filename)
+    if ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(400, "Unsupported file type")
+    doc, job = await run_in_threadpool(_find, user_id, doc_id)
+    if doc is None and job is None:
+        raise HTTPException(404, "Document not found")
+    if doc is None:
+        await run_in_threadpool(jobs.cancel, doc_id)
+
+    path = os.path.join(jobs.INGEST_SPOOL_DIR, f"{uuid.uuid4().hex}.{ext}")
+    await run_in_threadpool(spool_upload, file.file, path)
+    job_id = await run_in_threadpool(jobs.enqueue, user_id, file.filename, path, doc_id)
+    return {"status": "accepted", "job_id": job_id, "replaces": doc_id, "message": "File is queued for processing"}
@@ -0,0 +1,194 @@
+# app/embed_cache.py
+import hashlib
+import mmap
+import os
+import re
+import threading
+import numpy as np
+from app.filelock import FileLock
+
+# ------------------------------
+# Disk-backed embedding cache, content-addressed by chunk text
+# ------------------------------
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "/tmp/embed_cache")
+# Max cached vectors per model (384 float32 = 1.5KB per row); 0 disables the cache
+EMBED_CACHE_MAX_ROWS = int(os.getenv("EMBED_CACHE_MAX_ROWS", "100000"))
+
+_KEY_BYTES = 20  # sha1 digest
+_NO_KEY = bytes(_KEY_BYTES)
+
+
+def normalize_text(text: str) -> str:
+    # The tokenizer ignores whitespace runs, so they must not change the key
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(model_name: str, text: str) -> bytes:
+    return hashlib.sha1(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Fixed-capacity ring of embeddings stored as mmap'd files:
+      <model>.vecs  float32 (capacity, dim)
+      <model>.keys  uint8   (capacity, 20)   sha1 of (model, normalized text)
+      <model>.meta  int64   [writes so far]; the next slot is writes % capacity
+    When full, the oldest slot is overwritten. Writers take an flock so several
+    processes can share one cache directory; a process that misses picks up
+    the slots others wrote since it last looked (see _sync).
+    """
+
+    def __init__(self, model_name: str, dim: int, capacity: int, directory: str = EMBED_CACHE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+        self.model_name = model_name
+        self.dim = dim
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._lock_path = base + ".lock"
+
+        with self._file_lock():
+            self.vecs = self._open(base + ".vecs", np.float32, (capacity, dim))
+            self.keys = self._open(base + ".keys", np.uint8, (capacity, _KEY_BYTES))
+            self.meta = self._open(base + ".meta", np.int64, (1,))
+
+        # digest -> slot, and the digest each slot held when last read; slots
+        # are re-checked against self.keys on every hit
+        self._slots = {}
+        self._slot_keys = [None] * capacity
+        for slot in np.flatnonzero(self.keys.any(axis=1)):
+            self._remember(int(slot))
+        self._synced = int(self.meta[0])
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _open(path, dtype, shape):
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if not os.path.exists(path) or os.path.getsize(path) != nbytes:
+            # Fresh cache or capacity/dim changed: start over
+            with open(path, "wb") as f:
+                f.truncate(nbytes)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _file_lock(self):
+        return FileLock(self._lock_path)
+
+    def _flush(self, first: int, end: int):
+        """
+        Write back the slots written by writes [first, end) rather than the
+        whole ring; the range may wrap around the end of the files.
+        """
+        if end - first >= self.capacity:
+            spans = [(0, self.capacity)]
+        else:
+            lo, hi = first % self.capacity, end % self.capacity
+            spans = [(lo, hi)] if lo < hi else [(lo, self.capacity), (0, hi)]
+        for array in (self.vecs, self.keys):
+            row = array.strides[0]
+            for lo, hi in spans:
+                if lo < hi:
+                    # msync wants a page-aligned start
+                    start = lo * row // mmap.ALLOCATIONGRANULARITY * mmap.ALLOCATIONGRANULARITY
+                    array.base.flush(start, hi * row - start)
+        self.meta.flush()
+
+    def _remember(self, slot: int):
+        old = self._slot_keys[slot]
+        if old is not None and self._slots.get(old) == slot:
+            del self._slots[old]
+        key = self.keys[slot].tobytes()
+        self._slot_keys[slot] = key if key != _NO_KEY else None
+        if key != _NO_KEY:
+            self._slots[key] = slot
+
+    def _sync(self):
+        """
+        Re-read the slots written (by any process) since the last sync, or
+        all of them if the ring wrapped since. Caller holds both locks.
+        """
+        writes = int(self.meta[0])
+        if writes == self._synced:
+            return
+        if self._synced < writes < self._synced + self.capacity:
+            slots = (w % self.capacity for w in range(self._synced, writes))
+        else:
+            slots = range(self.capacity)
+        for slot in slots:
+            self._remember(slot)
+        self._synced = writes
+
+    def _read(self, key: bytes):
+        slot = self._slots.get(key)
+        if slot is None or self.keys[slot].tobytes() != key:
+            return None
+        vec = np.array(self.vecs[slot])
+        # Writers clear a slot's key before overwriting its vector
+        return vec if self.keys[slot].tobytes() == key else None
+
+    def get_many(self, texts):
+        """
+        Returns (keys, {position: vector}) for the texts already cached.
+        """
+        keys = [cache_key(self.model_name, t) for t in texts]
+        found = {}
+        with self._lock:
+            for pos, key in enumerate(keys):
+                vec = self._read(key)
+                if vec is not None:
+                    found[pos] = vec
+            if len(found) < len(keys) and int(self.meta[0]) != self._synced:
+                # Other processes may have cached the rest
+                with self._file_lock():
+                    self._sync()
+                for pos, key in enumerate(keys):
+                    if pos not in found:
+                        vec = self._read(key)
+                        if vec is not None:
+                            found[pos] = vec
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return keys, found
+
+    def put_many(self, keys, vectors: np.ndarray):
+        if not keys:
+            return
+        with self._lock, self._file_lock():
+            self._sync()
+            first = int(self.meta[0])
+            for key, vec in zip(keys, vectors):
+                known = self._slots.get(key)
+                if known is not None and self.keys[known].tobytes() == key:
+                    continue
+                writes = int(self.meta[0])
+                slot = writes % self.capacity
+                if self._slot_keys[slot] is not None:
+                    self.evictions += 1
+                # Clear the key first so lock-free readers never pair it with the new vector
+                self.keys[slot] = 0
+                self.vecs[slot] = vec
+                self.keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                self._remember(slot)
+                self.meta[0] = self._synced = writes + 1
+            end = int(self.meta[0])
+            if end > first:
+                self.writes += end - first
+                self._flush(first, end)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "model": self.model_name,
+                "rows": len(self._slots),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
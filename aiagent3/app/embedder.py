@@ -1,15 +1,268 @@
+import importlib
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
 import numpy as np
+from app.embed_cache import EmbeddingCache, EMBED_CACHE_MAX_ROWS
+from app import metrics
 
 _model = None  # private global variable
+_model_lock = threading.Lock()
+_cache = None
+_cache_lock = threading.Lock()
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Rows per forward pass when embedding many texts at once
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+# ------------------------------
+# Embedder backends: torch | torch-int8 | onnx | onnx-int8
+# ------------------------------
+# All produce MiniLM vectors close enough to share one index; run
+# bench/bench_backends.py to check agreement and speed on a given node.
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+# Quantized export used by onnx-int8; pick the variant matching the node's CPU
+EMBED_ONNX_INT8_FILE = os.getenv("EMBED_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+
+def _load_torch(name: str):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name, device="cpu")
+
+def _load_torch_int8(name: str):
+    # Dynamic int8 quantization of the Linear layers; no export step needed
+    import torch
+    return torch.quantization.quantize_dynamic(_load_torch(name), {torch.nn.Linear}, dtype=torch.qint8)
+
+def _load_onnx(name: str, file_name: str = None):
+    from sentence_transformers import SentenceTransformer
+    kwargs = {"model_kwargs": {"file_name": file_name}} if file_name else {}
+    try:
+        return SentenceTransformer(name, device="cpu", backend="onnx", **kwargs)
+    except ImportError as e:
+        raise RuntimeError("EMBED_BACKEND=onnx needs: pip install 'sentence-transformers[onnx]'") from e
+
+def _load_onnx_int8(name: str):
+    return _load_onnx(name, EMBED_ONNX_INT8_FILE)
+
+# name -> loader(model_name) returning an object with encode() and
+# get_sentence_embedding_dimension(), like SentenceTransformer.
+# EMBED_BACKEND may also be "package.module:loader", which spawned ingest
+# processes can import too (register_backend only affects this process).
+BACKENDS = {
+    "torch": _load_torch,
+    "torch-int8": _load_torch_int8,
+    "onnx": _load_onnx,
+    "onnx-int8": _load_onnx_int8,
+}
+
+def register_backend(name: str, loader):
+    BACKENDS[name] = loader
+
+def load_backend(name: str):
+    if name not in BACKENDS and ":" in name:
+        module, attr = name.split(":", 1)
+        register_backend(name, getattr(importlib.import_module(module), attr))
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown EMBED_BACKEND {name!r}; expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](MODEL_NAME)
 
 def get_model():
     global _model
     if _model is None:
-        # lazy-load only on first use
-        from sentence_transformers import SentenceTransformer
-        _model = SentenceTransformer("all-MiniLM-L6-v2")
+        # lazy-load on first use, or from the startup warm-up; the lock keeps
+        # a request racing the warm-up from loading a second copy
+        with _model_lock:
+            if _model is None:
+                _model = load_backend(EMBED_BACKEND)
     return _model
 
-def get_embedding(text: str):
+def model_loaded() -> bool:
+    return _model is not None
+
+def cache_namespace() -> str:
+    # Backends differ slightly, so each gets its own cached vectors;
+    # torch keeps the bare model name so existing caches stay valid
+    return MODEL_NAME if EMBED_BACKEND == "torch" else f"{MODEL_NAME}@{EMBED_BACKEND}"
+
+def get_cache():
+    """
+    Shared on-disk embedding cache for MODEL_NAME on EMBED_BACKEND, or None
+    when disabled.
+    """
+    global _cache
+    if _cache is None and EMBED_CACHE_MAX_ROWS > 0:
+        with _cache_lock:
+            if _cache is None:
+                dim = get_model().get_sentence_embedding_dimension()
+                _cache = EmbeddingCache(cache_namespace(), dim, EMBED_CACHE_MAX_ROWS)
+    return _cache
+
+def embedding_cache_stats() -> dict:
+    # Don't force a model load just to report stats
+    if _cache is None:
+        return {"backend": EMBED_BACKEND, "enabled": EMBED_CACHE_MAX_ROWS > 0, "loaded": False}
+    return {"backend": EMBED_BACKEND, **_cache.stats()}
+
+def _encode_batched(texts, batch_size: int) -> np.ndarray:
     model = get_model()
-    return np.array(model.encode(text), dtype="float32")
+    dim = model.get_sentence_embedding_dimension()
+    out = np.empty((len(texts), dim), dtype="float32")
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    for start in range(0, len(order), batch_size):
+        ids = order[start:start + batch_size]
+        with metrics.stage("embed_batch"):
+            out[ids] = model.encode([texts[i] for i in ids], batch_size=len(ids))
+    return out
+
+def get_embedding(text: str):
+    cache = get_cache()
+    if cache is not None:
+        keys, found = cache.get_many([text])
+        if found:
+            return found[0]
+    vec = np.array(get_model().encode(text), dtype="float32")
+    if cache is not None:
+        cache.put_many(keys, vec[None, :])
+    return vec
+
+def get_embeddings(texts, batch_size: int = None) -> np.ndarray:
+    """
+    Embed many texts with batched forward passes.
+    Texts are bucketed by length so each batch pads to a similar size.
+    Cached chunks are served from disk; only misses go through the model.
+    Returns a contiguous float32 matrix in the input order.
+    """
+    batch_size = batch_size or EMBED_BATCH_SIZE
+    cache = get_cache()
+    if cache is None:
+        return _encode_batched(texts, batch_size)
+
+    dim = get_model().get_sentence_embedding_dimension()
+    out = np.empty((len(texts), dim), dtype="float32")
+    keys, found = cache.get_many(texts)
+    for pos, vec in found.items():
+        out[pos] = vec
+
+    # Embed each distinct missing text once
+    missing = {}
+    for pos, key in enumerate(keys):
+        if pos not in found:
+            missing.setdefault(key, []).append(pos)
+    if missing:
+        miss_keys = list(missing)
+        vecs = _encode_batched([texts[missing[k][0]] for k in miss_keys], batch_size)
+        for key, vec in zip(miss_keys, vecs):
+            out[missing[key]] = vec
+        cache.put_many(miss_keys, vecs)
+    return out
+
+# ------------------------------
+# Micro-batching for concurrent single-text requests (query embeddings)
+# ------------------------------
+# Requests arriving within EMBED_MICROBATCH_WAIT_MS of each other share one
+# forward pass of up to EMBED_MICROBATCH_MAX texts (1 = one pass per request).
+EMBED_MICROBATCH_MAX = int(os.getenv("EMBED_MICROBATCH_MAX", "32"))
+EMBED_MICROBATCH_WAIT_MS = float(os.getenv("EMBED_MICROBATCH_WAIT_MS", "3"))
+
+class EmbeddingBatcher:
+    """
+    Collects texts from many callers and embeds them together on a single
+    dedicated thread; each caller gets a Future for its own vector. An idle
+    batcher doesn't wait for company, so a lone request pays no window.
+    """
+
+    def __init__(self, max_batch: int = EMBED_MICROBATCH_MAX, max_wait_ms: float = EMBED_MICROBATCH_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_arrival = 0.0
+        self.batches = 0
+        self.items = 0
+        self.max_seen = 0
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._queue.put((text, future, time.monotonic()))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True, name="embed-batcher")
+                    self._thread.start()
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        # Only hold the batch open if requests are arriving close together
+        busy = batch[0][2] - self._last_arrival < self.max_wait
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                if busy:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._last_arrival = batch[-1][2]
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            live = [(text, future) for text, future, _ in batch if future.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            try:
+                vecs = get_embeddings([text for text, _ in live], batch_size=len(live))
+            except Exception as e:
+                for _, future in live:
+                    future.set_exception(e)
+                continue
+            for (_, future), vec in zip(live, vecs):
+                future.set_result(vec)
+            self.batches += 1
+            self.items += len(live)
+            self.max_seen = max(self.max_seen, len(live))
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_batch_seen": self.max_seen,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+        }
+
+_batcher = EmbeddingBatcher()
+
+def embed_async(text: str) -> Future:
+    """
+    Future for the embedding of text, computed in a micro-batch with other
+    concurrent callers. Use asyncio.wrap_future() to await it.
+    """
+    return _batcher.submit(text)
+
+def embedding_batch_stats() -> dict:
+    return _batcher.stats()
+
+@metrics.counter("aiagent_embedding_cache_total", "Embedding cache lookups.", ("result",))
+def _embed_cache_counts():
+    if _cache is None:
+        return []
+    s = _cache.stats()
+    return [(("hit",), s["hits"]), (("miss",), s["misses"])]
+
+@metrics.gauge("aiagent_embed_queue_depth", "Query embeddings waiting for the micro-batcher.")
+def _embed_queue_depth():
+    return [((), _batcher._queue.qsize())]
+
+@metrics.counter("aiagent_embed_batched_total", "Query embedding micro-batches and the queries they carried.", ("kind",))
+def _embed_batch_counts():
+    s = _batcher.stats()
+    return [(("batches",), s["batches"]), (("items",), s["items"])]
@@ -0,0 +1,20 @@
+# app/filelock.py
+import fcntl
+
+
+class FileLock:
+    """
+    Exclusive advisory lock on a file, shared across processes on one host.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __enter__(self):
+        self._f = open(self.path, "a")
+        fcntl.flock(self._f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._f, fcntl.LOCK_UN)
+        self._f.close()
@@ -1,37 +1,904 @@
 # app/faiss_index/index_manager.py
 import faiss
+import json
 import numpy as np
 import os
+import pickle
+import threading
+from collections import OrderedDict
 from app.embedder import get_embedding
+from app.chunk_store import ChunkStore, append_chunks, chunk_count, mark_deleted, store_exists, store_paths
+from app.lexical import LexicalIndex, append_terms, indexed_count, lexical_paths
+from app.filelock import FileLock
+from app import metrics
 
 # ------------------------------
 # Use /tmp for persistence on Render
 # ------------------------------
-FAISS_DIR = "/tmp/faiss_index"
+FAISS_DIR = os.getenv("FAISS_DIR", "/tmp/faiss_index")
 os.makedirs(FAISS_DIR, exist_ok=True)
 
-def get_index(user_id: int):
+EMBED_DIM = 384
+
+# Byte budget for indexes + chunk lists kept in memory across requests
+INDEX_CACHE_MAX_BYTES = int(os.getenv("INDEX_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Tenants start on an exact IndexFlatL2 and are rebuilt as an ANN index
+# ("hnsw" or "ivfpq") in the background once they reach INDEX_PROMOTE_AT vectors
+INDEX_PROMOTE_AT = int(os.getenv("INDEX_PROMOTE_AT", "50000"))
+INDEX_ANN_KIND = os.getenv("INDEX_ANN_KIND", "hnsw")
+
+# Build-time and default search-time parameters; search-time ones can be
+# overridden per tenant in {user_id}.params.json
+DEFAULT_INDEX_PARAMS = {
+    "hnsw_m": 32,
+    "efConstruction": 80,
+    "efSearch": 64,
+    "pq_m": 48,        # 384 / 48 = 8 dims per sub-quantizer
+    "pq_nbits": 8,
+    "nprobe": 16,
+}
+SEARCH_PARAMS = ("efSearch", "nprobe")
+
+
+# ------------------------------
+# In-process LRU of loaded user indexes / chunk stores
+# ------------------------------
+def _release(value):
+    # Chunk stores hold an open blob file and its mmap
+    close = getattr(value, "close", None)
+    if close is not None:
+        close()
+
+
+class IndexCache:
     """
-    Get FAISS index for a user. Create a new one if it doesn't exist.
+    Bounded LRU keyed by (kind, user_id), evicted by an approximate byte budget.
+    kind is "base", "delta", "chunks" or "lexical". Entries carry the on-disk
+    file version they were loaded from, so writes made by another process
+    (the ingest worker) are picked up on the next get(). Values that have a
+    close() are closed when they leave the cache.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, nbytes, version)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] != version:
+                # Stale: the file changed under us
+                self._entries.pop(key)
+                self._bytes -= entry[1]
+                _release(entry[0])
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes: int, version=None):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+                if old[0] is not value:
+                    _release(old[0])
+            if nbytes > self.max_bytes:
+                # Never cache something that would flush the whole budget
+                return
+            self._entries[key] = (value, nbytes, version)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (evicted, evicted_bytes, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+                self.evictions += 1
+                _release(evicted)
+
+    def peek(self, key):
+        """
+        The cached value whatever its version, without touching LRU order or
+        counters; for refreshing a stale entry incrementally.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry is not None else None
+
+    def invalidate(self, user_id: int, kinds=None):
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == user_id and (kinds is None or k[0] in kinds)]:
+                value, nbytes, _ = self._entries.pop(key)
+                self._bytes -= nbytes
+                _release(value)
+
+    def clear(self):
+        with self._lock:
+            for value, _, _ in self._entries.values():
+                _release(value)
+            self._entries.clear()
+            self._bytes = 0
+
+    def items(self):
+        """
+        Snapshot of (key, value) pairs, for metrics.
+        """
+        with self._lock:
+            return [(key, entry[0]) for key, entry in self._entries.items()]
+
+    def tenant_stats(self, user_id: int) -> dict:
+        """
+        What one tenant holds in the cache, by kind.
+        """
+        with self._lock:
+            mine = [(key[0], entry[1]) for key, entry in self._entries.items() if key[1] == user_id]
+        return {
+            "entries": {kind: sum(1 for k, _ in mine if k == kind) for kind, _ in mine},
+            "bytes": sum(nbytes for _, nbytes in mine),
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+index_cache = IndexCache(INDEX_CACHE_MAX_BYTES)
+_migrate_lock = threading.Lock()
+
+
+@metrics.gauge("aiagent_index_cache_bytes", "Approximate bytes held by the index LRU.")
+def _cache_bytes():
+    return [((), index_cache.stats()["bytes"])]
+
+
+@metrics.counter("aiagent_index_cache_total", "Index LRU lookups and evictions.", ("result",))
+def _cache_counts():
+    s = index_cache.stats()
+    return [(("hit",), s["hits"]), (("miss",), s["misses"]), (("eviction",), s["evictions"])]
+
+
+@metrics.gauge("aiagent_tenant_index_size", "Vectors / chunks / postings per tenant, for tenants loaded in this process.",
+               ("user_id", "kind"))
+def _tenant_sizes():
+    bases, deltas, out = {}, {}, []
+    for (kind, user_id), value in index_cache.items():
+        if kind == "base":
+            bases[user_id] = value
+        elif kind == "delta":
+            deltas[user_id] = value
+        elif kind == "chunks":
+            out.append(((user_id, "chunks"), len(value)))
+            out.append(((user_id, "tombstones"), len(value.deleted_ids)))
+        elif kind == "lexical":
+            out.append(((user_id, "postings"), len(value)))
+    for user_id in bases.keys() | deltas.keys():
+        base = bases.get(user_id)
+        start, rows = deltas.get(user_id, (None, ()))
+        # Delta rows below the base's coverage were already compacted into it
+        covered = base_coverage(base) if base is not None else 0
+        skip = 0 if start is None else max(0, covered - start)
+        out.append(((user_id, "vectors"), (base.ntotal if base is not None else 0) + max(0, len(rows) - skip)))
+    return out
+
+
+def file_version(path: str):
+    """
+    Cheap change detector for a file written by append or atomic rename.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _index_nbytes(index) -> int:
+    # Flat storage dominates; IVF/HNSW overhead is small next to the vectors
+    return index.ntotal * index.d * 4 + 1024
+
+
+def index_path(user_id: int) -> str:
+    return os.path.join(FAISS_DIR, f"{user_id}.index")
+
+
+def legacy_chunks_path(user_id: int) -> str:
+    return os.path.join(FAISS_DIR, f"{user_id}_chunks.pkl")
+
+
+def params_path(user_id: int) -> str:
+    return os.path.join(FAISS_DIR, f"{user_id}.params.json")
+
+
+def get_index_params(user_id: int) -> dict:
+    params = dict(DEFAULT_INDEX_PARAMS)
+    path = params_path(user_id)
+    if os.path.exists(path):
+        with open(path) as f:
+            params.update(json.load(f))
+    return params
+
+
+def set_search_params(user_id: int, **overrides) -> dict:
+    """
+    Persist per-tenant nprobe / efSearch overrides and drop the cached index
+    so the next search picks them up.
+    """
+    current = {}
+    path = params_path(user_id)
+    if os.path.exists(path):
+        with open(path) as f:
+            current = json.load(f)
+    current.update({k: int(v) for k, v in overrides.items() if k in SEARCH_PARAMS and v is not None})
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(current, f)
+    os.replace(tmp, path)
+    index_cache.invalidate(user_id)
+    return get_index_params(user_id)
+
+
+def ann_structure(index):
+    """
+    The index itself, or the one wrapped by an IndexIDMap2.
     """
-    path = os.path.join(FAISS_DIR, f"{user_id}.index")
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap2):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def base_ids(index) -> np.ndarray:
+    """
+    Vector ids held by a base: explicit for an IndexIDMap2, else 0..ntotal-1
+    (bases built before documents could be deleted).
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap2):
+        return faiss.vector_to_array(index.id_map)
+    return np.arange(index.ntotal, dtype="int64")
+
+
+def base_coverage(index) -> int:
+    """
+    Ids below this are in the base or were purged from it. Ids are always
+    added in ascending order, so the last one is the largest. Purged
+    trailing ids fall outside it, which is harmless: they are tombstoned.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap2):
+        n = index.id_map.size()
+        return int(index.id_map.at(n - 1)) + 1 if n else 0
+    return index.ntotal
+
+
+def apply_search_params(index, params: dict):
+    """
+    Set efSearch / nprobe on whichever ANN structure the index contains.
+    """
+    hnsw = getattr(ann_structure(index), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = int(params["efSearch"])
+    try:
+        faiss.extract_index_ivf(index).nprobe = int(params["nprobe"])
+    except RuntimeError:
+        pass  # not an IVF index
+    return index
+
+
+def index_kind(index) -> str:
+    index = ann_structure(index)
+    if isinstance(index, faiss.IndexFlat):
+        return "flat"
+    if hasattr(index, "hnsw"):
+        return "hnsw"
+    return "ivfpq"
+
+
+def build_index(kind: str, vectors: np.ndarray, params: dict = None, ids: np.ndarray = None):
+    """
+    Build a trained index of the given kind ("flat", "hnsw", "ivfpq") holding
+    vectors; with ids (ascending), an IndexIDMap2 holding them under those ids.
+    """
+    params = {**DEFAULT_INDEX_PARAMS, **(params or {})}
+    d = vectors.shape[1]
+    if kind == "flat":
+        index = faiss.IndexFlatL2(d)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, int(params["hnsw_m"]))
+        index.hnsw.efConstruction = int(params["efConstruction"])
+    elif kind == "ivfpq":
+        # ~4*sqrt(n) lists, keeping >= 39 training points per centroid
+        nlist = max(1, min(int(4 * np.sqrt(len(vectors))), len(vectors) // 39))
+        # PQ codebooks need ~39 points per centroid too
+        nbits = min(int(params["pq_nbits"]), max(1, int(np.log2(max(2, len(vectors) // 39)))))
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(d), d, nlist, int(params["pq_m"]), nbits)
+        index.train(vectors)
+    else:
+        raise ValueError(f"Unknown index kind: {kind}")
+    if ids is not None:
+        index = faiss.IndexIDMap2(index)
+        index.add_with_ids(vectors, np.ascontiguousarray(ids, dtype="int64"))
+    else:
+        index.add(vectors)
+    return _enable_reconstruct(apply_search_params(index, params))
+
+
+def _enable_reconstruct(index):
+    """
+    IVF indexes need a direct map for reconstruct(), which the context
+    builder uses to fetch candidate vectors; flat and HNSW have it built in.
+    """
+    try:
+        faiss.extract_index_ivf(index).make_direct_map()
+    except RuntimeError:
+        pass  # not an IVF index
+    return index
+
+
+def _write_index_atomic(index, path: str):
+    tmp = path + ".tmp"
+    faiss.write_index(index, tmp)
+    os.replace(tmp, path)
+
+
+def _load_index(user_id: int):
+    path = index_path(user_id)
     if os.path.exists(path):
-        return faiss.read_index(path)
-    
+        return _enable_reconstruct(apply_search_params(faiss.read_index(path), get_index_params(user_id)))
+
     # Create new index for 384-dimensional embeddings
-    return faiss.IndexFlatL2(384)
+    return faiss.IndexFlatL2(EMBED_DIM)
+
+
+# ------------------------------
+# Delta segment (write-ahead log) for new vectors
+# ------------------------------
+#   {user_id}.delta  int64 start id, then float32[EMBED_DIM] rows
+# Row j holds vector id start + j. The base .index covers ids [0, base.ntotal);
+# delta rows below that were already compacted into it and are skipped.
+_DELTA_HEADER = 8
+_ROW_BYTES = EMBED_DIM * 4
+
+# Fold the delta into the base once it holds this many rows
+INDEX_COMPACT_AT = int(os.getenv("INDEX_COMPACT_AT", "5000"))
+INDEX_COMPACT_ATTEMPTS = int(os.getenv("INDEX_COMPACT_ATTEMPTS", "3"))
+
+
+def delta_path(user_id: int) -> str:
+    return os.path.join(FAISS_DIR, f"{user_id}.delta")
+
+
+def _read_delta(user_id: int):
+    """
+    Returns (start_id, rows), or (None, empty) when the tenant has no delta.
+    A torn trailing row from a crash mid-append is ignored.
+    """
+    empty = np.empty((0, EMBED_DIM), dtype="float32")
+    path = delta_path(user_id)
+    if not os.path.exists(path):
+        return None, empty
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < _DELTA_HEADER:
+        return None, empty
+    start = int(np.frombuffer(data[:_DELTA_HEADER], dtype="<i8")[0])
+    n = (len(data) - _DELTA_HEADER) // _ROW_BYTES
+    rows = np.frombuffer(data, dtype="float32", count=n * EMBED_DIM, offset=_DELTA_HEADER)
+    return start, rows.reshape(n, EMBED_DIM)
+
+
+def _write_delta(user_id: int, start: int, rows: np.ndarray):
+    path = delta_path(user_id)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(np.int64(start).tobytes())
+        f.write(np.ascontiguousarray(rows, dtype="float32").tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _append_delta(user_id: int, embeddings: np.ndarray):
+    """
+    Durably append rows to the delta. Returns (start_id, rows now in the delta).
+    Caller holds the tenant lock.
+    """
+    path = delta_path(user_id)
+    if not os.path.exists(path):
+        # First write since the delta was introduced: ids continue after the base
+        _write_delta(user_id, base_coverage(_load_index(user_id)), np.empty((0, EMBED_DIM), dtype="float32"))
+    with open(path, "r+b") as f:
+        start = int(np.frombuffer(f.read(_DELTA_HEADER), dtype="<i8")[0])
+        size = os.fstat(f.fileno()).st_size
+        n = (size - _DELTA_HEADER) // _ROW_BYTES
+        # Drop a torn row left by a crash before appending after it
+        f.truncate(_DELTA_HEADER + n * _ROW_BYTES)
+        f.seek(0, os.SEEK_END)
+        f.write(np.ascontiguousarray(embeddings, dtype="float32").tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    return start, n + len(embeddings)
+
+
+class UserIndex:
+    """
+    Read view of a tenant: the compacted base index plus live delta rows.
+    search() merges both, so new uploads are searchable before compaction,
+    and leaves out tombstoned ids, so deletions apply before it too.
+    """
+
+    def __init__(self, base, delta_start, delta_rows):
+        self.base = base
+        self.d = base.d
+        covered = base_coverage(base)
+        skip = 0 if delta_start is None else max(0, covered - delta_start)
+        self.delta = delta_rows[skip:]
+        self.delta_first = covered if delta_start is None else delta_start + skip  # id of delta row 0
+
+    @property
+    def ntotal(self) -> int:
+        return self.base.ntotal + len(self.delta)
+
+    @property
+    def kind(self) -> str:
+        return index_kind(self.base)
+
+    def _search_params(self, selector):
+        # Explicit parameters replace the index's own, so carry efSearch / nprobe over
+        ann = ann_structure(self.base)
+        if hasattr(ann, "hnsw"):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=ann.hnsw.efSearch)
+        try:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=faiss.extract_index_ivf(self.base).nprobe)
+        except RuntimeError:
+            return faiss.SearchParameters(sel=selector)
+
+    def search(self, queries: np.ndarray, k: int, exclude: np.ndarray = None):
+        """
+        k nearest ids per query row; exclude: sorted ids (tombstones) to skip.
+        Missing results are -1.
+        """
+        nq = len(queries)
+        D = np.full((nq, k), np.inf, dtype="float32")
+        I = np.full((nq, k), -1, dtype="int64")
+        excluding = exclude is not None and len(exclude) > 0
+        if self.base.ntotal:
+            if excluding:
+                batch = faiss.IDSelectorBatch(exclude)
+                selector = faiss.IDSelectorNot(batch)
+                D, I = self.base.search(queries, k, params=self._search_params(selector))
+            else:
+                D, I = self.base.search(queries, k)
+        delta, delta_ids = self.delta, None
+        if excluding and len(delta):
+            ids = np.arange(self.delta_first, self.delta_first + len(delta))
+            live = ~np.isin(ids, exclude, assume_unique=True)
+            if not live.all():
+                delta, delta_ids = np.ascontiguousarray(delta[live]), ids[live]
+        if len(delta):
+            Dd, Id = faiss.knn(queries, delta, min(k, len(delta)))
+            Id = delta_ids[Id] if delta_ids is not None else Id + self.delta_first
+            D = np.hstack([D, Dd])
+            I = np.hstack([I, Id])
+            order = np.argsort(D, axis=1, kind="stable")[:, :k]
+            D = np.take_along_axis(D, order, axis=1)
+            I = np.take_along_axis(I, order, axis=1)
+        return D, I
+
+    def vectors(self, ids) -> np.ndarray:
+        """
+        Stored vectors of the given ids (PQ-approximated on an ivfpq base).
+        """
+        out = np.empty((len(ids), self.d), dtype="float32")
+        for row, i in enumerate(ids):
+            if i < self.delta_first:
+                out[row] = self.base.reconstruct(int(i))
+            else:
+                out[row] = self.delta[i - self.delta_first]
+        return out
+
+
+# ------------------------------
+# Background compaction (promotion flat -> ANN, purging deleted documents)
+# ------------------------------
+# Rebuild an ANN base once this fraction of its vectors is tombstoned
+# (flat bases are rebuilt on any deletion; it's just a copy)
+INDEX_PURGE_RATIO = float(os.getenv("INDEX_PURGE_RATIO", "0.1"))
+_tenant_locks = {}
+_tenant_locks_guard = threading.Lock()
+_compacting = set()
+_base_kinds = {}  # user_id -> (base file version, kind)
+
+
+def base_kind(user_id: int) -> str:
+    """
+    Kind of the tenant's base index on disk, read at most once per base
+    version per process (compaction and get_index record it as they go).
+    """
+    version = file_version(index_path(user_id))
+    known = _base_kinds.get(user_id)
+    if known is None or known[0] != version:
+        known = _base_kinds[user_id] = (version, index_kind(_load_index(user_id)) if version else "flat")
+    return known[1]
+
+
+class _TenantLock:
+    """
+    Serializes writers of one tenant's files: a thread lock within this
+    process plus an flock on {user_id}.lock across web/worker processes.
+    """
+
+    def __init__(self, user_id: int):
+        self._thread_lock = threading.Lock()
+        self._file_lock = FileLock(os.path.join(FAISS_DIR, f"{user_id}.lock"))
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            self._file_lock.__enter__()
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        self._file_lock.__exit__(*exc)
+        self._thread_lock.release()
+
+
+def _tenant_lock(user_id: int) -> _TenantLock:
+    with _tenant_locks_guard:
+        lock = _tenant_locks.get(user_id)
+        if lock is None:
+            lock = _tenant_locks[user_id] = _TenantLock(user_id)
+        return lock
+
+
+def compact_index(user_id: int, kind: str = None):
+    """
+    Fold the delta into the base index, rebuilding a flat base as an ANN
+    index once the tenant reaches INDEX_PROMOTE_AT vectors, and rebuilding
+    without the vectors of deleted documents once enough of them pile up.
+    Rebuilt bases are IndexIDMap2s keyed by chunk id, so dropping vectors
+    never renumbers chunks. The heavy work runs without the tenant lock; the
+    new base and the remaining delta tail are committed with atomic renames,
+    base first, so a crash in between only leaves delta rows that get
+    skipped on load. If another process committed a compaction meanwhile,
+    the attempt is redone from its result.
+    """
+    try:
+        for _ in range(INDEX_COMPACT_ATTEMPTS):
+            if _compact_once(user_id, kind):
+                return
+        print(f"index user={user_id} compaction skipped: base kept changing", flush=True)
+    finally:
+        with _tenant_locks_guard:
+            _compacting.discard(user_id)
+
+
+def _compact_once(user_id: int, kind: str = None) -> bool:
+    """
+    One compaction attempt. Returns False, leaving the files untouched, when
+    the base or the delta start changed between snapshot and commit.
+    """
+    with _tenant_lock(user_id):
+        version = file_version(index_path(user_id))
+        base = _load_index(user_id)
+        start, rows = _read_delta(user_id)
+        deleted = np.empty(0, "int64")
+        if store_exists(FAISS_DIR, user_id):
+            store = ChunkStore(FAISS_DIR, user_id)
+            deleted = store.deleted_ids
+            store.close()
+    covered = base_coverage(base)
+    first = covered if start is None else max(start, covered)
+    snapshot = first if start is None else start + len(rows)
+    live = rows[first - start:] if start is not None else rows
+    live_ids = np.arange(first, first + len(live))
+    keep = ~np.isin(live_ids, deleted)
+    ids = base_ids(base)
+    dead = np.isin(ids, deleted)
+
+    mapped = isinstance(faiss.downcast_index(base), faiss.IndexIDMap2)
+    promote = (
+        index_kind(base) == "flat"
+        and INDEX_PROMOTE_AT > 0
+        and len(ids) - dead.sum() + keep.sum() >= INDEX_PROMOTE_AT
+    )
+    purge = dead.any() and (index_kind(base) == "flat" or dead.mean() >= INDEX_PURGE_RATIO)
+    # An unmapped base holds ids 0..n-1 implicitly; skipping a deleted row means mapping it
+    rebuild = promote or purge or (not mapped and not keep.all())
+
+    if rebuild:
+        target = kind or (INDEX_ANN_KIND if promote else index_kind(base))
+        vectors = np.vstack([ann_structure(base).reconstruct_n(0, base.ntotal)[~dead], live[keep]])
+        ids = np.concatenate([ids[~dead], live_ids[keep]])
+        if len(ids) == 0 or (target == "ivfpq" and len(ids) < 39):
+            target = "flat"  # nothing left to train on
+        base = build_index(target, vectors, get_index_params(user_id), ids=ids)
+    elif keep.any():
+        if mapped:
+            base.add_with_ids(np.ascontiguousarray(live[keep]), live_ids[keep])
+        else:
+            base.add(live)
+    elif snapshot == first:
+        return True
+
+    with _tenant_lock(user_id):
+        # Rows appended while we were building stay in the delta. Appends
+        # only grow it, and a delta created since starts where our base
+        # ended; anything else is another process's compaction
+        current, rows = _read_delta(user_id)
+        expected = snapshot if start is None else start
+        if file_version(index_path(user_id)) != version or current not in (None, expected):
+            return False
+        _write_index_atomic(base, index_path(user_id))
+        _base_kinds[user_id] = (file_version(index_path(user_id)), index_kind(base))
+        tail = rows[snapshot - current:] if current is not None else rows[:0]
+        _write_delta(user_id, snapshot, tail)
+        index_cache.invalidate(user_id)
+    action = f"promoted to {index_kind(base)}" if promote else "purged" if purge else "compacted"
+    print(f"index user={user_id} {action} ({base.ntotal} vectors)", flush=True)
+    return True
+
+
+def maybe_compact(user_id: int, delta_rows: int, total: int, deleted: bool = False):
+    # Past INDEX_PROMOTE_AT only a flat base is rebuilt right away; an ANN
+    # base takes new rows through the delta like a small tenant's
+    promote = 0 < INDEX_PROMOTE_AT <= total and delta_rows > 0 and base_kind(user_id) == "flat"
+    due = deleted or delta_rows >= INDEX_COMPACT_AT or promote
+    if not due:
+        return
+    with _tenant_locks_guard:
+        if user_id in _compacting:
+            return
+        _compacting.add(user_id)
+    threading.Thread(target=compact_index, args=(user_id,), daemon=True).start()
+
+
+def get_index(user_id: int) -> UserIndex:
+    """
+    Get FAISS index for a user. Create a new one if it doesn't exist.
+    Base indexes and delta rows are served from the in-process LRU; treat
+    them as read-only.
+    """
+    version = file_version(index_path(user_id))
+    base = index_cache.get(("base", user_id), version)
+    if base is None:
+        with metrics.stage("index_load"):
+            base = _load_index(user_id)
+        _base_kinds[user_id] = (version, index_kind(base))
+        if base.ntotal > 0:
+            index_cache.put(("base", user_id), base, _index_nbytes(base), version)
+
+    version = file_version(delta_path(user_id))
+    delta = index_cache.get(("delta", user_id), version)
+    if delta is None:
+        with metrics.stage("index_load"):
+            delta = _read_delta(user_id)
+        if len(delta[1]):
+            index_cache.put(("delta", user_id), delta, delta[1].nbytes + 64, version)
+    return UserIndex(base, *delta)
+
 
 def save_index(user_id: int, index):
     """
-    Save FAISS index to disk.
+    Save FAISS index to disk as the tenant's full base, with an empty delta.
     """
-    path = os.path.join(FAISS_DIR, f"{user_id}.index")
-    faiss.write_index(index, path)
+    with _tenant_lock(user_id):
+        _write_index_atomic(index, index_path(user_id))
+        _write_delta(user_id, index.ntotal, np.empty((0, EMBED_DIM), dtype="float32"))
+        index_cache.invalidate(user_id)
+
 
 def add_embeddings(user_id: int, embeddings: np.ndarray):
     """
-    Add new embeddings to a user's index and save.
+    Append new embeddings to a user's delta segment; compaction folds them
+    into the base index in the background.
+    """
+    with _tenant_lock(user_id):
+        start, rows = _append_delta(user_id, embeddings)
+        index_cache.invalidate(user_id, kinds=("delta",))
+    maybe_compact(user_id, rows, start + rows)
+
+
+def add_document(user_id: int, source: str, chunks, embeddings: np.ndarray, doc_id: str = None):
+    """
+    Append a document's vectors and chunks (or the next batch of them) under
+    a single tenant lock, so concurrent ingests can't interleave and vector
+    id i stays chunk i.
+    """
+    chunks = list(chunks)
+    with _tenant_lock(user_id):
+        first_id = chunk_count(FAISS_DIR, user_id)
+        start, rows = _append_delta(user_id, embeddings)
+        append_chunks(FAISS_DIR, user_id, source, chunks, doc_id=doc_id)
+        _index_terms(user_id, first_id, [c[0] for c in chunks])
+        # The lexical entry goes stale by version and is refreshed incrementally
+        index_cache.invalidate(user_id, kinds=("delta", "chunks"))
+    maybe_compact(user_id, rows, start + rows)
+
+
+def delete_document(user_id: int, doc_id: str, name: str = None) -> bool:
+    """
+    Tombstone a document: searches skip its chunks from now on, and a
+    background compaction drops its vectors from the index. name: see
+    mark_deleted(). Returns False if the tenant has no such live document.
+    """
+    with _tenant_lock(user_id):
+        if not mark_deleted(FAISS_DIR, user_id, doc_id, name):
+            return False
+        index_cache.invalidate(user_id, kinds=("chunks",))
+    maybe_compact(user_id, 0, 0, deleted=True)
+    return True
+
+
+# ------------------------------
+# Lexical (BM25) side of the index; see app/lexical.py
+# ------------------------------
+LEXICAL_BACKFILL_BATCH = 1000
+
+
+def _backfill_terms(user_id: int, start: int, end: int):
+    """
+    Index chunks [start, end) from the chunk store: tenants ingested before
+    the lexical index existed, or an ingest that died between the two writes.
+    Caller holds the tenant lock.
+    """
+    store = ChunkStore(FAISS_DIR, user_id)
+    try:
+        for s in range(start, end, LEXICAL_BACKFILL_BATCH):
+            e = min(s + LEXICAL_BACKFILL_BATCH, end)
+            append_terms(FAISS_DIR, user_id, s, store.get_many(range(s, e)))
+    finally:
+        store.close()
+
+
+def _index_terms(user_id: int, first_id: int, texts):
+    """
+    Index texts as chunks first_id.. (caller holds the tenant lock).
+    """
+    count = indexed_count(FAISS_DIR, user_id)
+    if count < first_id:
+        _backfill_terms(user_id, count, first_id)
+        count = first_id
+    if count < first_id + len(texts):
+        append_terms(FAISS_DIR, user_id, count, texts[count - first_id:])
+
+
+def backfill_lexical(user_id: int = None) -> int:
+    """
+    Catch the lexical index up with the chunk store for one tenant, or for
+    every tenant (most recently ingested first). Runs in the ingest worker,
+    which owns the writes; returns how many chunks it indexed.
+    """
+    done = 0
+    for uid in [user_id] if user_id is not None else recent_tenants():
+        if indexed_count(FAISS_DIR, uid) >= chunk_count(FAISS_DIR, uid):
+            continue
+        with _tenant_lock(uid):
+            count, total = indexed_count(FAISS_DIR, uid), chunk_count(FAISS_DIR, uid)
+            if count < total:
+                _backfill_terms(uid, count, total)
+                done += total - count
+    return done
+
+
+def load_lexical(user_id: int):
+    """
+    Get the tenant's BM25 index as far as it has been written; chunks the
+    worker hasn't indexed yet (see backfill_lexical) are only found by the
+    dense search. Never takes the tenant's writer lock. Served from the
+    in-process LRU; after an ingest only the new postings are merged into
+    the cached copy.
+    """
+    key = ("lexical", user_id)
+    version = file_version(lexical_paths(FAISS_DIR, user_id)[1])
+    previous = index_cache.peek(key)
+    lex = index_cache.get(key, version)
+    if lex is not None:
+        return lex
+
+    with metrics.stage("lexical_load"):
+        lex = LexicalIndex(FAISS_DIR, user_id, previous=previous)
+    index_cache.put(key, lex, lex.nbytes, version)
+    return lex
+
+
+def recent_tenants(limit: int = None):
+    """
+    Tenants whose chunk stores changed most recently, newest first (all of
+    them without a limit).
+    """
+    suffix = "_chunks.idx"
+    found = []
+    for name in os.listdir(FAISS_DIR):
+        if name.endswith(suffix) and name[:-len(suffix)].isdigit():
+            found.append((os.path.getmtime(os.path.join(FAISS_DIR, name)), int(name[:-len(suffix)])))
+    return [user_id for _, user_id in sorted(found, reverse=True)[:limit]]
+
+
+def chunks_version(user_id: int):
+    """
+    Every ingest appends to the chunk records and every deletion rewrites
+    the sources list; compaction touches neither.
+    """
+    _, idx_path, sources_path = store_paths(FAISS_DIR, user_id)
+    return file_version(idx_path), file_version(sources_path)
+
+
+def index_fingerprint(user_id: int):
+    """
+    Changes whenever the tenant's searchable content or search settings do,
+    so answers stay valid across compaction but not across a deletion.
+    """
+    return (chunks_version(user_id), file_version(params_path(user_id)))
+
+
+def committed_chunks(user_id: int, doc_id: str) -> int:
+    """
+    How many chunks of doc_id are already indexed; a retried ingest skips them.
+    """
+    store = load_chunks(user_id)
+    return store.count_for(doc_id) if store is not None else 0
+
+
+def _migrate_legacy_chunks(user_id: int):
+    """
+    Convert a pre-chunk-store {user_id}_chunks.pkl into the chunk store.
+    """
+    path = legacy_chunks_path(user_id)
+    if store_exists(FAISS_DIR, user_id) or not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        chunks = pickle.load(f)
+    append_chunks(FAISS_DIR, user_id, "legacy upload", [(c, 0, 0, len(c)) for c in chunks])
+    os.remove(path)
+
+
+def has_chunks(user_id: int) -> bool:
+    return store_exists(FAISS_DIR, user_id) or os.path.exists(legacy_chunks_path(user_id))
+
+
+def load_chunks(user_id: int):
+    """
+    Get the chunk store for a user, or None if nothing has been ingested.
+    """
+    key = ("chunks", user_id)
+    version = chunks_version(user_id)
+    store = index_cache.get(key, version)
+    if store is not None:
+        return store
+
+    if not store_exists(FAISS_DIR, user_id):
+        if not os.path.exists(legacy_chunks_path(user_id)):
+            return None
+        with _migrate_lock:
+            _migrate_legacy_chunks(user_id)
+        version = chunks_version(user_id)
+    store = ChunkStore(FAISS_DIR, user_id)
+    index_cache.put(key, store, store.nbytes, version)
+    return store
+
+
+def save_chunks(user_id: int, source: str, chunks):
+    """
+    Append chunks (text, page, char_start, char_end) for one source file
+    and drop any cached view of the store.
     """
-    index = get_index(user_id)
-    index.add(embeddings)
-    save_index(user_id, index)
+    append_chunks(FAISS_DIR, user_id, source, chunks)
+    index_cache.invalidate(user_id)
@@ -1,21 +1,22 @@
 # app/routes/ingest.py
-from fastapi import APIRouter, File, UploadFile, Depends, HTTPException, BackgroundTasks
-from app.index import add_embeddings, get_index, save_index
-from app.embedder import get_embedding
+from fastapi import APIRouter, File, UploadFile, Depends, HTTPException
+from app.index import add_document, committed_chunks, has_chunks
+from app.embedder import get_embeddings, embedding_cache_stats, EMBED_BATCH_SIZE
+from app import jobs, metrics
+from app.chunker import iter_chunks, Deduper
 from app.security import decode_access_token
-import numpy as np
-import fitz  # PyMuPDF for PDF
-from docx import Document
-import pickle, os
+import os
+import shutil
+import uuid
+import itertools
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.concurrency import run_in_threadpool
 from jose import jwt
 
 router = APIRouter()
-JWT_SECRET = "supersecretkey123"
-ALGORITHM = "HS256"
 security = HTTPBearer()
 
-FAISS_DIR = os.path.join("/tmp", "faiss_index")
+FAISS_DIR = os.getenv("FAISS_DIR", os.path.join("/tmp", "faiss_index"))
 os.makedirs(FAISS_DIR, exist_ok=True)
 
 def get_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -> int:
@@ -23,43 +24,119 @@ def get_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -
     if not token:
         raise HTTPException(status_code=401, detail="Missing token")
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
-        user_id = payload.get("user_id")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="User ID not found in token")
-        return user_id
+        # Same secret and verified-token cache as every other route
+        payload = decode_access_token(token)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError:
+    except jwt.JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    user_id = payload.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User ID not found in token")
+    return user_id
 
-def read_file(file: UploadFile):
-    ext = file.filename.split(".")[-1].lower()
-    if ext == "txt":
-        return file.file.read().decode("utf-8", errors="ignore")
-    elif ext == "pdf":
-        doc = fitz.open(stream=file.file.read(), filetype="pdf")
-        return "\n".join([page.get_text() for page in doc])
-    elif ext == "docx":
-        doc = Document(file.file)
-        return "\n".join([p.text for p in doc.paragraphs])
-    else:
-        raise HTTPException(400, "Unsupported file type")
+ALLOWED_EXTENSIONS = {"txt", "pdf", "docx"}
+
+# Chunks embedded and committed to the index at a time; bounds ingest memory
+INGEST_COMMIT_EVERY = int(os.getenv("INGEST_COMMIT_EVERY", str(EMBED_BATCH_SIZE * 8)))
+TXT_READ_CHARS = 1 << 20
+
+def file_extension(filename: str) -> str:
+    return filename.split(".")[-1].lower()
+
+class PageReader:
+    """
+    Iterates a document as (page, text) pieces without holding all of it
+    in memory. Page is 1-based for PDFs, 0 otherwise; consecutive pieces of
+    the same page are contiguous text. done/total track position in source
+    units (pages, characters or paragraphs) for progress reporting.
+    """
+
+    def __init__(self, path: str, filename: str):
+        self.path = path
+        self.ext = file_extension(filename)
+        if self.ext not in ALLOWED_EXTENSIONS:
+            raise ValueError(f"Unsupported file type: {self.ext}")
+        self.done = 0
+        self.total = 0
+
+    def __iter__(self):
+        if self.ext == "txt":
+            self.total = os.path.getsize(self.path)
+            with open(self.path, encoding="utf-8", errors="ignore") as f:
+                while True:
+                    piece = f.read(TXT_READ_CHARS)
+                    if not piece:
+                        break
+                    self.done = min(self.total, self.done + len(piece))
+                    yield 0, piece
+        elif self.ext == "pdf":
+            # Parsers are imported here: only the ingest worker needs them
+            from app import pdf_extract
+            # Large PDFs are extracted in parallel page ranges, still yielded in order
+            self.total = pdf_extract.page_count(self.path)
+            for page, text in pdf_extract.iter_pages(self.path, self.total):
+                self.done = page
+                yield page, text
+        elif self.ext == "docx":
+            from docx import Document
+            paragraphs = Document(self.path).paragraphs
+            self.total = len(paragraphs)
+            for i, p in enumerate(paragraphs):
+                self.done = i + 1
+                # Blank line between paragraphs, so the chunker sees the breaks
+                yield 0, p.text + "\n\n"
+
+def batched(items, size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 # ------------------------------
-# Heavy processing moved to background
+# Heavy processing (runs in the ingest worker, see app/worker.py)
 # ------------------------------
-def process_file_background(user_id: int, text: str):
-    chunks = [text[i:i+500] for i in range(0, len(text), 500)]
-    embeddings = np.stack([get_embedding(c) for c in chunks])
+def process_file_background(user_id: int, path: str, filename: str, doc_id: str = None, progress=None):
+    """
+    Stream a document through reader -> chunker -> near-duplicate filter ->
+    batched embedder -> index append, committing every INGEST_COMMIT_EVERY
+    chunks. A retried job (same doc_id) skips the chunks an earlier attempt
+    already committed. progress(done, total) is called after each commit.
+    Returns {"chunks": kept, "dropped": near-duplicates}.
+    """
+    reader = PageReader(path, filename)
+    pieces = metrics.TimedIter(reader)
+    deduper = Deduper()
+    timed_chunks = metrics.TimedIter(deduper.filter(iter_chunks(pieces)))
+    chunks = timed_chunks
+    skip = committed_chunks(user_id, doc_id) if doc_id else 0
+    if skip:
+        chunks = itertools.islice(chunks, skip, None)
 
-    # Replace old embeddings for this user
-    add_embeddings(user_id, embeddings)
+    count = skip
+    for batch in batched(chunks, INGEST_COMMIT_EVERY):
+        embeddings = get_embeddings([c[0] for c in batch])
+        with metrics.stage("index_append"):
+            add_document(user_id, filename, batch, embeddings, doc_id=doc_id)
+        count += len(batch)
+        if progress:
+            progress(reader.done, reader.total)
+    # chunking time (including deduplication) excludes the reader it pulls from
+    metrics.observe("parse", pieces.seconds)
+    metrics.observe("chunk", timed_chunks.seconds - pieces.seconds)
 
-    # Save chunks
-    chunks_path = os.path.join(FAISS_DIR, f"{user_id}_chunks.pkl")
-    with open(chunks_path, "wb") as f:
-        pickle.dump(chunks, f)
+    stats = embedding_cache_stats()
+    hit_ratio = f" embed cache hit ratio={stats['hit_ratio']:.2%}" if stats.get("hit_ratio") is not None else ""
+    print(f"ingest user={user_id} chunks={count} dropped={deduper.dropped}{hit_ratio}", flush=True)
+    return {"chunks": count, "dropped": deduper.dropped}
+
+def spool_upload(src, path: str):
+    with open(path, "wb") as out:
+        shutil.copyfileobj(src, out)
 
 # ------------------------------
 # POST /ingest
@@ -68,16 +145,30 @@ def process_file_background(user_id: int, text: str):
 async def ingest(
     file: UploadFile = File(...),
     user_id: int = Depends(get_user_id),
-    background_tasks: BackgroundTasks = None
 ):
-    # Read file synchronously (quick)
-    text = read_file(file)
+    ext = file_extension(file.filename)
+    if ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(400, "Unsupported file type")
 
-    # Schedule heavy work in background
-    background_tasks.add_task(process_file_background, user_id, text)
+    # Spool the upload to disk off the event loop; the worker picks it up from the job queue
+    path = os.path.join(jobs.INGEST_SPOOL_DIR, f"{uuid.uuid4().hex}.{ext}")
+    await run_in_threadpool(spool_upload, file.file, path)
+    job_id = await run_in_threadpool(jobs.enqueue, user_id, file.filename, path)
 
     # Respond immediately
-    return {"status": "accepted", "message": "File is being processed in background"}
+    return {"status": "accepted", "job_id": job_id, "message": "File is queued for processing"}
+
+
+# ------------------------------
+# GET /ingest/jobs/{job_id}
+# ------------------------------
+@router.get("/ingest/jobs/{job_id}")
+def ingest_job(job_id: str, user_id: int = Depends(get_user_id)):
+    job = jobs.get_job(job_id)
+    if job is None or job["user_id"] != user_id:
+        raise HTTPException(404, "Job not found")
+    job.pop("path")
+    return job
 
 
 # ------------------------------
@@ -85,8 +176,8 @@ async def ingest(
 # ------------------------------
 @router.get("/ingest/status/{user_id}")
 def ingest_status(user_id: int):
-    chunks_path = os.path.join(FAISS_DIR, f"{user_id}_chunks.pkl")
-    if os.path.exists(chunks_path):
-        return {"status": "completed"}
-    return {"status": "processing"}
-
+    job = jobs.latest_job(user_id)
+    if job is None:
+        return {"status": "completed" if has_chunks(user_id) else "processing"}
+    status = {"queued": "processing", "running": "processing"}.get(job["status"], job["status"])
+    return {"status": status, "job_id": job["id"], "progress": job["progress"]}
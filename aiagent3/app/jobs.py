@@ -0,0 +1,261 @@
+# app/jobs.py
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from app import metrics
+
+# ------------------------------
+# Durable ingest job queue (SQLite, shared by web and worker processes)
+# ------------------------------
+JOBS_DB = os.getenv("JOBS_DB", "/tmp/ingest_jobs.sqlite3")
+# Uploads are spooled here until their job finishes
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", "/tmp/ingest_spool")
+os.makedirs(INGEST_SPOOL_DIR, exist_ok=True)
+
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "5"))  # seconds, doubled per attempt
+# A running job whose lease isn't renewed by progress updates is handed to another worker
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+# Max jobs running at once for a single tenant
+JOB_TENANT_CONCURRENCY = int(os.getenv("JOB_TENANT_CONCURRENCY", "1"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,              -- queued | running | completed | failed | cancelled
+    done INTEGER NOT NULL DEFAULT 0,   -- progress through the source (pages, chars or paragraphs)
+    total INTEGER NOT NULL DEFAULT 0,  -- size of the source in the same units (0 until known)
+    chunks INTEGER NOT NULL DEFAULT 0, -- chunks indexed
+    dropped INTEGER NOT NULL DEFAULT 0, -- near-duplicate chunks skipped
+    replaces TEXT,                     -- document deleted once this one is indexed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    error TEXT,
+    not_before REAL NOT NULL DEFAULT 0,
+    lease_until REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, not_before);
+CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, created_at);
+"""
+
+_ADDED_COLUMNS = {
+    "chunks": "INTEGER NOT NULL DEFAULT 0",
+    "dropped": "INTEGER NOT NULL DEFAULT 0",
+    "replaces": "TEXT",
+}
+
+_initialized = False
+
+
+def connect() -> sqlite3.Connection:
+    global _initialized
+    conn = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if not _initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        # Queues created before these columns existed
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for name, decl in _ADDED_COLUMNS.items():
+            if name not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {decl}")
+        _initialized = True
+    return conn
+
+
+@contextmanager
+def _db():
+    conn = connect()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def _as_dict(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["progress"] = round(100.0 * job["done"] / job["total"], 1) if job["total"] else 0.0
+    if job["status"] == "completed":
+        job["progress"] = 100.0
+    return job
+
+
+def enqueue(user_id: int, filename: str, path: str, replaces: str = None) -> str:
+    """
+    Queue an upload; the job id doubles as the document id. With replaces,
+    that document is deleted once this one is indexed.
+    """
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with _db() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, user_id, filename, path, status, max_attempts, replaces, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?)",
+            (job_id, user_id, filename, path, JOB_MAX_ATTEMPTS, replaces, now, now),
+        )
+    return job_id
+
+
+def get_job(job_id: str):
+    with _db() as conn:
+        return _as_dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+
+def pending_jobs(user_id: int):
+    """
+    The tenant's queued and running jobs, oldest first.
+    """
+    with _db() as conn:
+        rows = conn.execute(
+            "SELECT * FROM jobs WHERE user_id = ? AND status IN ('queued', 'running') ORDER BY created_at", (user_id,)
+        ).fetchall()
+        return [_as_dict(row) for row in rows]
+
+
+def cancel(job_id: str) -> bool:
+    """
+    Cancel a job that hasn't started; False if it is already running or done.
+    """
+    with _db() as conn:
+        cur = conn.execute(
+            "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status = 'queued'",
+            (time.time(), job_id),
+        )
+    if cur.rowcount:
+        _drop_spool(job_id)
+    return bool(cur.rowcount)
+
+
+def latest_job(user_id: int):
+    with _db() as conn:
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE user_id = ? ORDER BY created_at DESC LIMIT 1", (user_id,)
+        ).fetchone()
+        return _as_dict(row)
+
+
+def claim_next(tenant_limit: int = None):
+    """
+    Atomically take the oldest runnable job whose tenant is under its
+    concurrency limit. Jobs whose lease expired (dead worker) are runnable.
+    """
+    tenant_limit = tenant_limit or JOB_TENANT_CONCURRENCY
+    now = time.time()
+    conn = connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        expired = [
+            r["id"] for r in conn.execute(
+                "SELECT id FROM jobs WHERE status = 'running' AND lease_until < :now AND attempts >= max_attempts",
+                {"now": now},
+            )
+        ]
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', error = 'worker lease expired', updated_at = :now"
+            " WHERE status = 'running' AND lease_until < :now AND attempts >= max_attempts",
+            {"now": now},
+        )
+        row = conn.execute(
+            """
+            SELECT * FROM jobs
+            WHERE ((status = 'queued' AND not_before <= :now)
+                   OR (status = 'running' AND lease_until < :now))
+              AND user_id NOT IN (
+                  SELECT user_id FROM jobs
+                  WHERE status = 'running' AND lease_until >= :now
+                  GROUP BY user_id HAVING COUNT(*) >= :limit)
+            ORDER BY created_at
+            LIMIT 1
+            """,
+            {"now": now, "limit": tenant_limit},
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, error = NULL,"
+                " lease_until = ?, updated_at = ? WHERE id = ?",
+                (now + JOB_LEASE_SECONDS, now, row["id"]),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    # Out of attempts: nothing will read their uploads again
+    for job_id in expired:
+        _drop_spool(job_id)
+    return get_job(row["id"]) if row is not None else None
+
+
+def update_progress(job_id: str, done: int, total: int):
+    now = time.time()
+    with _db() as conn:
+        conn.execute(
+            "UPDATE jobs SET done = ?, total = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+            (done, total, now + JOB_LEASE_SECONDS, now, job_id),
+        )
+
+
+def complete(job_id: str, chunks: int = 0, dropped: int = 0):
+    with _db() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = 'completed', done = total, chunks = ?, dropped = ?, updated_at = ? WHERE id = ?",
+            (chunks, dropped, time.time(), job_id),
+        )
+    _drop_spool(job_id)
+
+
+def fail(job_id: str, error: str):
+    """
+    Record a failed attempt: requeue with exponential backoff, or mark the
+    job failed once it has used all its attempts.
+    """
+    job = get_job(job_id)
+    if job is None:
+        return
+    now = time.time()
+    if job["attempts"] < job["max_attempts"]:
+        delay = JOB_RETRY_BACKOFF * 2 ** (job["attempts"] - 1)
+        status, not_before = "queued", now + delay
+    else:
+        status, not_before = "failed", 0
+    with _db() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, not_before = ?, lease_until = 0, updated_at = ? WHERE id = ?",
+            (status, error[-2000:], not_before, now, job_id),
+        )
+    if status == "failed":
+        _drop_spool(job_id)
+
+
+def queue_depth() -> dict:
+    with _db() as conn:
+        rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+
+@metrics.gauge("aiagent_ingest_jobs", "Ingest jobs by status.", ("status",))
+def _jobs_by_status():
+    return [((status,), n) for status, n in queue_depth().items()]
+
+
+@metrics.counter("aiagent_ingest_chunks_total", "Chunks of completed ingest jobs, indexed or dropped as near-duplicates.", ("outcome",))
+def _chunk_totals():
+    with _db() as conn:
+        row = conn.execute("SELECT SUM(chunks) AS kept, SUM(dropped) AS dropped FROM jobs WHERE status = 'completed'").fetchone()
+    return [(("indexed",), row["kept"] or 0), (("dropped",), row["dropped"] or 0)]
+
+
+def _drop_spool(job_id: str):
+    job = get_job(job_id)
+    if job and os.path.exists(job["path"]):
+        os.remove(job["path"])
@@ -0,0 +1,169 @@
+# app/lexical.py
+import hashlib
+import os
+import re
+import numpy as np
+from collections import Counter
+from functools import lru_cache
+
+# ------------------------------
+# Append-only BM25 inverted index, one per tenant, row-aligned with the chunk store
+# ------------------------------
+#   {user_id}_lex.post  POSTING records (term hash, chunk id, term frequency), in chunk order
+#   {user_id}_lex.docs  one DOC record per chunk: token count and end offset of its postings
+POSTING = np.dtype([("term", "<u8"), ("chunk", "<i4"), ("tf", "<u2")])
+DOC = np.dtype([("length", "<i4"), ("end", "<i8")])
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Words, numbers and identifiers like INV-2024-0042 or AB12.x (kept whole, and split into parts)
+_TOKEN = re.compile(r"\w+(?:[-_./:#]\w+)*")
+_PARTS = re.compile(r"[-_./:#]")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in into is it its me my no not of on "
+    "or our she so than that the their them then there these they this to was we were what when where "
+    "which who will with you your".split()
+)
+
+
+def lexical_paths(directory: str, user_id: int):
+    base = os.path.join(directory, f"{user_id}_lex")
+    return base + ".post", base + ".docs"
+
+
+def tokenize(text: str):
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        if _PARTS.search(token):
+            tokens.extend(p for p in _PARTS.split(token) if p and p not in _STOPWORDS)
+    return tokens
+
+
+@lru_cache(maxsize=65536)
+def term_hash(token: str) -> int:
+    # Stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def indexed_count(directory: str, user_id: int) -> int:
+    docs_path = lexical_paths(directory, user_id)[1]
+    return os.path.getsize(docs_path) // DOC.itemsize if os.path.exists(docs_path) else 0
+
+
+def append_terms(directory: str, user_id: int, first_id: int, texts) -> int:
+    """
+    Index texts as chunks first_id, first_id + 1, ... Caller holds the tenant
+    lock and first_id must equal indexed_count(). Returns chunks written.
+    """
+    post_path, docs_path = lexical_paths(directory, user_id)
+    with open(docs_path, "a+b") as docs:
+        # Drop a torn record left by a crash so row numbers stay aligned
+        count = docs.seek(0, os.SEEK_END) // DOC.itemsize
+        docs.truncate(count * DOC.itemsize)
+        if first_id != count:
+            raise ValueError(f"lexical index has {count} chunks, asked to append at {first_id}")
+        if count:
+            docs.seek((count - 1) * DOC.itemsize)
+            end = int(np.frombuffer(docs.read(DOC.itemsize), dtype=DOC)[0]["end"])
+        else:
+            end = 0
+
+        postings, records = [], []
+        for offset, text in enumerate(texts):
+            tokens = tokenize(text)
+            counts = Counter(tokens)
+            for token, tf in counts.items():
+                postings.append((term_hash(token), first_id + offset, min(tf, 65535)))
+            end += len(counts) * POSTING.itemsize
+            records.append((len(tokens), end))
+
+        with open(post_path, "ab") as post:
+            # Postings past the last complete doc record belong to a crashed append
+            post.truncate(end - len(postings) * POSTING.itemsize)
+            post.write(np.array(postings, dtype=POSTING).tobytes())
+            post.flush()
+            os.fsync(post.fileno())
+
+        docs.seek(0, os.SEEK_END)
+        docs.write(np.array(records, dtype=DOC).tobytes())
+        docs.flush()
+        os.fsync(docs.fileno())
+    return len(records)
+
+
+class LexicalIndex:
+    """
+    In-memory BM25 view over a tenant's postings, sorted by term so each
+    query term is two binary searches. Given the previous view of the same
+    files, only postings appended since are read and merged in.
+    """
+
+    def __init__(self, directory: str, user_id: int, previous: "LexicalIndex" = None):
+        post_path, docs_path = lexical_paths(directory, user_id)
+        n_docs = indexed_count(directory, user_id)
+        docs = np.fromfile(docs_path, dtype=DOC, count=n_docs) if n_docs else np.empty(0, DOC)
+        self.n_postings = int(docs[-1]["end"]) // POSTING.itemsize if len(docs) else 0
+        self.inode = os.stat(post_path).st_ino if os.path.exists(post_path) else None
+
+        if previous is None or previous.inode != self.inode or previous.n_postings > self.n_postings:
+            previous = None
+        skip = previous.n_postings if previous is not None else 0
+        new = np.fromfile(post_path, dtype=POSTING, count=self.n_postings - skip, offset=skip * POSTING.itemsize) \
+            if self.n_postings > skip else np.empty(0, POSTING)
+        terms, chunks, tf = new["term"], new["chunk"], new["tf"]
+        if previous is not None:
+            terms = np.concatenate([previous.terms, terms])
+            chunks = np.concatenate([previous.chunks, chunks])
+            tf = np.concatenate([previous.tf, tf])
+        # Stable sort merges the already-sorted prefix with the new run in ~linear time
+        order = np.argsort(terms, kind="stable")
+        self.terms = np.ascontiguousarray(terms[order])
+        self.chunks = np.ascontiguousarray(chunks[order])
+        self.tf = np.ascontiguousarray(tf[order])
+
+        self.lengths = docs["length"].astype("float32")
+        avgdl = float(self.lengths.mean()) if len(docs) else 1.0
+        # The tf / length part of BM25 is fixed per posting; only idf depends on the query
+        tf = self.tf.astype("float32")
+        norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.lengths[self.chunks] / max(avgdl, 1.0))
+        self.weights = tf * (BM25_K1 + 1.0) / (tf + norm)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @property
+    def nbytes(self) -> int:
+        return self.terms.nbytes + self.chunks.nbytes + self.tf.nbytes + self.weights.nbytes + self.lengths.nbytes + 1024
+
+    def search(self, query: str, k: int, exclude=None):
+        """
+        Top-k chunk ids by BM25 score for query, best first, as (ids, scores).
+        exclude: chunk ids (tombstones) to leave out.
+        """
+        n = len(self)
+        scores = None
+        for h in {term_hash(token) for token in tokenize(query)}:
+            h = np.uint64(h)
+            lo, hi = np.searchsorted(self.terms, h, "left"), np.searchsorted(self.terms, h, "right")
+            if lo == hi:
+                continue
+            idf = np.float32(np.log(1.0 + (n - (hi - lo) + 0.5) / ((hi - lo) + 0.5)))
+            if scores is None:
+                scores = np.zeros(n, dtype="float32")
+            # A term's postings name each chunk once, so plain fancy-index += is safe
+            scores[self.chunks[lo:hi]] += idf * self.weights[lo:hi]
+        if scores is None:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+        if exclude is not None and len(exclude):
+            scores[exclude[exclude < n]] = 0
+            if not scores.any():
+                return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+
+        k = min(k, int(np.count_nonzero(scores)))
+        top = np.argpartition(-scores, k - 1)[:k] if k < n else np.arange(n)
+        top = top[np.argsort(-scores[top], kind="stable")][:k]
+        return top.astype("int64"), scores[top]
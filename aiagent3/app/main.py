@@ -1,6 +1,11 @@
 import traceback
+from app import startup as boot  # (startup() below is the event handler)
+boot.install_import_timer()  # STARTUP_PROFILE=1; must run before the heavy imports below
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app import metrics
 
 print("=== STEP 0: main.py imported ===", flush=True)
 
@@ -18,8 +23,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Request latency histogram and, with METRICS_TIMING_HEADER=1, Server-Timing
+app.add_middleware(metrics.MetricsMiddleware)
+
 # --------------------
 # Root
 # --------------------
@@ -27,6 +36,20 @@ app.add_middleware(
 def root():
     return {"status": "alive"}
 
+# --------------------
+# Readiness: 503 until the model and hot indexes are warm
+# --------------------
+@app.get("/ready")
+def ready():
+    return JSONResponse(boot.report(), status_code=200 if boot.is_ready() else 503)
+
+# --------------------
+# Prometheus scrape endpoint
+# --------------------
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 def trace(msg: str):
     print(f"🔍 {msg}", flush=True)
 
@@ -35,19 +58,28 @@ def trace(msg: str):
 # --------------------
 try:
     trace("importing auth router")
-    from app.auth import router as auth_router
+    with boot.stage("import auth router"):
+        from app.auth import router as auth_router
     app.include_router(auth_router, prefix="/api/auth", tags=["auth"])
 
     trace("importing ingest router")
-    from app.ingest import router as ingest_router
+    with boot.stage("import ingest router"):
+        from app.ingest import router as ingest_router
     app.include_router(ingest_router, prefix="/api", tags=["ingest"])
 
+    trace("importing documents router")
+    with boot.stage("import documents router"):
+        from app.documents import router as documents_router
+    app.include_router(documents_router, prefix="/api", tags=["documents"])
+
     trace("importing query router")
-    from app.query import router as query_router
+    with boot.stage("import query router"):
+        from app.query import router as query_router
     app.include_router(query_router, prefix="/api", tags=["query"])
 
     trace("importing automation router")
-    from app.automation import router as automation_router
+    with boot.stage("import automation router"):
+        from app.automation import router as automation_router
     app.include_router(automation_router, prefix="/api", tags=["automation"])
 
     trace("ALL ROUTERS LOADED SUCCESSFULLY")
@@ -64,10 +96,34 @@ except Exception:
 async def startup():
     trace("startup entered")
     try:
-        from app.database import Base, engine
-        Base.metadata.create_all(bind=engine)
+        with boot.stage("db init"):
+            from app.database import Base, engine
+            Base.metadata.create_all(bind=engine)
         trace("db ready")
     except Exception:
         trace("⚠️ db init failed")
         traceback.print_exc()
         raise
+
+    # Ingest jobs run on a process pool; see app/worker.py
+    from app.worker import INGEST_WORKER_MODE, start_embedded
+    if INGEST_WORKER_MODE == "embedded":
+        app.state.ingest_worker_stop = start_embedded()
+        trace("ingest worker started")
+
+    # Model, LLM client and hot indexes load in the background; see /ready
+    boot.start_warm_up()
+    if boot.STARTUP_PROFILE:
+        boot.print_report()
+
+@app.on_event("shutdown")
+async def shutdown():
+    stop = getattr(app.state, "ingest_worker_stop", None)
+    if stop is not None:
+        stop.set()
+
+    from app.clientell import close_client
+    await close_client()
+
+    from app.sms import dispatcher
+    dispatcher.close()
@@ -0,0 +1,276 @@
+# app/metrics.py
+# In-process Prometheus metrics, rendered in the text exposition format by
+# GET /metrics. Hot paths only do a bisect and a few increments; cache,
+# queue and per-tenant index figures are read from the existing stats()
+# methods at scrape time.
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.getenv("METRICS", "1") == "1"
+# Add a Server-Timing header with the stages each request went through
+METRICS_TIMING_HEADER = os.getenv("METRICS_TIMING_HEADER", "0") == "1"
+# Serve /metrics from a standalone ingest worker (python -m app.worker) on this port
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stage durations of the current request, for the Server-Timing header
+_request_stages = contextvars.ContextVar("request_stages", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _num(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# ------------------------------
+# Metric types
+# ------------------------------
+class Histogram:
+    def __init__(self, name: str, doc: str, labelnames=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def merge(self, labelvalues, series):
+        with self._lock:
+            mine = self._series.setdefault(tuple(labelvalues), [0] * (len(self.buckets) + 1) + [0.0, 0])
+            for i, v in enumerate(series):
+                mine[i] += v
+
+    def drain(self) -> list:
+        with self._lock:
+            out = [(list(k), v) for k, v in self._series.items()]
+            self._series.clear()
+        return out
+
+    def render(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = [(k, list(v)) for k, v in self._series.items()]
+        for labelvalues, counts in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                labels = _labels(self.labelnames + ("le",), labelvalues + (_num(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_num(counts[-2])}"
+            yield f"{self.name}_count{labels} {counts[-1]}"
+
+
+class Collected:
+    """
+    A gauge or counter family whose samples come from fn() at scrape time:
+    fn returns [(label values tuple, value), ...].
+    """
+
+    def __init__(self, name: str, doc: str, kind: str, labelnames, fn):
+        self.name = name
+        self.doc = doc
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def render(self):
+        try:
+            samples = list(self.fn())
+        except Exception as e:
+            yield f"# {self.name} unavailable: {_escape(e)}"
+            return
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for labelvalues, value in samples:
+            yield f"{self.name}{_labels(self.labelnames, labelvalues)} {_num(value)}"
+
+
+# ------------------------------
+# Registry
+# ------------------------------
+_registry = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def gauge(name: str, doc: str, labelnames=()):
+    """
+    Decorator registering a scrape-time gauge.
+    """
+    def wrap(fn):
+        register(Collected(name, doc, "gauge", labelnames, fn))
+        return fn
+    return wrap
+
+
+def counter(name: str, doc: str, labelnames=()):
+    """
+    Decorator registering a scrape-time counter (monotonic totals kept elsewhere).
+    """
+    def wrap(fn):
+        register(Collected(name, doc, "counter", labelnames, fn))
+        return fn
+    return wrap
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = register(Histogram(
+    "aiagent_stage_seconds",
+    "Time spent in each hot-path stage (parse, chunk, embed_batch, index_append, index_load, lexical_load, "
+    "faiss_search, lexical_search, chunk_lookup, context_build, llm, llm_first_token, sms_send).",
+    ("stage",),
+))
+REQUEST_SECONDS = register(Histogram(
+    "aiagent_http_request_seconds", "HTTP request latency by endpoint.", ("method", "handler", "status"),
+))
+
+
+def observe(stage_name: str, seconds: float):
+    if not METRICS_ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, stage_name)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage_name] = stages.get(stage_name, 0.0) + seconds
+
+
+@contextmanager
+def stage(stage_name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage_name, time.perf_counter() - t0)
+
+
+class TimedIter:
+    """
+    Wraps an iterator and adds up the time spent producing its items.
+    """
+
+    def __init__(self, iterable):
+        self._it = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try:
+            return next(self._it)
+        finally:
+            self.seconds += time.perf_counter() - t0
+
+
+# ------------------------------
+# Stage timings from ingest pool processes
+# ------------------------------
+def drain_stages() -> list:
+    """
+    Stage series recorded in this process since the last drain; the ingest
+    pool returns them with each job so the parent's /metrics includes them.
+    """
+    return STAGE_SECONDS.drain()
+
+
+def merge_stages(series: list):
+    for labelvalues, counts in series or ():
+        STAGE_SECONDS.merge(labelvalues, counts)
+
+
+# ------------------------------
+# ASGI middleware: request latency + optional Server-Timing header
+# ------------------------------
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+
+        stages = {}
+        token = _request_stages.set(stages)
+        t0 = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if METRICS_TIMING_HEADER:
+                    # Stages finished before the first byte; a streamed body's LLM time isn't included
+                    timing = [f"{name};dur={s * 1000:.2f}" for name, s in stages.items()]
+                    timing.append(f"app;dur={(time.perf_counter() - t0) * 1000:.2f}")
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"server-timing", ", ".join(timing).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stages.reset(token)
+            # Endpoint names keep label cardinality bounded; unmatched paths are lumped together
+            handler = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            REQUEST_SECONDS.observe(time.perf_counter() - t0, scope["method"], handler, str(status[0]))
+
+
+# ------------------------------
+# Standalone endpoint (external ingest worker)
+# ------------------------------
+def serve_http(port: int = METRICS_PORT):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            found = self.path == "/metrics"
+            body = render().encode() if found else b""
+            self.send_response(200 if found else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    return server
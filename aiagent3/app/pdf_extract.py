@@ -0,0 +1,66 @@
+# app/pdf_extract.py
+# PDF text extraction, fanned out over page ranges on a process pool.
+# Kept free of app imports so pool processes start quickly.
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import fitz  # PyMuPDF
+
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# Smaller documents are extracted inline; pool round-trips would cost more than they save
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def page_count(path: str) -> int:
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def extract_range(path: str, start: int, end: int):
+    """
+    Text of pages [start, end) (0-based). Runs in a pool process.
+    """
+    with fitz.open(path) as doc:
+        return [doc[i].get_text() for i in range(start, end)]
+
+
+def iter_pages(path: str, total: int = None):
+    """
+    Yield (page_number, text) in order, 1-based. Large PDFs are split into
+    PDF_PAGES_PER_TASK ranges extracted in parallel, with at most two ranges
+    per worker in flight so memory stays bounded.
+    """
+    total = page_count(path) if total is None else total
+    if PDF_EXTRACT_WORKERS <= 1 or total < PDF_PARALLEL_MIN_PAGES:
+        with fitz.open(path) as doc:
+            for i, page in enumerate(doc):
+                yield i + 1, page.get_text()
+        return
+
+    pool = _get_pool()
+    ranges = deque((s, min(s + PDF_PAGES_PER_TASK, total)) for s in range(0, total, PDF_PAGES_PER_TASK))
+    in_flight = deque()
+    while ranges or in_flight:
+        while ranges and len(in_flight) < 2 * PDF_EXTRACT_WORKERS:
+            start, end = ranges.popleft()
+            in_flight.append((start, pool.submit(extract_range, path, start, end)))
+        start, future = in_flight.popleft()
+        for offset, text in enumerate(future.result()):
+            yield start + offset + 1, text
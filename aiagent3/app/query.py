@@ -1,26 +1,44 @@
 # app/routes/query.py 
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+import asyncio
 import os
-import requests
+import json
+import time
 import numpy as np
-import pickle
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.security import decode_access_token
-from app.index import get_index
-from app.embedder import get_embedding
-from app.clientell import client  # your OpenAI client
+from app.index import get_index, load_chunks, load_lexical, index_cache, get_index_params, set_search_params, index_fingerprint
+from app.embedder import embed_async, get_embeddings
+from app.answer_cache import answer_cache
+from app import context
+from app.clientell import get_client  # your OpenAI client
+from app.sms import send_sms
+from app import metrics
 
 router = APIRouter()
 security = HTTPBearer()
 
 # -----------------------------
-# Twilio credentials from environment
+# Hybrid retrieval: dense (FAISS) + lexical (BM25) rankings fused by weighted reciprocal rank
 # -----------------------------
-TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
-TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
-TWILIO_SMS_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")  # SMS-enabled Twilio number
+# Most chunks in the prompt; the context token budget usually binds first
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "8"))
+RETRIEVAL_MAX_K = int(os.getenv("RETRIEVAL_MAX_K", "20"))
+# Taken from each ranking before fusion; the fused top ones are the MMR candidates
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+RETRIEVAL_DENSE_WEIGHT = float(os.getenv("RETRIEVAL_DENSE_WEIGHT", "1.0"))
+RETRIEVAL_LEXICAL_WEIGHT = float(os.getenv("RETRIEVAL_LEXICAL_WEIGHT", "1.0"))  # 0 = dense only
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# -----------------------------
+# Batch queries (/query/batch)
+# -----------------------------
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "64"))  # questions per request
+QUERY_BATCH_LLM_CONCURRENCY = int(os.getenv("QUERY_BATCH_LLM_CONCURRENCY", "8"))  # LLM calls in flight per batch
 
 # -----------------------------
 # JWT dependency
@@ -34,11 +52,40 @@ def get_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -
         raise HTTPException(status_code=401, detail="Invalid token")
 
 # -----------------------------
-# Request model
+# Request models
 # -----------------------------
-class QueryRequest(BaseModel):
+class RetrievalOptions(BaseModel):
+    use_cache: bool = True  # serve near-duplicate questions from the answer cache
+    k: Optional[int] = None  # most chunks of context, default RETRIEVAL_K
+    dense_weight: Optional[float] = None
+    lexical_weight: Optional[float] = None
+    max_context_tokens: Optional[int] = None  # capped at the model's CONTEXT_TOKEN_BUDGET(S)
+    mmr_lambda: Optional[float] = None  # default MMR_LAMBDA
+
+    def retrieval_settings(self):
+        """
+        (k, dense weight, lexical weight, token budget, MMR lambda)
+        """
+        k = min(max(1, self.k or RETRIEVAL_K), RETRIEVAL_MAX_K)
+        dense = RETRIEVAL_DENSE_WEIGHT if self.dense_weight is None else self.dense_weight
+        lexical = RETRIEVAL_LEXICAL_WEIGHT if self.lexical_weight is None else self.lexical_weight
+        budget = context.token_budget(get_client().model)
+        if self.max_context_tokens:
+            budget = min(max(1, self.max_context_tokens), budget)
+        lam = context.MMR_LAMBDA if self.mmr_lambda is None else min(max(0.0, self.mmr_lambda), 1.0)
+        return k, dense, lexical, budget, lam
+
+class QueryRequest(RetrievalOptions):
     query: str
     send_sms_to: Optional[str] = None
+    stream: bool = False  # answer as Server-Sent Events
+
+class BatchQueryRequest(RetrievalOptions):
+    queries: List[str]
+
+class SearchParams(BaseModel):
+    nprobe: Optional[int] = None
+    efSearch: Optional[int] = None
 
 # -----------------------------
 # Summarization helper
@@ -51,71 +98,360 @@ def summarize_text(text: str) -> str:
     return summary
 
 # -----------------------------
-# Helper: send SMS in background
+# Helper: queue the answer summary on the SMS dispatcher
 # -----------------------------
-def send_sms_background(to_number: str, body: str):
+def queue_sms(user_id: int, to_number: str, answer: str):
+    """
+    Returns the message id for GET /api/sms/{id}, or None if it couldn't be queued.
+    """
     try:
-        payload = {
-            "From": TWILIO_SMS_NUMBER,
-            "To": to_number,
-            "Body": body
-        }
-        url = f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
-        requests.post(url, data=payload, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN))
+        return send_sms(to_number, summarize_text(answer), user_id)
     except Exception as e:
         print(f"SMS send failed: {e}")
+        return None
+
+def build_prompt(query: str, retrieved_texts) -> str:
+    return (
+        "You are an assistant. Use the following context to answer the question:\n\n"
+        f"Context:\n{chr(10).join(retrieved_texts)}\n\n"
+        f"Question: {query}\nAnswer:"
+    )
+
+async def embed_query(query: str, timings: dict):
+    # Micro-batched with other in-flight queries on the embedder thread
+    t0 = time.perf_counter()
+    qvec = await asyncio.wrap_future(embed_async(query))
+    timings["embed_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    return qvec
+
+def fuse_scores(rankings, weights, k: int):
+    """
+    Weighted reciprocal rank fusion of ranked id lists; top k (id, score) pairs.
+    """
+    scores = {}
+    for ids, weight in zip(rankings, weights):
+        if weight <= 0:
+            continue
+        for rank, i in enumerate(ids):
+            scores[i] = scores.get(i, 0.0) + weight / (RRF_K + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+def fuse(rankings, weights, k: int):
+    """
+    Weighted reciprocal rank fusion of ranked id lists; top k ids.
+    """
+    return [i for i, _ in fuse_scores(rankings, weights, k)]
+
+def retrieve_many(user_id: int, queries, qvecs: np.ndarray, timings: dict, settings=None):
+    """
+    Run the dense and lexical searches for many queries (embedded as the
+    rows of qvecs), fetch the fused candidates of all of them in one pass
+    over the chunk store, then build each prompt context by MMR within the
+    token budget. settings is RetrievalOptions.retrieval_settings().
+    Returns (hits per query, {chunk id: text}, chunk store, context usage
+    per query), or a message string when there is nothing to answer from.
+    Stage durations (ms) are recorded in timings.
+    """
+    index = get_index(user_id)
+    if index.ntotal == 0:
+        return "No documents ingested yet."
+
+    try:
+        chunks = load_chunks(user_id)
+    except Exception:
+        return "Failed to load document chunks."
+
+    if chunks is None:
+        return "No document chunks found for this user."
+    if chunks.live == 0:
+        return "No documents ingested yet."
+    # Deleted documents' ids, left out of both rankings
+    deleted = chunks.deleted_ids
+
+    k, dense_weight, lexical_weight, budget, lam = settings or RetrievalOptions().retrieval_settings()
+    depth = max(k, RETRIEVAL_CANDIDATES)
+    t1 = time.perf_counter()
+    # One multi-query search; FAISS parallelizes over the rows
+    D, I = index.search(np.ascontiguousarray(qvecs, dtype="float32"), k=min(depth, index.ntotal), exclude=deleted)
+    dense = [[int(i) for i in row if i >= 0] for row in I]
+    t2 = time.perf_counter()
+    timings["search_ms"] = round((t2 - t1) * 1000, 2)
+    metrics.observe("faiss_search", t2 - t1)
+
+    if lexical_weight > 0:
+        lex = load_lexical(user_id)
+        ranked = [
+            fuse_scores([ids, lex.search(query, depth, exclude=deleted)[0].tolist()], [dense_weight, lexical_weight], depth)
+            for query, ids in zip(queries, dense)
+        ]
+        t3 = time.perf_counter()
+        timings["lexical_ms"] = round((t3 - t2) * 1000, 2)
+        metrics.observe("lexical_search", t3 - t2)
+        t2 = t3
+    else:
+        # Dense only: MMR falls back to cosine relevance
+        ranked = [[(i, None) for i in ids] for ids in dense]
+
+    ranked = [[(i, score) for i, score in pairs if i < len(chunks)] for pairs in ranked]
+    candidates = [[i for i, _ in pairs] for pairs in ranked]
+    union = sorted({i for ids in candidates for i in ids})
+    texts = dict(zip(union, chunks.get_many(union)))
+    t3 = time.perf_counter()
+    timings["chunks_ms"] = round((t3 - t2) * 1000, 2)
+    metrics.observe("chunk_lookup", t3 - t2)
+
+    # The candidates' vectors are already in the index; no re-embedding
+    vectors = dict(zip(union, index.vectors(union)))
+    hits, usage = [], []
+    for qvec, ids, pairs in zip(qvecs, candidates, ranked):
+        rows = np.array([vectors[i] for i in ids], dtype="float32").reshape(len(ids), index.d)
+        # The fused score is the relevance, so lexical-only hits (exact identifiers) compete
+        relevance = [score for _, score in pairs] if lexical_weight > 0 else None
+        picked, tokens = context.select(qvec, ids, rows, texts, budget, k, lam, relevance)
+        hits.append(picked)
+        usage.append({"candidates": len(ids), "chunks": len(picked), "tokens": tokens, "budget": budget})
+    elapsed = time.perf_counter() - t3
+    timings["context_ms"] = round(elapsed * 1000, 2)
+    metrics.observe("context_build", elapsed)
+    return hits, texts, chunks, usage
+
+def retrieve(user_id: int, query: str, qvec, timings: dict, settings=None):
+    """
+    retrieve_many() for a single query. Returns (hits, texts, chunk store,
+    context usage) or a message string.
+    """
+    result = retrieve_many(user_id, [query], np.expand_dims(qvec, axis=0), timings, settings)
+    if isinstance(result, str):
+        return result
+    hits, texts, chunks, usage = result
+    return hits[0], [texts[i] for i in hits[0]], chunks, usage[0]
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def cache_headers(cached) -> dict:
+    if cached is None:
+        return {"X-Cache": "MISS"}
+    _, similarity, age = cached
+    return {"X-Cache": "HIT", "X-Cache-Similarity": f"{similarity:.4f}", "Age": str(int(age))}
 
 # -----------------------------
 # Endpoint: Query + SMS
 # -----------------------------
 @router.post("/query")
-async def query_agent(request: QueryRequest, background_tasks: BackgroundTasks, user_id: int = Depends(get_user_id)):
+async def query_agent(request: QueryRequest, response: Response, user_id: int = Depends(get_user_id)):
 
     query = request.query
-    index = get_index(user_id)
-    
-    if index.ntotal == 0:
-        return {"answer": "No documents ingested yet."}
+    timings = {}
+    qvec = await embed_query(query, timings)
 
-    qvec = np.expand_dims(get_embedding(query), axis=0)
-    D, I = index.search(qvec, k=min(3, index.ntotal))
+    # Near-duplicate of a question already answered against the same documents and settings
+    settings = request.retrieval_settings()
+    fingerprint = (index_fingerprint(user_id), settings)
+    cached = answer_cache.lookup(user_id, qvec, fingerprint) if request.use_cache else None
+    headers = cache_headers(cached) if request.use_cache else {}
 
-    # Use /tmp for persistent storage on Render
-    FAISS_DIR = "/tmp/faiss_index"
-    os.makedirs(FAISS_DIR, exist_ok=True)
-    chunks_path = os.path.join(FAISS_DIR, f"{user_id}_chunks.pkl")
+    if cached is not None:
+        answer, sources = cached[0]["answer"], cached[0]["sources"]
+        messages = usage = None
+    else:
+        # Index/lexical loads, the search and chunk reads all block: keep them off the event loop
+        retrieved = await run_in_threadpool(retrieve, user_id, query, qvec, timings, settings=settings)
+        if isinstance(retrieved, str):
+            return {"answer": retrieved}
+        hits, retrieved_texts, chunks, usage = retrieved
+        sources = [chunks.meta(i) for i in hits]
+        prompt = build_prompt(query, retrieved_texts)
+        messages = [{"role": "user", "content": prompt}]
 
-    if not os.path.exists(chunks_path):
-        return {"answer": "No document chunks found for this user."}
+    if request.stream:
+        if cached is not None:
+            body = stream_cached(request, user_id, answer, sources, timings)
+        else:
+            body = stream_answer(request, user_id, messages, sources, timings, (qvec, fingerprint), usage)
+        return StreamingResponse(
+            body,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **headers},
+        )
 
-    try:
-        with open(chunks_path, "rb") as f:
-            chunks = pickle.load(f)
-    except Exception:
-        return {"answer": "Failed to load document chunks."}
+    response.headers.update(headers)
+    if cached is None:
+        t0 = time.perf_counter()
+        try:
+            completion = await get_client().chat(
+                system="You are a helpful AI assistant.",
+                messages=messages
+            )
+            answer = completion["content"]
+            if request.use_cache:
+                answer_cache.store(user_id, qvec, fingerprint, {"answer": answer, "sources": sources})
+        except Exception as e:
+            answer = "LLM failed to generate answer: " + str(e)
+        timings["llm_total_ms"] = round((time.perf_counter() - t0) * 1000, 2)
 
-    retrieved_texts = [chunks[i] for i in I[0] if i < len(chunks)]
+    # -----------------------------
+    # Send via SMS if requested (sent by the dispatcher threads)
+    # -----------------------------
+    result = {"answer": answer, "sources": sources, "timings": timings}
+    if usage is not None:
+        result["context"] = usage
+    if request.send_sms_to:
+        result["sms_id"] = queue_sms(user_id, request.send_sms_to, answer)
 
-    prompt = (
-        "You are an assistant. Use the following context to answer the question:\n\n"
-        f"Context:\n{chr(10).join(retrieved_texts)}\n\n"
-        f"Question: {query}\nAnswer:"
-    )
+    return result
 
+async def stream_answer(request: QueryRequest, user_id: int, messages, sources, timings, cache_key=None, usage=None):
+    """
+    SSE body: one "retrieval" event with the sources (and context token
+    usage), a "token" event per streamed delta, then "done" with the timing
+    breakdown. A complete answer is stored in the answer cache under
+    cache_key (qvec, fingerprint) when one is given.
+    """
+    yield sse("retrieval", {"sources": sources} if usage is None else {"sources": sources, "context": usage})
+
+    parts = []
+    failed = False
+    t0 = time.perf_counter()
     try:
-        response = client.chat(
+        async for delta in get_client().chat_stream(
             system="You are a helpful AI assistant.",
-            messages=[{"role": "user", "content": prompt}]
-        )
-        answer = response["content"]
+            messages=messages
+        ):
+            if not parts:
+                timings["llm_first_token_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            parts.append(delta)
+            yield sse("token", {"text": delta})
     except Exception as e:
-        answer = "LLM failed to generate answer: " + str(e)
+        error = "LLM failed to generate answer: " + str(e)
+        parts.append(error)
+        failed = True
+        yield sse("error", {"detail": error})
+    timings["llm_total_ms"] = round((time.perf_counter() - t0) * 1000, 2)
 
-    # -----------------------------
-    # Send via SMS in background if requested
-    # -----------------------------
+    if cache_key is not None and request.use_cache and not failed:
+        qvec, fingerprint = cache_key
+        answer_cache.store(user_id, qvec, fingerprint, {"answer": "".join(parts), "sources": sources})
+
+    done = {"timings": timings}
+    if request.send_sms_to:
+        done["sms_id"] = queue_sms(user_id, request.send_sms_to, "".join(parts))
+    yield sse("done", done)
+
+async def stream_cached(request: QueryRequest, user_id: int, answer: str, sources, timings):
+    """
+    Cache hit: same event sequence as stream_answer, with the whole answer
+    in a single "token" event.
+    """
+    yield sse("retrieval", {"sources": sources})
+    yield sse("token", {"text": answer})
+    done = {"timings": timings}
     if request.send_sms_to:
-        summary = summarize_text(answer)
-        background_tasks.add_task(send_sms_background, request.send_sms_to, summary)
+        done["sms_id"] = queue_sms(user_id, request.send_sms_to, answer)
+    yield sse("done", done)
+
+# -----------------------------
+# Endpoint: many questions against one tenant's documents
+# -----------------------------
+@router.post("/query/batch")
+async def query_batch(request: BatchQueryRequest, user_id: int = Depends(get_user_id)):
+    """
+    Embeds all questions as one matrix, runs one multi-query search and one
+    chunk fetch for their union, then answers them with up to
+    QUERY_BATCH_LLM_CONCURRENCY concurrent LLM calls. Repeated questions are
+    answered once. Results come back in request order.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="No queries")
+    if len(request.queries) > QUERY_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {QUERY_BATCH_MAX} queries per batch")
+
+    queries = list(dict.fromkeys(request.queries))
+    timings = {"queries": len(request.queries), "unique": len(queries)}
+    t0 = time.perf_counter()
+    qvecs = await run_in_threadpool(get_embeddings, queries)
+    timings["embed_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+    settings = request.retrieval_settings()
+    fingerprint = (index_fingerprint(user_id), settings)
+    items = [{"query": q, "timings": {}} for q in queries]
+    todo = []
+    for i, (item, qvec) in enumerate(zip(items, qvecs)):
+        cached = answer_cache.lookup(user_id, qvec, fingerprint) if request.use_cache else None
+        if cached is not None:
+            item.update(answer=cached[0]["answer"], sources=cached[0]["sources"], cache=cache_headers(cached))
+        else:
+            item["cache"] = cache_headers(None) if request.use_cache else {}
+            todo.append(i)
+
+    if todo:
+        retrieved = await run_in_threadpool(
+            retrieve_many, user_id, [queries[i] for i in todo], qvecs[todo], timings, settings
+        )
+        if isinstance(retrieved, str):
+            for i in todo:
+                items[i].update(answer=retrieved, sources=[])
+            todo = []
+        else:
+            hits, texts, chunks, usage = retrieved
+            for i, ids, used in zip(todo, hits, usage):
+                items[i]["sources"] = [chunks.meta(c) for c in ids]
+                items[i]["context"] = used
+                items[i]["prompt"] = build_prompt(queries[i], [texts[c] for c in ids])
+
+    gate = asyncio.Semaphore(QUERY_BATCH_LLM_CONCURRENCY)
+
+    async def answer(i: int):
+        item = items[i]
+        async with gate:
+            t1 = time.perf_counter()
+            try:
+                completion = await get_client().chat(
+                    system="You are a helpful AI assistant.",
+                    messages=[{"role": "user", "content": item.pop("prompt")}]
+                )
+                item["answer"] = completion["content"]
+                if request.use_cache:
+                    answer_cache.store(user_id, qvecs[i], fingerprint, {"answer": item["answer"], "sources": item["sources"]})
+            except Exception as e:
+                item["answer"] = "LLM failed to generate answer: " + str(e)
+            item["timings"]["llm_total_ms"] = round((time.perf_counter() - t1) * 1000, 2)
+
+    t1 = time.perf_counter()
+    await asyncio.gather(*[answer(i) for i in todo])
+    timings["llm_wall_ms"] = round((time.perf_counter() - t1) * 1000, 2)
+    timings["total_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+    by_query = {item["query"]: item for item in items}
+    return {"results": [by_query[q] for q in request.queries], "timings": timings}
+
+# -----------------------------
+# Endpoint: what the caller has in the index / answer caches
+# (process-wide counters are on /metrics)
+# -----------------------------
+@router.get("/query/cache")
+def query_cache_stats(user_id: int = Depends(get_user_id)):
+    return {
+        "index": index_cache.tenant_stats(user_id),
+        "answer": answer_cache.tenant_stats(user_id),
+    }
+
+
+# -----------------------------
+# Endpoint: per-tenant ANN search settings
+# -----------------------------
+@router.get("/query/index")
+def query_index_info(user_id: int = Depends(get_user_id)):
+    index = get_index(user_id)
+    chunks = load_chunks(user_id)
+    return {
+        "kind": index.kind,
+        "ntotal": index.ntotal,
+        "delta": len(index.delta),
+        "tombstones": len(chunks.deleted_ids) if chunks is not None else 0,
+        "params": get_index_params(user_id),
+    }
 
-    return {"answer": answer}
+@router.put("/query/index")
+def query_index_update(params: SearchParams, user_id: int = Depends(get_user_id)):
+    return {"params": set_search_params(user_id, nprobe=params.nprobe, efSearch=params.efSearch)}
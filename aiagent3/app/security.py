@@ -1,16 +1,41 @@
 from jose import jwt
 from datetime import datetime, timedelta, timezone
 from passlib.context import CryptContext
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import asyncio
+import hashlib
 import os
+import threading
+import time
+from app import metrics
 
 # ------------------------------
 # Password & JWT settings
 # ------------------------------
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# Argon2 cost (memory in KiB). Existing hashes keep verifying with the
+# parameters they were made with and are re-hashed on the next login.
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__time_cost=ARGON2_TIME_COST,
+    argon2__memory_cost=ARGON2_MEMORY_COST,
+    argon2__parallelism=ARGON2_PARALLELISM,
+)
 JWT_SECRET = os.getenv("JWT_SECRET", "supersecret")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# Hashes running at once (each holds ARGON2_MEMORY_COST KiB), and how many
+# more may wait before new logins are turned away
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "64"))
+# Verified tokens remembered per process; 0 disables
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+
 
 # ------------------------------
 # Password hashing
@@ -23,6 +48,32 @@ def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
 
+class PasswordHasherBusy(Exception):
+    pass
+
+_hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="argon2")
+_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+async def _run_hash(fn, *args):
+    # argon2 releases the GIL, so the pool threads hash in parallel off the event loop
+    if not _hash_slots.acquire(blocking=False):
+        raise PasswordHasherBusy("Too many logins in progress, retry shortly")
+    try:
+        return await asyncio.wrap_future(_hash_pool.submit(fn, *args))
+    finally:
+        _hash_slots.release()
+
+async def hash_password_async(password: str) -> str:
+    return await _run_hash(pwd_context.hash, password)
+
+async def verify_password_async(plain: str, hashed: str):
+    """
+    Returns (valid, new_hash); new_hash is set when the stored hash used
+    outdated argon2 parameters and should be replaced.
+    """
+    return await _run_hash(pwd_context.verify_and_update, plain, hashed)
+
+
 # ------------------------------
 # JWT handling
 # ------------------------------
@@ -34,6 +85,60 @@ def create_access_token(data: dict, expires_delta=None) -> str:
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, JWT_SECRET, algorithm=ALGORITHM)
 
-def decode_access_token(token: str) -> dict:
-    return jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
 
+class TokenCache:
+    """
+    LRU of verified token claims keyed by sha256 of the token, so raw
+    tokens aren't kept around. Entries are dropped once their exp passes.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # digest -> (claims, exp)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str):
+        key = hashlib.sha256(token.encode("utf-8")).digest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[0])
+
+    def put(self, token: str, claims: dict):
+        exp = claims.get("exp")
+        if self.max_entries <= 0 or not isinstance(exp, (int, float)):
+            return
+        key = hashlib.sha256(token.encode("utf-8")).digest()
+        with self._lock:
+            self._entries[key] = (dict(claims), exp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+@metrics.counter("aiagent_token_cache_total", "Verified-JWT cache lookups.", ("result",))
+def _token_cache_counts():
+    s = token_cache.stats()
+    return [(("hit",), s["hits"]), (("miss",), s["misses"])]
+
+def decode_access_token(token: str) -> dict:
+    claims = token_cache.get(token)
+    if claims is None:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
+        token_cache.put(token, claims)
+    return claims
@@ -0,0 +1,349 @@
+# app/sms.py
+# Outbound SMS dispatcher: a bounded queue drained by worker threads that
+# share keep-alive sessions to Twilio, paced by a token bucket, with
+# retries and per-message delivery status.
+import base64
+import hashlib
+import heapq
+import hmac
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dotenv import load_dotenv
+from app import metrics
+
+load_dotenv()
+
+# ------------------------------
+# Twilio credentials & endpoint
+# ------------------------------
+TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
+TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
+TWILIO_SMS_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")  # Twilio SMS-enabled number
+# Point at a local fake Twilio for tests and benchmarks
+TWILIO_API_BASE = os.getenv("TWILIO_API_BASE", "https://api.twilio.com").rstrip("/")
+# Public URL of POST /api/sms/callback; Twilio reports delivery updates there when set
+SMS_STATUS_CALLBACK_URL = os.getenv("SMS_STATUS_CALLBACK_URL")
+
+# ------------------------------
+# Dispatcher settings
+# ------------------------------
+SMS_QUEUE_SIZE = int(os.getenv("SMS_QUEUE_SIZE", "1000"))  # new messages beyond this are refused
+SMS_WORKERS = int(os.getenv("SMS_WORKERS", "2"))
+# Twilio queues a long-code sender at 1 message/s; raise for toll-free / short codes
+SMS_RATE = float(os.getenv("SMS_RATE", "1"))  # messages per second
+SMS_BURST = int(os.getenv("SMS_BURST", "1"))  # bucket capacity
+SMS_MAX_ATTEMPTS = int(os.getenv("SMS_MAX_ATTEMPTS", "4"))
+SMS_RETRY_BACKOFF = float(os.getenv("SMS_RETRY_BACKOFF", "1"))  # seconds, doubled per attempt
+SMS_CONNECT_TIMEOUT = float(os.getenv("SMS_CONNECT_TIMEOUT", "5"))
+SMS_READ_TIMEOUT = float(os.getenv("SMS_READ_TIMEOUT", "15"))
+SMS_STATUS_MAX = int(os.getenv("SMS_STATUS_MAX", "10000"))  # finished message statuses remembered
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+PENDING_STATUS = {"queued", "sending", "retrying"}  # still owned by the send loop
+
+
+class SmsQueueFull(Exception):
+    pass
+
+
+class SmsNotConfigured(Exception):
+    pass
+
+
+def configured() -> bool:
+    return bool(TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN and TWILIO_SMS_NUMBER)
+
+
+def messages_url() -> str:
+    return f"{TWILIO_API_BASE}/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
+
+
+def never_sent(exc: Exception) -> bool:
+    """
+    True when a failed POST can't have reached Twilio: no connection was
+    made. After that (read timeout, reset mid-response) it may have been
+    accepted, and sending it again could deliver it twice.
+    """
+    import requests
+    from urllib3.exceptions import NewConnectionError
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.exceptions.ConnectionError) and exc.args:
+        return isinstance(getattr(exc.args[0], "reason", None), NewConnectionError)
+    return False
+
+
+# ------------------------------
+# Rate limiting
+# ------------------------------
+class TokenBucket:
+    """
+    rate tokens per second up to capacity; acquire() blocks until one is free.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, stop: threading.Event = None) -> bool:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.rate <= 0 or self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if stop is not None:
+                if stop.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+
+# ------------------------------
+# Dispatcher
+# ------------------------------
+class SmsDispatcher:
+    """
+    submit() only records and queues the message; worker threads send it.
+    Sends that Twilio can't have accepted (no connection, 429, 5xx) are
+    rescheduled with backoff, honouring Retry-After, until SMS_MAX_ATTEMPTS.
+    One that may have been accepted (e.g. a read timeout) is never resent:
+    it is marked unknown until a status callback for its number settles it.
+    Statuses: queued -> sending -> sent (-> delivered / undelivered via
+    the Twilio callback), or retrying, failed, unknown.
+    """
+
+    def __init__(self, workers: int = SMS_WORKERS, queue_size: int = SMS_QUEUE_SIZE,
+                 rate: float = SMS_RATE, burst: int = SMS_BURST):
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.bucket = TokenBucket(rate, burst)
+        self._heap = []  # (not_before, seq, message id)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._messages = OrderedDict()  # id -> status dict
+        self._by_sid = {}  # Twilio MessageSid -> id
+        self._stop = threading.Event()
+        self._threads = []
+        self._local = threading.local()
+        self.counts = {"submitted": 0, "sent": 0, "failed": 0, "unknown": 0, "retried": 0, "rejected": 0}
+
+    # -- public --------------------------------------------------------
+    def submit(self, to_number: str, body: str, user_id: int = None) -> str:
+        if not configured():
+            raise SmsNotConfigured("Twilio credentials not set")
+        message_id = uuid.uuid4().hex
+        now = time.time()
+        with self._cond:
+            if len(self._heap) >= self.queue_size:
+                self.counts["rejected"] += 1
+                raise SmsQueueFull("SMS queue is full, retry shortly")
+            self._messages[message_id] = {
+                "id": message_id, "user_id": user_id, "to": to_number, "body": body, "status": "queued",
+                "attempts": 0, "sid": None, "error": None, "created_at": now, "updated_at": now,
+            }
+            heapq.heappush(self._heap, (0.0, next(self._seq), message_id))
+            self.counts["submitted"] += 1
+            self._ensure_workers()
+            self._cond.notify()
+        return message_id
+
+    def status(self, message_id: str):
+        with self._cond:
+            msg = self._messages.get(message_id)
+            return None if msg is None else {k: v for k, v in msg.items() if k != "body"}
+
+    def update_delivery(self, sid: str, status: str, error_code=None, to_number: str = None) -> bool:
+        """
+        Applies a Twilio status callback (queued / sent / delivered / undelivered / failed).
+        An unseen sid is matched to the oldest message to the same number
+        whose send had an unknown outcome.
+        """
+        with self._cond:
+            msg = self._messages.get(self._by_sid.get(sid))
+            if msg is None and sid and to_number:
+                msg = next((m for m in self._messages.values()
+                            if m["status"] == "unknown" and m["sid"] is None and m["to"] == to_number), None)
+                if msg is not None:
+                    msg["sid"] = sid
+                    self._by_sid[sid] = msg["id"]
+            if msg is None:
+                return False
+            msg["status"] = status
+            if error_code:
+                msg["error"] = f"Twilio error {error_code}"
+            msg["updated_at"] = time.time()
+            return True
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self.counts, "queued": len(self._heap), "workers": len(self._threads)}
+
+    def close(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout=SMS_READ_TIMEOUT)
+
+    # -- workers -------------------------------------------------------
+    def _ensure_workers(self):
+        # Called with self._cond held
+        if not self._threads and not self._stop.is_set():
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, daemon=True, name=f"sms-{i}")
+                t.start()
+                self._threads.append(t)
+
+    def _next(self):
+        with self._cond:
+            while not self._stop.is_set():
+                if self._heap:
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        return heapq.heappop(self._heap)[2]
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+        return None
+
+    def _session(self):
+        # One keep-alive session per worker thread
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import requests  # deferred: only the dispatcher threads need it
+            session = requests.Session()
+            session.auth = (TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+            self._local.session = session
+        return session
+
+    def _run(self):
+        while True:
+            message_id = self._next()
+            if message_id is None:
+                return
+            if not self.bucket.acquire(self._stop):
+                return
+            self._send(message_id)
+
+    def _send(self, message_id: str):
+        with self._cond:
+            msg = self._messages.get(message_id)
+            if msg is None:
+                return
+            msg["status"] = "sending"
+            msg["attempts"] += 1
+            payload = {"From": TWILIO_SMS_NUMBER, "To": msg["to"], "Body": msg["body"]}
+        if SMS_STATUS_CALLBACK_URL:
+            payload["StatusCallback"] = SMS_STATUS_CALLBACK_URL
+
+        retry_after = None
+        try:
+            with metrics.stage("sms_send"):
+                response = self._session().post(
+                    messages_url(), data=payload, timeout=(SMS_CONNECT_TIMEOUT, SMS_READ_TIMEOUT)
+                )
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if not never_sent(e):
+                print(f"SMS send outcome unknown, not resending: {error}", flush=True)
+                self._finish(message_id, "unknown", error=error)
+                return
+            retryable = True
+        else:
+            if response.ok:
+                try:
+                    sid = response.json().get("sid")
+                except (ValueError, AttributeError):
+                    sid = None  # accepted all the same
+                self._finish(message_id, "sent", sid=sid)
+                return
+            error = f"HTTP {response.status_code}: {response.text[:200]}"
+            retryable = response.status_code in RETRY_STATUS
+            retry_after = response.headers.get("Retry-After")
+
+        with self._cond:
+            attempts = msg["attempts"]
+        if not retryable or attempts >= SMS_MAX_ATTEMPTS:
+            print(f"SMS send failed: {error}", flush=True)
+            self._finish(message_id, "failed", error=error)
+            return
+        delay = SMS_RETRY_BACKOFF * (2 ** (attempts - 1))
+        try:
+            delay = max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            pass
+        with self._cond:
+            msg.update(status="retrying", error=error, updated_at=time.time())
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), message_id))
+            self.counts["retried"] += 1
+            self._cond.notify()
+
+    def _finish(self, message_id: str, status: str, sid=None, error=None):
+        with self._cond:
+            msg = self._messages.get(message_id)
+            if msg is None:
+                return
+            msg.update(status=status, error=error, updated_at=time.time())
+            if sid:
+                msg["sid"] = sid
+                self._by_sid[sid] = message_id
+            self.counts[status] += 1
+            self._forget_finished()
+
+    def _forget_finished(self):
+        # Called with self._cond held. Drops the oldest finished messages past
+        # SMS_STATUS_MAX; pending ones are bounded by the queue size and must
+        # stay until _send has dealt with them
+        excess = len(self._messages) - SMS_STATUS_MAX
+        if excess > 0:
+            done = (m for m in self._messages.values() if m["status"] not in PENDING_STATUS)
+            for old in list(itertools.islice(done, excess)):
+                del self._messages[old["id"]]
+                self._by_sid.pop(old["sid"], None)
+
+
+dispatcher = SmsDispatcher()
+
+
+@metrics.gauge("aiagent_sms_queue_depth", "SMS messages waiting to be sent (including scheduled retries).")
+def _sms_queue_depth():
+    return [((), dispatcher.stats()["queued"])]
+
+
+@metrics.counter("aiagent_sms_total", "SMS dispatcher outcomes.", ("result",))
+def _sms_counts():
+    s = dispatcher.stats()
+    return [((k,), s[k]) for k in ("submitted", "sent", "failed", "unknown", "retried", "rejected")]
+
+
+def send_sms(to_number: str, body: str, user_id: int = None) -> str:
+    """
+    Queue a message; returns its id for GET /api/sms/{id}.
+    """
+    return dispatcher.submit(to_number, body, user_id)
+
+
+# ------------------------------
+# Twilio webhook signature
+# ------------------------------
+def valid_signature(url: str, params: dict, signature: str) -> bool:
+    """
+    X-Twilio-Signature: base64 HMAC-SHA1 of the URL followed by each
+    POST parameter name and value, sorted by name.
+    """
+    if not TWILIO_AUTH_TOKEN or not signature:
+        return False
+    data = url + "".join(k + params[k] for k in sorted(params))
+    digest = hmac.new(TWILIO_AUTH_TOKEN.encode(), data.encode("utf-8"), hashlib.sha1).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode(), signature)
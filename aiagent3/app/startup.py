@@ -0,0 +1,193 @@
+# app/startup.py
+# Boot-time instrumentation and background warm-up, reported by GET /ready.
+# Kept free of app imports at module level so main.py can load it first.
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+# STARTUP_PROFILE=1 records how long every module takes to import
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "0") == "1"
+STARTUP_PROFILE_TOP = int(os.getenv("STARTUP_PROFILE_TOP", "20"))
+# Load the embedding model, LLM client and hot tenant indexes after boot
+WARMUP = os.getenv("WARMUP", "1") == "1"
+# How many of the most recently ingested tenants get their indexes preloaded
+WARMUP_TENANTS = int(os.getenv("WARMUP_TENANTS", "8"))
+
+_started = time.perf_counter()
+_lock = threading.Lock()
+_stages = {}  # stage -> {"status", "ms", "error"}
+_ready = threading.Event()
+
+
+# ------------------------------
+# Import timing
+# ------------------------------
+class _TimedLoader:
+    """
+    Wraps a module loader to time exec_module; everything else is delegated.
+    """
+
+    def __init__(self, loader, name, timer):
+        self._loader = loader
+        self._name = name
+        self._timer = timer
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        create = getattr(self._loader, "create_module", None)
+        return create(spec) if create else None
+
+    def exec_module(self, module):
+        self._timer.enter()
+        t0 = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer.leave(self._name, time.perf_counter() - t0)
+
+
+class ImportTimer:
+    """
+    sys.meta_path hook recording, per module, the inclusive import time and
+    the self time (excluding the imports it triggered).
+    """
+
+    def __init__(self):
+        self.times = {}  # module -> (total s, self s)
+        self._local = threading.local()
+        self._finding = threading.local()
+
+    def enter(self):
+        self._stack().append(0.0)
+
+    def leave(self, name: str, total: float):
+        stack = self._stack()
+        children = stack.pop()
+        self.times[name] = (total, total - children)
+        if stack:
+            stack[-1] += total
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def find_spec(self, name, path=None, target=None):
+        if getattr(self._finding, "active", False):
+            return None
+        self._finding.active = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(name, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._finding.active = False
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, name, self)
+        return spec
+
+    def top(self, n: int):
+        ranked = sorted(self.times.items(), key=lambda kv: kv[1][1], reverse=True)[:n]
+        return [{"module": m, "self_ms": round(s * 1000, 1), "total_ms": round(t * 1000, 1)} for m, (t, s) in ranked]
+
+
+_timer = None
+
+def install_import_timer():
+    global _timer
+    if STARTUP_PROFILE and _timer is None:
+        _timer = ImportTimer()
+        sys.meta_path.insert(0, _timer)
+
+
+# ------------------------------
+# Stages (router imports, DB init, warm-up steps)
+# ------------------------------
+@contextmanager
+def stage(name: str):
+    with _lock:
+        _stages[name] = {"status": "running"}
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        with _lock:
+            _stages[name] = {"status": "failed", "ms": round((time.perf_counter() - t0) * 1000, 1), "error": str(e)}
+        raise
+    with _lock:
+        _stages[name] = {"status": "done", "ms": round((time.perf_counter() - t0) * 1000, 1)}
+
+
+def report() -> dict:
+    with _lock:
+        out = {
+            "ready": _ready.is_set(),
+            "uptime_s": round(time.perf_counter() - _started, 2),
+            "stages": dict(_stages),
+        }
+    if _timer is not None:
+        out["slowest_imports"] = _timer.top(STARTUP_PROFILE_TOP)
+    return out
+
+
+def print_report():
+    info = report()
+    print("startup stages:", flush=True)
+    for name, s in info["stages"].items():
+        print(f"  {name:<28} {s['status']:<8} {s.get('ms', '')} ms", flush=True)
+    for row in info.get("slowest_imports", []):
+        print(f"  import {row['module']:<40} self {row['self_ms']:8.1f} ms  total {row['total_ms']:8.1f} ms", flush=True)
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+# ------------------------------
+# Background warm-up
+# ------------------------------
+def warm_up():
+    """
+    Load and exercise everything the first query would otherwise pay for.
+    Ready is only set once every step succeeded.
+    """
+    try:
+        from app.embedder import get_model, get_cache
+        with stage("warmup: embedding model"):
+            model = get_model()
+            model.encode(["warm up"])  # first forward pass allocates / compiles
+            get_cache()
+
+        from app.clientell import get_client
+        with stage("warmup: llm client"):
+            get_client()
+
+        from app.index import recent_tenants, get_index, load_chunks, load_lexical
+        with stage("warmup: hot indexes"):
+            for user_id in recent_tenants(WARMUP_TENANTS):
+                get_index(user_id)
+                load_chunks(user_id)
+                load_lexical(user_id)
+    except Exception:
+        print("warm-up failed", flush=True)
+        traceback.print_exc()
+        return
+    _ready.set()
+    print_report()
+
+
+def start_warm_up():
+    if not WARMUP:
+        _ready.set()
+        return
+    threading.Thread(target=warm_up, daemon=True, name="warm-up").start()
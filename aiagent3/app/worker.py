@@ -0,0 +1,144 @@
+# app/worker.py
+# Ingest worker: claims jobs from app/jobs.py and runs them on a process pool.
+#   python -m app.worker
+# With INGEST_WORKER_MODE=embedded (the default) the web process starts the
+# same loop on a thread at startup, so single-service deploys keep working.
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from app import jobs, metrics
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_WORKER_MODE = os.getenv("INGEST_WORKER_MODE", "embedded")  # embedded | external
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "1"))
+# Longest pause after repeated errors in the loop itself (e.g. the jobs DB is locked)
+INGEST_ERROR_BACKOFF_MAX = float(os.getenv("INGEST_ERROR_BACKOFF_MAX", "60"))
+
+
+def run_job(job: dict):
+    """
+    Runs inside a pool process. Returns the chunk counts and the stage
+    timings it recorded, for the parent's /metrics.
+    """
+    from app.ingest import process_file_background
+    from app.index import delete_document
+
+    def progress(done, total):
+        jobs.update_progress(job["id"], done, total)
+
+    # The job id doubles as the document id, so a retry resumes where it stopped
+    counts = process_file_background(job["user_id"], job["path"], job["filename"], doc_id=job["id"], progress=progress)
+    if job.get("replaces"):
+        # The new version is searchable; retire the old one. If that is still being
+        # ingested, stop any retry and tombstone it by name, so chunks it commits
+        # later stay hidden too.
+        old = jobs.get_job(job["replaces"])
+        pending = old is not None and old["user_id"] == job["user_id"] and old["status"] in ("queued", "running")
+        if pending:
+            jobs.cancel(old["id"])
+        delete_document(job["user_id"], job["replaces"], old["filename"] if pending else None)
+    return counts, metrics.drain_stages()
+
+
+def _new_pool(workers: int) -> ProcessPoolExecutor:
+    # spawn: the web process has threads running, which fork doesn't mix with
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _poll(pool: ProcessPoolExecutor, running: dict, workers: int) -> ProcessPoolExecutor:
+    """
+    One round of serve(): top up the running jobs and settle finished ones.
+    Returns the pool to use next (a new one if a process died).
+    """
+    while len(running) < workers:
+        job = jobs.claim_next()
+        if job is None:
+            break
+        running[pool.submit(run_job, job)] = job["id"]
+
+    if not running:
+        time.sleep(INGEST_POLL_INTERVAL)
+        return pool
+
+    done, _ = wait(running, timeout=INGEST_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+    broken = False
+    for future in done:
+        job_id = running.pop(future)
+        try:
+            counts, stages = future.result()
+            metrics.merge_stages(stages)
+            jobs.complete(job_id, **counts)
+        except BrokenProcessPool:
+            broken = True
+            jobs.fail(job_id, "worker process died")
+        except Exception:
+            jobs.fail(job_id, traceback.format_exc())
+    if broken:
+        # Every in-flight job died with the pool
+        for job_id in running.values():
+            jobs.fail(job_id, "worker process died")
+        running.clear()
+        pool.shutdown(wait=False, cancel_futures=True)
+        pool = _new_pool(workers)
+    return pool
+
+
+def serve(workers: int = INGEST_WORKERS, stop: threading.Event = None):
+    """
+    Keep up to `workers` jobs running until stop is set. Errors from the
+    queue itself are logged and retried with backoff; a job whose outcome
+    couldn't be recorded is picked up again when its lease expires.
+    """
+    pool = _new_pool(workers)
+    running = {}  # future -> job id
+    failures = 0
+    print(f"ingest worker started ({workers} processes)", flush=True)
+    threading.Thread(target=_backfill_lexical, daemon=True, name="lexical-backfill").start()
+    try:
+        while stop is None or not stop.is_set():
+            try:
+                pool = _poll(pool, running, workers)
+                failures = 0
+            except Exception:
+                failures += 1
+                delay = min(INGEST_POLL_INTERVAL * 2 ** failures, INGEST_ERROR_BACKOFF_MAX)
+                print(f"ingest worker error ({failures} in a row), retrying in {delay:g}s", flush=True)
+                traceback.print_exc()
+                time.sleep(delay)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _backfill_lexical():
+    """
+    Index the chunks of tenants ingested before the lexical index existed
+    (or whose ingest died between the two writes), so queries never do it.
+    """
+    from app.index import backfill_lexical
+    try:
+        done = backfill_lexical()
+    except Exception:
+        print("lexical backfill failed", flush=True)
+        traceback.print_exc()
+        return
+    if done:
+        print(f"lexical backfill indexed {done} chunks", flush=True)
+
+
+def start_embedded() -> threading.Event:
+    """
+    Run serve() on a daemon thread; set the returned event to stop it.
+    """
+    stop = threading.Event()
+    threading.Thread(target=serve, kwargs={"stop": stop}, daemon=True, name="ingest-worker").start()
+    return stop
+
+
+if __name__ == "__main__":
+    if metrics.METRICS_PORT:
+        metrics.serve_http()
+    serve()
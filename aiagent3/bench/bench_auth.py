@@ -0,0 +1,75 @@
+# bench/bench_auth.py
+# Login throughput on the bounded argon2 pool, and per-request JWT verification cost.
+# Run from aiagent3/:  python -m bench.bench_auth --logins 200 --concurrency 32
+# Argon2 cost comes from ARGON2_TIME_COST / ARGON2_MEMORY_COST / ARGON2_PARALLELISM.
+import argparse
+import asyncio
+import time
+import numpy as np
+from jose import jwt
+from app import security
+from app.security import (
+    create_access_token, decode_access_token, hash_password, verify_password, verify_password_async,
+    JWT_SECRET, ALGORITHM, PASSWORD_HASH_WORKERS,
+)
+
+
+def sequential_logins(hashed: str, n: int):
+    latencies = []
+    t0 = time.perf_counter()
+    for _ in range(n):
+        t1 = time.perf_counter()
+        verify_password("correct horse", hashed)
+        latencies.append(1000 * (time.perf_counter() - t1))
+    return n / (time.perf_counter() - t0), latencies
+
+
+async def concurrent_logins(hashed: str, n: int, concurrency: int):
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)  # concurrency clients in flight at once
+
+    async def login():
+        async with gate:
+            t1 = time.perf_counter()
+            await verify_password_async("correct horse", hashed)
+            latencies.append(1000 * (time.perf_counter() - t1))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[login() for _ in range(n)])
+    return n / (time.perf_counter() - t0), latencies
+
+
+def per_call_us(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return 1e6 * (time.perf_counter() - t0) / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--decodes", type=int, default=20000)
+    args = parser.parse_args()
+
+    hashed = hash_password("correct horse")
+    print(f"argon2 t={security.ARGON2_TIME_COST} m={security.ARGON2_MEMORY_COST}KiB p={security.ARGON2_PARALLELISM}"
+          f"  pool={PASSWORD_HASH_WORKERS} workers")
+    for label, (rate, lat) in [
+        ("sequential", sequential_logins(hashed, args.logins)),
+        (f"pool, {args.concurrency} clients", asyncio.run(concurrent_logins(hashed, args.logins, args.concurrency))),
+    ]:
+        p50, p95 = np.percentile(lat, [50, 95])
+        print(f"login {label:<22}: {rate:8.1f} logins/s  p50 {p50:7.1f} ms  p95 {p95:7.1f} ms")
+
+    token = create_access_token({"user_id": 1})
+    uncached = per_call_us(lambda: jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM]), args.decodes)
+    decode_access_token(token)
+    cached = per_call_us(lambda: decode_access_token(token), args.decodes)
+    print(f"jwt verify (python-jose)      : {uncached:8.1f} us/request")
+    print(f"jwt verify (token cache hit)  : {cached:8.1f} us/request  ({uncached / cached:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
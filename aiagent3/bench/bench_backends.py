@@ -0,0 +1,73 @@
+# bench/bench_backends.py
+# Accuracy and speed of each embedder backend against the full-precision torch baseline.
+# Run from aiagent3/:  python -m bench.bench_backends --chunks 2000 --backends torch,torch-int8,onnx,onnx-int8
+import argparse
+import time
+import numpy as np
+import faiss
+from app.embedder import load_backend, EMBED_BATCH_SIZE
+from bench.bench_embed import make_chunks
+
+
+def encode(model, texts, batch_size):
+    return np.asarray(model.encode(texts, batch_size=batch_size), dtype="float32")
+
+
+def neighbour_agreement(baseline, vectors, k: int) -> float:
+    """
+    Mean overlap of each text's k nearest neighbours (within the corpus)
+    under the baseline and the candidate embeddings.
+    """
+    found = []
+    for x in (baseline, vectors):
+        index = faiss.IndexFlatIP(x.shape[1])
+        x = x / np.linalg.norm(x, axis=1, keepdims=True)
+        index.add(x)
+        found.append(index.search(x, k + 1)[1][:, 1:])
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(*found)]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--backends", default="torch,torch-int8,onnx,onnx-int8")
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    # Fixed corpus (seeded), so runs on different nodes compare like for like
+    texts = make_chunks(args.chunks)
+    baseline = None
+    print(f"chunks={len(texts)} batch_size={args.batch_size}")
+    print(f"{'backend':<12} {'load s':>7} {'chunks/s':>9} {'1-query ms':>10} {'cos mean':>9} {'cos min':>8} {'nn@' + str(args.k):>6}")
+    for name in ["torch"] + [b for b in args.backends.split(",") if b != "torch"]:
+        t0 = time.perf_counter()
+        try:
+            model = load_backend(name)
+        except Exception as e:
+            print(f"{name:<12} unavailable: {e}")
+            continue
+        load_s = time.perf_counter() - t0
+
+        encode(model, texts[:args.batch_size], args.batch_size)  # warm up
+        t0 = time.perf_counter()
+        vectors = encode(model, texts, args.batch_size)
+        rate = len(texts) / (time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        for text in texts[:50]:
+            model.encode(text)
+        query_ms = 1000 * (time.perf_counter() - t0) / min(50, len(texts))
+
+        if baseline is None:
+            if name != "torch":
+                print(f"(torch unavailable; agreement is measured against {name})")
+            baseline = vectors
+        cos = np.sum(baseline * vectors, axis=1) / (
+            np.linalg.norm(baseline, axis=1) * np.linalg.norm(vectors, axis=1)
+        )
+        nn = neighbour_agreement(baseline, vectors, args.k)
+        print(f"{name:<12} {load_s:7.2f} {rate:9.1f} {query_ms:10.2f} {cos.mean():9.4f} {cos.min():8.4f} {nn:6.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,477 @@
+# bench/bench_e2e.py
+# End-to-end load test of the FastAPI app, fully offline: the app runs under
+# uvicorn against a throwaway SQLite database and data directory, with the
+# LLM (bench/stub_llm.py), Twilio (bench/fake_twilio.py) and embedding model
+# (bench/hash_embedder.py) replaced by local stand-ins.
+# Run from aiagent3/:
+#   python -m bench.bench_e2e --users 8 --docs-per-user 4 --doc-kb 64 --queries 400 --concurrency 32 \
+#       --llm-latency-ms 300 --output results.json
+# Phases: register, login, ingest (upload + time to index), query, batch
+# query, then a timed mix of the first four. Results (latency percentiles, throughput, errors,
+# server-side stage means from /metrics) are printed and written as JSON.
+# Extra app settings can be passed through the environment (e.g. EMBED_BACKEND=torch).
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import numpy as np
+
+from bench.fake_twilio import FakeTwilio
+from bench.stub_llm import StubLLM
+
+CHUNK_CHARS = 500  # app/chunker.py CHUNK_SIZE
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ------------------------------
+# Synthetic corpus
+# ------------------------------
+def make_vocab(n: int, rng: random.Random):
+    syllables = ["ka", "lo", "mi", "ra", "te", "su", "no", "vi", "de", "pa", "ri", "to", "ma", "ne", "zu", "fe"]
+    words = set()
+    while len(words) < n:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+class Corpus:
+    """
+    Documents of Zipf-distributed words from a synthetic vocabulary, and
+    questions built from words of a random document so retrieval has
+    something to find.
+    """
+
+    def __init__(self, doc_kb: int, vocab_size: int = 5000, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.vocab = make_vocab(vocab_size, self.rng)
+        self.weights = [1.0 / (rank + 1) for rank in range(vocab_size)]
+        self.doc_chars = doc_kb * 1024
+        self.docs = []  # texts generated so far, for questions
+
+    def document(self) -> str:
+        words, size = [], 0
+        while size < self.doc_chars:
+            sentence = self.rng.choices(self.vocab, self.weights, k=self.rng.randint(8, 20))
+            text = " ".join(sentence).capitalize() + ". "
+            words.append(text)
+            size += len(text)
+        doc = "".join(words)[:self.doc_chars]
+        self.docs.append(doc)
+        return doc
+
+    def question(self) -> str:
+        if not self.docs:
+            return "What is this about?"
+        doc = self.rng.choice(self.docs)
+        start = self.rng.randrange(0, max(1, len(doc) - CHUNK_CHARS))
+        terms = re.findall(r"[a-z]+", doc[start:start + CHUNK_CHARS].lower())
+        picked = self.rng.sample(terms, min(len(terms), self.rng.randint(3, 6)))
+        return f"What does the document say about {' '.join(picked)}?"
+
+
+# ------------------------------
+# Measurements
+# ------------------------------
+class Phase:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = {}  # op -> [ms]
+        self.errors = {}  # op -> count
+        self.extra = {}  # op -> {metric: [ms]}
+        self.started = time.perf_counter()
+        self.elapsed = None
+
+    def record(self, op: str, ms: float, ok: bool, **extra):
+        if ok:
+            self.latencies.setdefault(op, []).append(ms)
+            for key, value in extra.items():
+                self.extra.setdefault(op, {}).setdefault(key, []).append(value)
+        else:
+            self.errors[op] = self.errors.get(op, 0) + 1
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def summary(self) -> dict:
+        out = {}
+        for op in sorted(set(self.latencies) | set(self.errors)):
+            lat = self.latencies.get(op, [])
+            out[op] = {
+                "count": len(lat),
+                "errors": self.errors.get(op, 0),
+                "throughput_rps": round(len(lat) / self.elapsed, 2) if self.elapsed else 0.0,
+                **percentiles(lat),
+            }
+            for key, values in self.extra.get(op, {}).items():
+                out[op][key] = percentiles(values)
+        return out
+
+
+def percentiles(values) -> dict:
+    if not values:
+        return {}
+    p50, p90, p95, p99 = np.percentile(values, [50, 90, 95, 99])
+    return {
+        "mean_ms": round(float(np.mean(values)), 2),
+        "p50_ms": round(float(p50), 2),
+        "p90_ms": round(float(p90), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "max_ms": round(float(np.max(values)), 2),
+    }
+
+
+def stage_means(metrics_text: str) -> dict:
+    """
+    {stage: {"count", "mean_ms"}} from the app's aiagent_stage_seconds histogram.
+    """
+    sums, counts = {}, {}
+    for name, stage, value in re.findall(r'^aiagent_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$',
+                                         metrics_text, re.M):
+        (sums if name == "sum" else counts)[stage] = float(value)
+    return {
+        stage: {"count": int(counts[stage]), "mean_ms": round(1000 * sums.get(stage, 0.0) / counts[stage], 3)}
+        for stage in sorted(counts) if counts[stage]
+    }
+
+
+# ------------------------------
+# App process
+# ------------------------------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_app(workdir: str, port: int, llm: StubLLM, twilio: FakeTwilio, args):
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{workdir}/bench.db",
+        "JWT_SECRET": uuid.uuid4().hex,
+        "OpenAI_API_KEY": "bench",
+        "LLM_BASE_URL": llm.base_url,
+        "TWILIO_API_BASE": twilio.base_url,
+        "TWILIO_ACCOUNT_SID": "AC_bench",
+        "TWILIO_AUTH_TOKEN": "bench",
+        "TWILIO_PHONE_NUMBER": "+15550000000",
+        "SMS_RATE": str(args.sms_rate),
+        "SMS_BURST": str(max(1, int(args.sms_rate))),
+        "FAISS_DIR": os.path.join(workdir, "faiss_index"),
+        "JOBS_DB": os.path.join(workdir, "jobs.sqlite3"),
+        "INGEST_SPOOL_DIR": os.path.join(workdir, "spool"),
+        "EMBED_CACHE_DIR": os.path.join(workdir, "embed_cache"),
+        "PYTHONPATH": ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+    })
+    env.setdefault("EMBED_BACKEND", "bench.hash_embedder:load")
+    env.setdefault("INGEST_POLL_INTERVAL", "0.1")
+    log = open(os.path.join(workdir, "app.log"), "w")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    return proc, env
+
+
+async def wait_ready(client, proc, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("app exited during startup")
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("app not ready in time")
+
+
+# ------------------------------
+# Workload
+# ------------------------------
+class Driver:
+    def __init__(self, client, corpus: Corpus, args):
+        self.client = client
+        self.corpus = corpus
+        self.args = args
+        self.users = []  # (username, password, token)
+        self.rng = random.Random(1)
+
+    async def timed(self, phase: Phase, op: str, request):
+        t0 = time.perf_counter()
+        try:
+            response = await request
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        phase.record(op, 1000 * (time.perf_counter() - t0), ok)
+        return response if ok else None
+
+    async def register(self, phase: Phase):
+        username, password = f"bench_{uuid.uuid4().hex[:12]}", "bench-password"
+        r = await self.timed(phase, "register", self.client.post(
+            "/api/auth/register", json={"username": username, "password": password}))
+        if r is not None:
+            self.users.append((username, password, r.json()["access_token"]))
+
+    async def login(self, phase: Phase, user=None):
+        username, password, _ = user or self.rng.choice(self.users)
+        await self.timed(phase, "login", self.client.post(
+            "/api/auth/login", json={"username": username, "password": password}))
+
+    async def upload(self, phase: Phase, token: str):
+        doc = self.corpus.document().encode()
+        r = await self.timed(phase, "ingest_upload", self.client.post(
+            "/api/ingest", files={"file": (f"{uuid.uuid4().hex[:8]}.txt", doc, "text/plain")},
+            headers={"Authorization": f"Bearer {token}"}))
+        return (r.json()["job_id"], token, len(doc)) if r is not None else None
+
+    async def wait_job(self, job_id: str, token: str):
+        while True:
+            r = await self.client.get(f"/api/ingest/jobs/{job_id}", headers={"Authorization": f"Bearer {token}"})
+            status = r.json().get("status") if r.status_code == 200 else "failed"
+            if status in ("completed", "failed"):
+                return status
+            await asyncio.sleep(0.05)
+
+    async def query_batch(self, phase: Phase, size: int):
+        token = self.rng.choice(self.users)[2]
+        payload = {"queries": [self.corpus.question() for _ in range(size)], "use_cache": self.args.answer_cache}
+        await self.timed(phase, "query_batch", self.client.post(
+            "/api/query/batch", json=payload, headers={"Authorization": f"Bearer {token}"}))
+
+    async def query(self, phase: Phase, token: str = None):
+        token = token or self.rng.choice(self.users)[2]
+        payload = {"query": self.corpus.question(), "use_cache": self.args.answer_cache}
+        if self.rng.random() < self.args.sms_ratio:
+            payload["send_sms_to"] = "+15551234567"
+        headers = {"Authorization": f"Bearer {token}"}
+        if self.rng.random() >= self.args.stream_ratio:
+            await self.timed(phase, "query", self.client.post("/api/query", json=payload, headers=headers))
+            return
+
+        payload["stream"] = True
+        t0 = time.perf_counter()
+        first = None
+        try:
+            async with self.client.stream("POST", "/api/query", json=payload, headers=headers) as r:
+                ok = r.status_code < 400
+                async for line in r.aiter_lines():
+                    if first is None and line.startswith("event: token"):
+                        first = 1000 * (time.perf_counter() - t0)
+        except Exception:
+            ok = False
+        total = 1000 * (time.perf_counter() - t0)
+        phase.record("query_stream", total, ok, first_token=first if first is not None else total)
+
+
+async def run_clients(n: int, concurrency: int, fn):
+    """
+    Call fn() n times with at most concurrency calls in flight.
+    """
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with gate:
+            await fn()
+
+    await asyncio.gather(*[one() for _ in range(n)])
+
+
+async def run_phases(driver: Driver, args) -> dict:
+    results = {}
+
+    phase = Phase("register")
+    await run_clients(args.users, args.concurrency, lambda: driver.register(phase))
+    results["register"] = phase.finish().summary()
+    if not driver.users:
+        raise RuntimeError("no user could register; see app.log")
+
+    phase = Phase("login")
+    await run_clients(args.users * args.logins_per_user, args.concurrency, lambda: driver.login(phase))
+    results["login"] = phase.finish().summary()
+
+    phase = Phase("ingest")
+    uploads = [asyncio.ensure_future(driver.upload(phase, token))
+               for _, _, token in driver.users for _ in range(args.docs_per_user)]
+    jobs = [j for j in await asyncio.gather(*uploads) if j is not None]
+    statuses = await asyncio.gather(*[driver.wait_job(job_id, token) for job_id, token, _ in jobs])
+    phase.finish()
+    total_bytes = sum(size for (_, _, size), s in zip(jobs, statuses) if s == "completed")
+    results["ingest"] = {
+        **phase.summary(),
+        "documents": len(jobs),
+        "failed": statuses.count("failed"),
+        "wall_s": round(phase.elapsed, 3),
+        "docs_per_s": round(statuses.count("completed") / phase.elapsed, 2),
+        "mb_per_s": round(total_bytes / 2 ** 20 / phase.elapsed, 3),
+        "chunks_per_s": round(total_bytes / CHUNK_CHARS / phase.elapsed, 1),
+    }
+
+    phase = Phase("query")
+    await run_clients(args.queries, args.concurrency, lambda: driver.query(phase))
+    results["query"] = phase.finish().summary()
+
+    if args.batches > 0:
+        phase = Phase("batch")
+        await run_clients(args.batches, args.concurrency, lambda: driver.query_batch(phase, args.batch_size))
+        results["batch"] = phase.finish().summary()
+        row = results["batch"].get("query_batch", {})
+        row["questions_per_s"] = round(row.get("throughput_rps", 0.0) * args.batch_size, 2)
+
+    if args.mixed_seconds > 0:
+        weights = dict(item.split("=") for item in args.mix.split(","))
+        ops, w = list(weights), [float(v) for v in weights.values()]
+        phase = Phase("mixed")
+        deadline = time.monotonic() + args.mixed_seconds
+
+        async def client():
+            while time.monotonic() < deadline:
+                op = driver.rng.choices(ops, w)[0]
+                if op == "register":
+                    await driver.register(phase)
+                elif op == "login":
+                    await driver.login(phase)
+                elif op == "ingest":
+                    await driver.upload(phase, driver.rng.choice(driver.users)[2])
+                else:
+                    await driver.query(phase)
+
+        await asyncio.gather(*[client() for _ in range(args.concurrency)])
+        results["mixed"] = phase.finish().summary()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def print_table(results: dict):
+    print(f"{'phase':<8} {'op':<14} {'ok':>6} {'err':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for phase in ("register", "login", "ingest", "query", "batch", "mixed"):
+        for op, row in results.get(phase, {}).items():
+            if not isinstance(row, dict) or "count" not in row:
+                continue
+            print(f"{phase:<8} {op:<14} {row['count']:>6} {row['errors']:>5} {row['throughput_rps']:>8.1f} "
+                  f"{row.get('p50_ms', 0):>9.1f} {row.get('p95_ms', 0):>9.1f} {row.get('p99_ms', 0):>9.1f}")
+            if "first_token" in row:
+                ft = row["first_token"]
+                print(f"{'':<8} {'  first token':<14} {'':>6} {'':>5} {'':>8} "
+                      f"{ft['p50_ms']:>9.1f} {ft['p95_ms']:>9.1f} {ft['p99_ms']:>9.1f}")
+    ingest = results.get("ingest", {})
+    if ingest:
+        print(f"ingest: {ingest['documents']} docs in {ingest['wall_s']} s -> {ingest['docs_per_s']} docs/s, "
+              f"{ingest['mb_per_s']} MB/s, {ingest['chunks_per_s']} chunks/s ({ingest['failed']} failed)")
+    batch = results.get("batch", {}).get("query_batch")
+    if batch:
+        print(f"batch: {batch['questions_per_s']} questions/s vs {results['query'].get('query', {}).get('throughput_rps')} "
+              f"single queries/s")
+
+
+async def bench(args) -> dict:
+    import httpx  # installed with openai
+
+    workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+    llm = StubLLM(latency_ms=args.llm_latency_ms, token_ms=args.llm_token_ms, error_rate=args.llm_error_rate).start()
+    twilio = FakeTwilio(latency_ms=args.twilio_latency_ms).start()
+    port = free_port()
+    proc, env = start_app(workdir, port, llm, twilio, args)
+    t0 = time.perf_counter()
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120) as client:
+            await wait_ready(client, proc, args.startup_timeout)
+            startup_s = time.perf_counter() - t0
+            driver = Driver(client, Corpus(args.doc_kb, seed=args.seed), args)
+            results = await run_phases(driver, args)
+            server_stages = stage_means((await client.get("/metrics")).text)
+    except Exception:
+        print(f"benchmark failed; app log: {os.path.join(workdir, 'app.log')}", file=sys.stderr)
+        args.keep = True
+        raise
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        llm.shutdown()
+        twilio.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "benchmark": "e2e",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "keep")},
+        # Tuning knobs in effect; per-run paths and stub URLs are left out
+        "app_env": {k: env[k] for k in sorted(env)
+                    if k.startswith(("EMBED_", "INGEST_", "LLM_", "SMS_", "INDEX_", "RETRIEVAL_", "ARGON2_", "DB_"))
+                    and workdir not in env[k] and "127.0.0.1" not in env[k]},
+        "startup_s": round(startup_s, 3),
+        "results": results,
+        "server_stages": server_stages,
+        "stubs": {"llm_requests": llm.requests, "llm_errors": llm.errors, "sms_delivered": len(twilio.messages)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--logins-per-user", type=int, default=2)
+    parser.add_argument("--docs-per-user", type=int, default=4)
+    parser.add_argument("--doc-kb", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batches", type=int, default=10, help="/api/query/batch requests (0 = skip)")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--stream-ratio", type=float, default=0.25, help="share of queries sent with stream=true")
+    parser.add_argument("--sms-ratio", type=float, default=0.05, help="share of queries with send_sms_to")
+    parser.add_argument("--answer-cache", action="store_true", help="let queries use the answer cache")
+    parser.add_argument("--mixed-seconds", type=float, default=10)
+    parser.add_argument("--mix", default="query=85,login=8,ingest=5,register=2")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-token-ms", type=float, default=10)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--twilio-latency-ms", type=float, default=50)
+    parser.add_argument("--sms-rate", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--output", help="write results JSON here ('-' for stdout)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary data directory and app log")
+    args = parser.parse_args()
+
+    report = asyncio.run(bench(args))
+    print_table(report["results"])
+    print("server stage means (ms): " + ", ".join(f"{k} {v['mean_ms']}" for k, v in report["server_stages"].items()))
+    if args.output == "-":
+        print(json.dumps(report, indent=2))
+    elif args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# bench/bench_embed.py
+# Compare the old one-encode-per-chunk ingest loop with batched get_embeddings,
+# and per-request query embeddings with the micro-batching embedder under concurrency.
+# Run from aiagent3/:  python -m bench.bench_embed --chunks 2000 --batch-size 64 --concurrency 16
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from app.embedder import get_model, get_embedding, get_embeddings, embed_async, embedding_batch_stats
+
+WORDS = (
+    "agreement party invoice payment term clause liability notice service "
+    "delivery contract renewal termination schedule amount confidential"
+).split()
+
+
+def make_chunks(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    chunks = []
+    for _ in range(n):
+        # Mix of full 500-char chunks and short tail chunks, like a real upload
+        size = 500 if rng.random() < 0.9 else rng.randint(20, 500)
+        text = ""
+        while len(text) < size:
+            text += rng.choice(WORDS) + " "
+        chunks.append(text[:size])
+    return chunks
+
+
+def concurrent_queries(embed, queries, concurrency: int):
+    """
+    concurrency clients each embedding their share of queries one at a time.
+    Returns (embeddings/s, p50 ms, p95 ms).
+    """
+    latencies = []
+
+    def client(texts):
+        for text in texts:
+            t0 = time.perf_counter()
+            embed(text)
+            latencies.append(1000 * (time.perf_counter() - t0))
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(client, [queries[i::concurrency] for i in range(concurrency)]))
+    elapsed = time.perf_counter() - t0
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return len(queries) / elapsed, p50, p95
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--queries", type=int, default=800)
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.chunks)
+    get_model().encode("warm up")
+
+    t0 = time.perf_counter()
+    loop = np.stack([get_embedding(c) for c in chunks])
+    loop_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    batched = get_embeddings(chunks, batch_size=args.batch_size)
+    batched_s = time.perf_counter() - t0
+
+    max_diff = float(np.abs(loop - batched).max())
+    print(f"chunks={len(chunks)} batch_size={args.batch_size}")
+    print(f"per-chunk loop : {loop_s:8.2f}s  {len(chunks) / loop_s:8.1f} chunks/s")
+    print(f"batched        : {batched_s:8.2f}s  {len(chunks) / batched_s:8.1f} chunks/s")
+    print(f"speedup        : {loop_s / batched_s:8.2f}x  (max abs diff {max_diff:.2e})")
+
+    # Distinct query-sized texts per run so the embedding cache can't answer
+    queries = [" ".join(random.Random(i).choices(WORDS, k=8)) + f" #{i}" for i in range(2 * args.queries)]
+    for label, embed, texts in [
+        ("1 query / pass", get_embedding, queries[:args.queries]),
+        ("micro-batched", lambda q: embed_async(q).result(), queries[args.queries:]),
+    ]:
+        # A quarter of the texts single-client, the rest under concurrency
+        split = len(texts) // 4
+        for c, part in ((1, texts[:split]), (args.concurrency, texts[split:])):
+            rate, p50, p95 = concurrent_queries(embed, part, c)
+            print(f"{label:<15}: clients={c:<3} {rate:8.1f} embeddings/s  p50 {p50:6.2f} ms  p95 {p95:6.2f} ms")
+    print(f"batches        : {embedding_batch_stats()}")
+
+
+if __name__ == "__main__":
+    main()
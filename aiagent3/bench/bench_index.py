@@ -0,0 +1,67 @@
+# bench/bench_index.py
+# Recall@k vs per-query latency of the ANN backends against the IndexFlatL2 baseline.
+# Run from aiagent3/:  python -m bench.bench_index --vectors 200000 --queries 500
+import argparse
+import time
+import numpy as np
+import faiss
+from app.index import EMBED_DIM, build_index, apply_search_params, DEFAULT_INDEX_PARAMS
+
+
+def make_corpus(n: int, d: int, seed: int = 0):
+    # Clustered unit vectors look more like sentence embeddings than pure noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 500), d)).astype("float32")
+    x = centers[rng.integers(0, len(centers), n)] + 0.3 * rng.standard_normal((n, d)).astype("float32")
+    faiss.normalize_L2(x)
+    return x
+
+
+def run(index, queries, k, truth):
+    """
+    One query at a time, like /api/query. Returns (recall@k, ms per query).
+    """
+    found = []
+    t0 = time.perf_counter()
+    for q in queries:
+        found.append(index.search(q[None, :], k)[1][0])
+    elapsed = time.perf_counter() - t0
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    return recall, 1000 * elapsed / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--nprobe", default="1,4,16,64")
+    parser.add_argument("--ef-search", default="16,32,64,128")
+    args = parser.parse_args()
+
+    data = make_corpus(args.vectors + args.queries, EMBED_DIM)
+    corpus, queries = data[:args.vectors], data[args.vectors:]
+
+    t0 = time.perf_counter()
+    flat = build_index("flat", corpus)
+    print(f"{'backend':<8} {'param':<14} {'build s':>8} {'recall@' + str(args.k):>9} {'ms/query':>9}")
+    truth = [flat.search(q[None, :], args.k)[1][0] for q in queries]
+    recall, ms = run(flat, queries, args.k, truth)
+    print(f"{'flat':<8} {'-':<14} {time.perf_counter() - t0:8.2f} {recall:9.3f} {ms:9.3f}")
+
+    sweeps = {
+        "hnsw": ("efSearch", [int(v) for v in args.ef_search.split(",")]),
+        "ivfpq": ("nprobe", [int(v) for v in args.nprobe.split(",")]),
+    }
+    for kind, (name, values) in sweeps.items():
+        t0 = time.perf_counter()
+        index = build_index(kind, corpus)
+        build_s = time.perf_counter() - t0
+        for value in values:
+            apply_search_params(index, {**DEFAULT_INDEX_PARAMS, name: value})
+            recall, ms = run(index, queries, args.k, truth)
+            print(f"{kind:<8} {f'{name}={value}':<14} {build_s:8.2f} {recall:9.3f} {ms:9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# bench/bench_lexical.py
+# Cost of the BM25 side of hybrid retrieval next to the dense FAISS search it runs with.
+# Run from aiagent3/:  python -m bench.bench_lexical --chunks 100000 --queries 500
+import argparse
+import random
+import tempfile
+import time
+from app.index import EMBED_DIM, build_index
+from app.lexical import LexicalIndex, append_terms
+from app.query import fuse, RETRIEVAL_CANDIDATES
+from bench.bench_index import make_corpus
+
+WORDS = (
+    "agreement party invoice payment term clause liability notice service "
+    "delivery contract renewal termination schedule amount confidential "
+    "customer order shipment warranty refund balance account statement"
+).split()
+# Long tail of rarer terms, drawn Zipf-like like real text
+VOCAB = WORDS + [f"term{i}" for i in range(20000)]
+WEIGHTS = [1.0 / (rank + 1) for rank in range(len(VOCAB))]
+
+
+def make_chunks(n: int, start: int = 0, seed: int = 0):
+    # ~80-word chunks (roughly CHUNK_SIZE=500 chars), each carrying an invoice number and a SKU
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choices(VOCAB, WEIGHTS, k=80)) + f" INV-2024-{i:06d} SKU-{rng.randint(0, 9999):04d}"
+        for i in range(start, start + n)
+    ]
+
+
+def per_query_ms(fn, queries) -> float:
+    t0 = time.perf_counter()
+    for q in queries:
+        fn(q)
+    return 1000 * (time.perf_counter() - t0) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--refresh", type=int, default=64, help="chunks appended before the incremental reload")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    chunks = make_chunks(args.chunks)
+    text_queries = [
+        f"what is the balance on invoice INV-2024-{rng.randrange(args.chunks):06d}" if i % 2
+        else " ".join(rng.choices(VOCAB, WEIGHTS, k=6))
+        for i in range(args.queries)
+    ]
+    vectors = make_corpus(args.chunks + args.queries, EMBED_DIM)
+    corpus, vec_queries = vectors[:args.chunks], vectors[args.chunks:]
+    depth = max(args.k, RETRIEVAL_CANDIDATES)
+
+    with tempfile.TemporaryDirectory() as directory:
+        t0 = time.perf_counter()
+        for start in range(0, len(chunks), 1000):
+            append_terms(directory, 0, start, chunks[start:start + 1000])
+        build_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        lex = LexicalIndex(directory, 0)
+        load_s = time.perf_counter() - t0
+
+        # What a query pays after an ingest batch lands
+        extra = make_chunks(args.refresh, start=len(chunks), seed=1)
+        append_terms(directory, 0, len(chunks), extra)
+        t0 = time.perf_counter()
+        lex = LexicalIndex(directory, 0, previous=lex)
+        refresh_s = time.perf_counter() - t0
+
+        flat = build_index("flat", corpus)
+        dense_ms = per_query_ms(lambda q: flat.search(q[None, :], depth), vec_queries)
+        lexical_ms = per_query_ms(lambda q: lex.search(q, depth), text_queries)
+        dense_ids = [flat.search(q[None, :], depth)[1][0].tolist() for q in vec_queries]
+        lexical_ids = [lex.search(q, depth)[0].tolist() for q in text_queries]
+        pairs = list(zip(dense_ids, lexical_ids))
+        fuse_ms = per_query_ms(lambda p: fuse(p, [1.0, 1.0], args.k), pairs)
+
+        hits = sum(
+            lex.search(q, args.k)[0][:1].tolist() == [int(q.rsplit("-", 1)[1])]
+            for q in text_queries if "INV-" in q
+        )
+
+    print(f"chunks={args.chunks} queries={args.queries} depth={depth} k={args.k}")
+    print(f"lexical build  : {build_s:8.2f}s  {args.chunks / build_s:8.0f} chunks/s  ({lex.nbytes / 2 ** 20:.1f} MiB in memory)")
+    print(f"lexical load   : {load_s * 1000:8.2f} ms (full), {refresh_s * 1000:.2f} ms (after +{args.refresh} chunks)")
+    print(f"dense search   : {dense_ms:8.3f} ms/query (IndexFlatL2)")
+    print(f"lexical search : {lexical_ms:8.3f} ms/query")
+    print(f"fusion         : {fuse_ms:8.3f} ms/query")
+    print(f"overhead       : {100 * (lexical_ms + fuse_ms) / dense_ms:8.1f}% of the dense search")
+    print(f"exact invoice id at rank 1: {hits}/{sum('INV-' in q for q in text_queries)}")
+
+
+if __name__ == "__main__":
+    main()
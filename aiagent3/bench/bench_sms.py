@@ -0,0 +1,67 @@
+# bench/bench_sms.py
+# Old per-message requests.post vs the SMS dispatcher, against bench/fake_twilio.py.
+# Run from aiagent3/:  python -m bench.bench_sms --messages 200 --rate 50 --fail-rate 0.1
+import argparse
+import os
+import time
+
+from bench.fake_twilio import FakeTwilio
+
+
+def old_send(base_url: str, n: int):
+    import requests
+    url = f"{base_url}/2010-04-01/Accounts/AC_bench/Messages.json"
+    t0 = time.perf_counter()
+    for i in range(n):
+        requests.post(url, data={"From": "+15550000000", "To": "+15551234567", "Body": f"msg {i}"},
+                      auth=("AC_bench", "token"))
+    return time.perf_counter() - t0
+
+
+def dispatcher_send(n: int, rate: float, workers: int):
+    from app.sms import SmsDispatcher
+    dispatcher = SmsDispatcher(workers=workers, queue_size=n, rate=rate, burst=1)
+    t0 = time.perf_counter()
+    ids = [dispatcher.submit("+15551234567", f"msg {i}") for i in range(n)]
+    submit_s = time.perf_counter() - t0
+    while True:
+        statuses = [dispatcher.status(i)["status"] for i in ids]
+        if all(s in ("sent", "failed", "unknown") for s in statuses):
+            break
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - t0
+    dispatcher.close()
+    return submit_s, elapsed, statuses.count("sent"), dispatcher.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=50, help="dispatcher messages/s")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    plain = FakeTwilio(latency_ms=args.latency_ms).start()
+    elapsed = old_send(plain.base_url, args.messages)
+    print(f"requests.post per message : {args.messages / elapsed:7.1f} msg/s  "
+          f"{plain.connections} connections, blocks the caller {1000 * elapsed / args.messages:.1f} ms/msg")
+
+    flaky = FakeTwilio(latency_ms=args.latency_ms, fail_rate=args.fail_rate).start()
+    # app.sms reads its settings at import
+    os.environ.update(TWILIO_API_BASE=flaky.base_url, TWILIO_ACCOUNT_SID="AC_bench",
+                      TWILIO_AUTH_TOKEN="token", TWILIO_PHONE_NUMBER="+15550000000",
+                      SMS_RETRY_BACKOFF="0.05")
+    submit_s, elapsed, sent, stats = dispatcher_send(args.messages, args.rate, args.workers)
+    times = [t for t, _ in flaky.messages]
+    achieved = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 else 0.0
+    print(f"dispatcher ({args.workers} workers)     : {sent / elapsed:7.1f} msg/s  "
+          f"{flaky.connections} connections, submit {1e6 * submit_s / args.messages:.1f} us/msg")
+    print(f"  rate limit {args.rate:.0f}/s -> delivered at {achieved:.1f}/s; "
+          f"{sent}/{args.messages} sent, {stats['retried']} retries, {stats['failed']} failed "
+          f"(fail rate {args.fail_rate:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# bench/fake_twilio.py
+# Local stand-in for the Twilio Messages API, for benchmarks and manual tests.
+# Run from aiagent3/:  python -m bench.fake_twilio --port 8013 --fail-rate 0.1
+# then start the app with TWILIO_API_BASE=http://127.0.0.1:8013
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class FakeTwilio(ThreadingHTTPServer):
+    """
+    Accepts POST /2010-04-01/Accounts/{sid}/Messages.json and answers like
+    Twilio (201 + JSON with a sid). fail_rate of requests get a 503 and
+    throttle_rate a 429 with Retry-After. Counts connections and messages
+    so callers can check keep-alive reuse.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency_ms: float = 20, fail_rate: float = 0.0,
+                 throttle_rate: float = 0.0, seed: int = 0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency_ms / 1000
+        self.fail_rate = fail_rate
+        self.throttle_rate = throttle_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []  # (time, form) of accepted messages
+        self.rejected = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True, name="fake-twilio").start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body: dict, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+        form = {k: v[0] for k, v in form.items()}
+        time.sleep(self.server.latency)
+        if not self.path.endswith("/Messages.json") or not self.headers.get("Authorization"):
+            return self._reply(404, {"message": "not found"})
+        with self.server.lock:
+            roll = self.server.rng.random()
+            if roll < self.server.throttle_rate:
+                self.server.rejected += 1
+                return self._reply(429, {"code": 20429, "message": "Too Many Requests"}, {"Retry-After": "1"})
+            if roll < self.server.throttle_rate + self.server.fail_rate:
+                self.server.rejected += 1
+                return self._reply(503, {"message": "Service Unavailable"})
+            self.server.messages.append((time.monotonic(), form))
+        self._reply(201, {"sid": "SM" + uuid.uuid4().hex, "status": "queued", "to": form.get("To")})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8013)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeTwilio(args.port, args.latency_ms, args.fail_rate, args.throttle_rate)
+    print(f"fake Twilio on {server.base_url}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# bench/hash_embedder.py
+# Offline stand-in for the MiniLM model: a feature-hashed bag of words, so
+# benchmarks run without downloading weights. Texts sharing words get
+# similar vectors, which is enough to exercise retrieval end to end.
+# Use with EMBED_BACKEND=bench.hash_embedder:load (run from aiagent3/).
+import os
+import re
+import time
+import zlib
+import numpy as np
+
+EMBED_DIM = 384
+# Simulated model cost, to keep CPU-bound embedding in the picture
+HASH_EMBED_US_PER_CHAR = float(os.getenv("HASH_EMBED_US_PER_CHAR", "0"))
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+class HashEmbedder:
+    def __init__(self, dim: int = EMBED_DIM, us_per_char: float = HASH_EMBED_US_PER_CHAR):
+        self.dim = dim
+        self.us_per_char = us_per_char
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _embed(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype="float32")
+        for token in _TOKEN.findall(text.lower()):
+            h = zlib.crc32(token.encode())
+            vec[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def encode(self, texts, batch_size: int = None, **kwargs):
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        if self.us_per_char:
+            time.sleep(self.us_per_char * sum(len(t) for t in batch) / 1e6)
+        out = np.stack([self._embed(t) for t in batch]) if batch else np.empty((0, self.dim), dtype="float32")
+        return out[0] if single else out
+
+
+def load(model_name: str) -> HashEmbedder:
+    return HashEmbedder()
@@ -0,0 +1,123 @@
+# bench/stub_llm.py
+# Local OpenAI-compatible chat completions endpoint with configurable
+# latency, standing in for OpenRouter in benchmarks and manual tests.
+# Run from aiagent3/:  python -m bench.stub_llm --port 8012 --latency-ms 300
+# then start the app with LLM_BASE_URL=http://127.0.0.1:8012/v1
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = ("The documents describe the requested terms in detail. "
+          "Payment is due within thirty days of the invoice. "
+          "Either party may terminate with written notice.")
+
+
+class StubLLM(ThreadingHTTPServer):
+    """
+    POST .../chat/completions. A plain request is answered after
+    latency_ms (+/- jitter); a streamed one sends its first token after
+    latency_ms, then one word every token_ms. error_rate of requests get
+    a 503, which the app's client retries.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency_ms: float = 300, token_ms: float = 10,
+                 jitter: float = 0.2, error_rate: float = 0.0, seed: int = 0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency_ms / 1000
+        self.token_delay = token_ms / 1000
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True, name="stub-llm").start()
+        return self
+
+    def delay(self) -> float:
+        with self.lock:
+            return max(0.0, self.latency * (1 + self.rng.uniform(-self.jitter, self.jitter)))
+
+    def fail(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            failed = self.rng.random() < self.error_rate
+            self.errors += failed
+            return failed
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, text: str):
+        data = text.encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            return self._json(404, {"error": {"message": "not found"}})
+        if self.server.fail():
+            return self._json(503, {"error": {"message": "stub overloaded"}})
+        model = body.get("model", "stub")
+        time.sleep(self.server.delay())
+
+        if not body.get("stream"):
+            return self._json(200, {
+                "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": ANSWER}, "finish_reason": "stop"}],
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, word in enumerate(ANSWER.split(" ")):
+            if i:
+                time.sleep(self.server.token_delay)
+            event = {
+                "id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+            }
+            self._chunk(f"data: {json.dumps(event)}\n\n")
+        self._chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8012)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = StubLLM(args.port, args.latency_ms, args.token_ms, error_rate=args.error_rate)
+    print(f"stub LLM on {server.base_url}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
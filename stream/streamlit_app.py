@@ -1,3 +1,4 @@
+import json
 import streamlit as st
 import requests
 from dotenv import load_dotenv
@@ -120,18 +121,24 @@ def upload_document(file):
         # -------------------------
         # Polling backend for completion
         # -------------------------
-        chunks_path_check = f"{API_BASE}/ingest/status/{st.session_state['logged_in_user']}"  # must match user_id
+        job_url = f"{API_BASE}/ingest/jobs/{res.json()['job_id']}"
         import time
 
-        with st.spinner("Waiting for processing to complete..."):
-            for i in range(30):  # poll up to 30 times (~30 sec)
-                status_res = requests.get(chunks_path_check, headers=headers, timeout=5)
-                if status_res.status_code == 200 and status_res.json().get("status") == "completed":
+        progress_bar = st.progress(0, text="Waiting for processing to complete...")
+        for i in range(60):  # poll up to 60 times (~60 sec)
+            status_res = requests.get(job_url, headers=headers, timeout=5)
+            if status_res.status_code == 200:
+                job = status_res.json()
+                progress_bar.progress(int(job["progress"]), text=f"Processing... {job['progress']:.0f}%")
+                if job["status"] == "completed":
                     st.success("✅ Processing completed!")
                     break
-                time.sleep(1)
-            else:
-                st.info("⏳ Processing still ongoing. You can continue using the app.")
+                if job["status"] == "failed":
+                    st.error(f"❌ Processing failed: {job.get('error')}")
+                    break
+            time.sleep(1)
+        else:
+            st.info("⏳ Processing still ongoing. You can continue using the app.")
 
     except requests.exceptions.RequestException as e:
         st.error("🔥 Upload exception (requests)")
@@ -141,6 +148,50 @@ def upload_document(file):
         st.exception(e)
 
 
+def list_documents():
+    headers = get_auth_headers()
+    try:
+        res = requests.get(f"{API_BASE}/documents", headers=headers, timeout=10)
+    except requests.exceptions.RequestException as e:
+        st.error(f"❌ Could not load documents: {e}")
+        return
+    if res.status_code != 200:
+        st.error(f"❌ Could not load documents ({res.status_code})")
+        return
+
+    docs = res.json()["documents"]
+    if not docs:
+        st.caption("No documents yet.")
+    for doc in docs:
+        col_name, col_info, col_delete = st.columns([4, 2, 1])
+        col_name.write(f"📄 {doc['name']}")
+        col_info.caption(f"{doc['chunks']} chunks · {doc['status']}")
+        if col_delete.button("Delete", key=f"delete-{doc['doc_id']}"):
+            res = requests.delete(f"{API_BASE}/documents/{doc['doc_id']}", headers=headers, timeout=10)
+            if res.status_code == 200:
+                st.rerun()
+            st.error(f"❌ Delete failed ({res.status_code})")
+
+
+
+def read_answer_stream(res, sources: list):
+    """
+    Yield answer tokens from the /query SSE stream; retrieval sources are
+    collected into `sources` as they arrive.
+    """
+    event = None
+    for line in res.iter_lines(decode_unicode=True):
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            data = json.loads(line[len("data: "):])
+            if event == "retrieval":
+                sources.extend(data["sources"])
+            elif event == "token":
+                yield data["text"]
+            elif event == "error":
+                yield data["detail"]
+
 
 def ask_question(query: str, sms_number: str | None):
     headers = get_auth_headers()
@@ -148,7 +199,7 @@ def ask_question(query: str, sms_number: str | None):
         st.error("❌ Not authenticated")
         return
 
-    payload = {"query": query}
+    payload = {"query": query, "stream": True}
     if sms_number:
         payload["send_sms_to"] = sms_number
 
@@ -158,7 +209,8 @@ def ask_question(query: str, sms_number: str | None):
                 f"{API_BASE}/query",
                 json=payload,
                 headers=headers,
-                timeout=60  # increased timeout
+                timeout=60,  # increased timeout
+                stream=True  # answer arrives as Server-Sent Events
             )
 
         if res.status_code != 200:
@@ -173,10 +225,20 @@ def ask_question(query: str, sms_number: str | None):
             return
 
         st.subheader("AI Answer")
-        st.write(res.json()["answer"])
+        sources = []
+        if res.headers.get("content-type", "").startswith("text/event-stream"):
+            st.write_stream(read_answer_stream(res, sources))
+        else:
+            # Nothing to retrieve from (e.g. no documents yet): plain JSON
+            st.write(res.json()["answer"])
+            sources = res.json().get("sources") or []
+
+        if sources:
+            cited = sorted({f"{s['source']} p.{s['page']}" if s["page"] else s["source"] for s in sources})
+            st.caption("Sources: " + ", ".join(cited))
 
         if sms_number:
-            st.success(f"📩 Answer summary sent via SMS to {sms_number}")
+            st.success(f"📩 Answer summary queued for SMS to {sms_number}")
 
     except requests.exceptions.RequestException as e:
         st.error("🔥 Query exception (requests)")
@@ -223,6 +285,9 @@ else:
         if st.button("Upload"):
             upload_document(file)
 
+    st.subheader("Your Documents")
+    list_documents()
+
     st.subheader("Ask a Question")
     query = st.text_input("Your question")
     sms_number = st.text_input("Send summary via SMS (optional)")